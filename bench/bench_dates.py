@@ -0,0 +1,120 @@
+"""Compare les requêtes d'échéance sur l'ancien schéma (JJ/MM/AAAA, sans index)
+et sur le schéma migré (AAAA-MM-JJ + index composites).
+
+Usage : python -m bench.bench_dates [nb_relances]
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from database import Database
+
+# Schéma d'origine, avant toute migration
+ANCIEN_SCHEMA = '''
+    CREATE TABLE clients (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, nom TEXT NOT NULL, telephone TEXT, email TEXT,
+        source TEXT, type_demande TEXT, destination TEXT, statut TEXT DEFAULT 'en_cours',
+        date_creation TIMESTAMP, agent_id INTEGER
+    );
+    CREATE TABLE relances (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, client_id INTEGER, date_relance TEXT,
+        type_relance TEXT, priorite TEXT DEFAULT 'moyenne', statut TEXT DEFAULT 'programmee',
+        notes TEXT, date_creation TIMESTAMP, date_effectuee TIMESTAMP, resultat TEXT
+    );
+'''
+
+
+def generer_ancienne_base(chemin, nb_relances, nb_clients):
+    conn = sqlite3.connect(chemin)
+    conn.executescript(ANCIEN_SCHEMA)
+    conn.executemany('INSERT INTO clients (id, nom) VALUES (?, ?)',
+                     ((i, f'Client {i}') for i in range(1, nb_clients + 1)))
+    aujourd_hui = date.today()
+    rnd = random.Random(42)
+
+    def lignes():
+        for _ in range(nb_relances):
+            jour = aujourd_hui + timedelta(days=rnd.randint(-730, 365))
+            statut = 'programmee' if rnd.random() < 0.3 else 'effectuee'
+            yield rnd.randint(1, nb_clients), jour.strftime('%d/%m/%Y'), statut
+
+    conn.executemany('INSERT INTO relances (client_id, date_relance, statut) VALUES (?, ?, ?)', lignes())
+    conn.commit()
+    conn.close()
+
+
+def chronometrer(fonction, repetitions=5):
+    meilleur = None
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        resultat = fonction()
+        duree = time.perf_counter() - debut
+        meilleur = duree if meilleur is None else min(meilleur, duree)
+    return meilleur, resultat
+
+
+def requetes_anciennes(conn):
+    # Reproduction exacte des requêtes avant migration (comparaison de texte JJ/MM/AAAA)
+    aujourd_hui = date.today()
+    jour = aujourd_hui.strftime('%d/%m/%Y')
+    limite = (aujourd_hui + timedelta(days=7)).strftime('%d/%m/%Y')
+    return {
+        'du_jour': lambda: conn.execute(
+            "SELECT r.*, c.nom FROM relances r JOIN clients c ON r.client_id = c.id "
+            "WHERE r.date_relance = ? AND r.statut = 'programmee'", (jour,)).fetchall(),
+        'en_retard': lambda: conn.execute(
+            "SELECT r.*, c.nom FROM relances r JOIN clients c ON r.client_id = c.id "
+            "WHERE r.date_relance < ? AND r.statut = 'programmee' ORDER BY r.date_relance ASC", (jour,)).fetchall(),
+        'a_venir': lambda: conn.execute(
+            "SELECT r.*, c.nom FROM relances r JOIN clients c ON r.client_id = c.id "
+            "WHERE r.date_relance BETWEEN ? AND ? AND r.statut = 'programmee' ORDER BY r.date_relance ASC",
+            (jour, limite)).fetchall(),
+    }
+
+
+def requetes_nouvelles(db):
+    return {
+        'du_jour': db.get_relances_du_jour,
+        'en_retard': db.get_relances_en_retard,
+        'a_venir': lambda: db.get_relances_a_venir(7),
+    }
+
+
+def plan(conn, sql, params):
+    return ' | '.join(ligne[-1] for ligne in conn.execute('EXPLAIN QUERY PLAN ' + sql, params))
+
+
+def main():
+    nb_relances = int(sys.argv[1]) if len(sys.argv) > 1 else 300_000
+    nb_clients = max(1, nb_relances // 10)
+    with tempfile.TemporaryDirectory() as dossier:
+        chemin = os.path.join(dossier, 'bench.db')
+        print(f"Génération de {nb_relances} relances / {nb_clients} clients...")
+        generer_ancienne_base(chemin, nb_relances, nb_clients)
+
+        conn = sqlite3.connect(chemin)
+        anciens = {nom: chronometrer(f) for nom, f in requetes_anciennes(conn).items()}
+        conn.close()
+
+        debut = time.perf_counter()
+        db = Database(chemin)
+        print(f"Migration : {time.perf_counter() - debut:.2f} s")
+        nouveaux = {nom: chronometrer(f) for nom, f in requetes_nouvelles(db).items()}
+
+        print(f"\n{'requête':<12}{'avant (ms)':>12}{'lignes':>10}{'après (ms)':>12}{'lignes':>10}")
+        for nom in anciens:
+            (t_a, r_a), (t_n, r_n) = anciens[nom], nouveaux[nom]
+            print(f"{nom:<12}{t_a * 1000:>12.2f}{len(r_a):>10}{t_n * 1000:>12.2f}{len(r_n):>10}")
+
+        aujourd_hui = date.today().isoformat()
+        print("\nPlan en_retard :",
+              plan(db.conn, "SELECT id FROM relances WHERE statut = 'programmee' AND date_relance < ?", (aujourd_hui,)))
+        db.fermer()
+
+
+if __name__ == '__main__':
+    main()
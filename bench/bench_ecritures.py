@@ -0,0 +1,58 @@
+"""Débit d'insertion : mode classique (un commit par écriture) contre WAL avec
+écrivain unique et group commit.
+
+Usage : python -m bench.bench_ecritures [nb_insertions] [nb_agents_concurrents]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from database import Database
+from database_async import AsyncDatabase
+
+
+def inserer_sync(chemin, mode, nb):
+    db = Database(chemin, mode=mode)
+    debut = time.perf_counter()
+    for i in range(nb):
+        db.ajouter_client(f'Client {i}', telephone='0600000000')
+    duree = time.perf_counter() - debut
+    db.fermer()
+    return nb / duree
+
+
+async def inserer_async(chemin, mode, nb, concurrents, fenetre_ms):
+    db = AsyncDatabase(chemin, mode=mode, fenetre_commit_ms=fenetre_ms)
+
+    async def agent(numero):
+        for i in range(numero, nb, concurrents):
+            await db.ajouter_client(f'Client {i}', telephone='0600000000')
+
+    debut = time.perf_counter()
+    await asyncio.gather(*(agent(n) for n in range(concurrents)))
+    duree = time.perf_counter() - debut
+    db.fermer()
+    return nb / duree
+
+
+def main():
+    nb = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    concurrents = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    scenarios = [
+        ('classique, synchrone (avant)', lambda c: inserer_sync(c, 'classique', nb)),
+        ('wal, synchrone', lambda c: inserer_sync(c, 'wal', nb)),
+        (f'classique, async x{concurrents}', lambda c: asyncio.run(inserer_async(c, 'classique', nb, concurrents, 0))),
+        (f'wal, async x{concurrents}', lambda c: asyncio.run(inserer_async(c, 'wal', nb, concurrents, 0))),
+        (f'wal, async x{concurrents}, fenêtre 5 ms', lambda c: asyncio.run(inserer_async(c, 'wal', nb, concurrents, 5))),
+    ]
+    print(f"{nb} insertions\n")
+    for nom, scenario in scenarios:
+        with tempfile.TemporaryDirectory() as dossier:
+            debit = scenario(os.path.join(dossier, 'bench.db'))
+        print(f"{nom:<40}{debit:>10.0f} insertions/s")
+
+
+if __name__ == '__main__':
+    main()
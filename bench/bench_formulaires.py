@@ -0,0 +1,98 @@
+"""Surcoût de l'aiguillage des messages texte : chaîne if/elif de 12 étapes
+(ancien handle_message) contre accès direct à ETAPES, puis coût complet
+d'une étape de formulaire (validation + réponse), sans réseau.
+
+Usage : python -m bench.bench_formulaires [iterations]
+"""
+import asyncio
+import importlib
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+os.chdir(tempfile.mkdtemp())
+os.environ.setdefault('TOKEN', '123456:bench')
+
+from formulaires import ETAPES, traiter_saisie  # noqa: E402
+
+# Les formulaires sont déclarés à l'import du bot : ETAPES est rempli ici
+importlib.import_module('main')
+
+ANCIENNES_ETAPES = ['nom', 'telephone', 'email', 'source', 'type_demande', 'destination', 'recherche',
+                    'date_precise', 'nb_jours_avant', 'date_reference', 'nouvel_admin_id', 'nouvel_admin_nom']
+
+
+def chaine_if(etape):
+    """Réplique de l'ancien aiguillage (renvoie le numéro de branche)"""
+    if etape == 'nom':
+        return 0
+    elif etape == 'telephone':
+        return 1
+    elif etape == 'email':
+        return 2
+    elif etape == 'source':
+        return 3
+    elif etape == 'type_demande':
+        return 4
+    elif etape == 'destination':
+        return 5
+    elif etape == 'recherche':
+        return 6
+    elif etape == 'date_precise':
+        return 7
+    elif etape == 'nb_jours_avant':
+        return 8
+    elif etape == 'date_reference':
+        return 9
+    elif etape == 'nouvel_admin_id':
+        return 10
+    elif etape == 'nouvel_admin_nom':
+        return 11
+    return None
+
+
+def chronometrer(fonction, valeurs, iterations):
+    debut = time.perf_counter()
+    for _ in range(iterations):
+        for valeur in valeurs:
+            fonction(valeur)
+    return (time.perf_counter() - debut) / (iterations * len(valeurs)) * 1e9
+
+
+class Message:
+    def __init__(self):
+        self.text = ''
+
+    async def reply_text(self, *args, **kwargs):
+        pass
+
+
+async def etape_complete(iterations):
+    """Une saisie de l'étape 'email' (facultative) : aiguillage, stockage,
+    passage à l'étape suivante et réponse (factice)"""
+    message = Message()
+    update = SimpleNamespace(message=message)
+    context = SimpleNamespace(user_data={})
+    debut = time.perf_counter()
+    for i in range(iterations):
+        context.user_data['etape'] = 'email'
+        message.text = 'skip' if i % 2 else 'client@exemple.fr'
+        await traiter_saisie(update, context)
+    return (time.perf_counter() - debut) / iterations * 1e9
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    print(f"{len(ETAPES)} étapes déclarées\n")
+    for nom, valeurs in [('première étape', ['nom']), ('dernière étape', ['nouvel_admin_nom']),
+                         ('toutes les étapes', ANCIENNES_ETAPES)]:
+        avant = chronometrer(chaine_if, valeurs, iterations)
+        apres = chronometrer(ETAPES.get, valeurs, iterations)
+        print(f"{nom:<20} if/elif {avant:>7.1f} ns   dict {apres:>7.1f} ns")
+    print(f"\nétape complète (traiter_saisie)  {asyncio.run(etape_complete(iterations)):>7.0f} ns")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Latence de recherche client : LIKE '%x%' sur trois colonnes (avant) contre
+index FTS5 + téléphone normalisé (après), pour des tables de tailles croissantes.
+
+Usage : python -m bench.bench_recherche [taille1 taille2 ...]   (défaut : 10000 100000)
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+from database import Database, normaliser_telephone
+
+PRENOMS = ['Jean', 'Marie', 'Pierre', 'Sophie', 'Luc', 'Camille', 'Nadia', 'Karim', 'Julie', 'Hugo']
+NOMS = ['Martin', 'Bernard', 'Dubois', 'Thomas', 'Robert', 'Richard', 'Petit', 'Durand', 'Leroy', 'Moreau']
+DESTINATIONS = ['Martinique', 'Guadeloupe', 'Crète', 'Maroc', 'Bali', 'Islande', 'Japon', 'Canada']
+SOURCES = ['Instagram', 'Site web', 'Salon', 'Bouche à oreille', 'Facebook']
+RECHERCHES = ['martin', 'sophie dubois', 'crete', 'inst', '0612', '4567', 'zzzz']
+
+
+def remplir(db, nb, rnd):
+    def lignes():
+        for i in range(nb):
+            nom = f'{rnd.choice(PRENOMS)} {rnd.choice(NOMS)} {i}'
+            tel = f'06{rnd.randint(0, 99999999):08d}'
+            yield (nom, tel, f'client{i}@exemple.fr', rnd.choice(SOURCES), rnd.choice(DESTINATIONS),
+                   normaliser_telephone(tel), normaliser_telephone(tel)[::-1])
+
+    with db.transaction():
+        db.c.executemany('''
+            INSERT INTO clients (nom, telephone, email, source, destination, telephone_normalise, telephone_inverse)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', lignes())
+
+
+def ancienne_recherche(db, recherche):
+    db.c.execute('''
+        SELECT * FROM clients WHERE nom LIKE ? OR telephone LIKE ? OR email LIKE ?
+        ORDER BY date_creation DESC
+    ''', (f'%{recherche}%',) * 3)
+    return db.c.fetchall()
+
+
+def chronometrer(fonction, repetitions=5):
+    durees = []
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        resultat = fonction()
+        durees.append(time.perf_counter() - debut)
+    return min(durees) * 1000, len(resultat)
+
+
+def main():
+    tailles = [int(x) for x in sys.argv[1:]] or [10_000, 100_000]
+    print(f"{'clients':>9}  {'recherche':<15}{'avant (ms)':>11}{'lignes':>8}{'après (ms)':>11}{'lignes':>8}")
+    for taille in tailles:
+        with tempfile.TemporaryDirectory() as dossier:
+            db = Database(os.path.join(dossier, 'bench.db'))
+            remplir(db, taille, random.Random(7))
+            for recherche in RECHERCHES:
+                t_a, n_a = chronometrer(lambda: ancienne_recherche(db, recherche))
+                t_n, n_n = chronometrer(lambda: db.rechercher_clients(recherche))
+                print(f"{taille:>9}  {recherche:<15}{t_a:>11.2f}{n_a:>8}{t_n:>11.2f}{n_n:>8}")
+            db.fermer()
+
+
+if __name__ == '__main__':
+    main()
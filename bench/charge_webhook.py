@@ -0,0 +1,129 @@
+"""Générateur de charge pour le mode webhook, entièrement hors ligne.
+
+Le bot est démarré en mode webhook sur 127.0.0.1 avec une fausse API Bot en
+mémoire (aucun appel à Telegram) ; des mises à jour JSON sont postées sur
+l'endpoint avec le secret, chaque utilisateur simulé attendant la fin du
+traitement de sa mise à jour avant d'envoyer la suivante. Mesure le débit
+(mises à jour/s) et la latence des handlers (réception HTTP -> fin du
+handler), p50 / p99.
+
+Usage : python -m bench.charge_webhook [nb_utilisateurs] [tours] [fichier.jsonl]
+
+Avec un fichier, chaque ligne est une Update enregistrée (JSON brut de
+l'API Bot) ; sinon un scénario synthétique est généré (création de client,
+consultation des listes et des statistiques).
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+# Répertoire de lancement : le fichier rejoué est relatif à celui-ci
+LANCEMENT = os.getcwd()
+os.chdir(tempfile.mkdtemp())
+os.environ.setdefault('TOKEN', '123456:charge')
+os.environ.setdefault('ADMIN_IDS', '1')
+os.environ['MODE'] = 'webhook'
+os.environ.setdefault('WEBHOOK_SECRET', 'secret-charge')
+
+import httpx  # noqa: E402
+from telegram import Update  # noqa: E402
+from telegram.ext import TypeHandler  # noqa: E402
+
+import main as bot  # noqa: E402
+from bench.outils_bot import FausseApiBot, message, scenario  # noqa: E402
+from envoi import Expediteur  # noqa: E402
+
+PORT = int(os.environ.get('PORT_CHARGE', '8787'))
+
+
+def lire_fichier(chemin):
+    """Regroupe les Updates enregistrées par utilisateur, dans l'ordre du fichier"""
+    par_utilisateur = {}
+    with open(chemin, encoding='utf-8') as f:
+        for ligne in f:
+            if ligne.strip():
+                donnees = json.loads(ligne)
+                corps = donnees.get('message') or donnees.get('callback_query') or {}
+                utilisateur = corps.get('from', {}).get('id', 0)
+                par_utilisateur.setdefault(utilisateur, []).append(donnees)
+    return par_utilisateur
+
+
+def centile(valeurs, p):
+    valeurs = sorted(valeurs)
+    return valeurs[min(len(valeurs) - 1, int(len(valeurs) * p / 100))] if valeurs else 0
+
+
+async def charger(sequences):
+    api = FausseApiBot()
+    # On mesure le bot, pas les limites de Telegram : expéditeur sans plafond
+    bot.expediteur = Expediteur(debit_global=1e6, debit_chat=1e6, capacite_chat=1e6,
+                                debit_groupe=1e6, capacite_groupe=1e6)
+    app = bot.construire_application(requete=api)
+    recues = {}
+    en_cours = {}
+
+    async def fin_traitement(update, context):
+        futur = en_cours.pop(update.update_id, None)
+        if futur is not None:
+            futur.set_result(time.perf_counter() - recues.pop(update.update_id))
+
+    # Groupe 1 : exécuté après le handler du groupe 0, pour la même mise à jour
+    app.add_handler(TypeHandler(Update, fin_traitement), group=1)
+
+    url = f'http://127.0.0.1:{PORT}/{bot.WEBHOOK_CHEMIN}'
+    entetes = {'X-Telegram-Bot-Api-Secret-Token': bot.WEBHOOK_SECRET}
+    latences = []
+
+    async with app:
+        await app.updater.start_webhook(listen='127.0.0.1', port=PORT, url_path=bot.WEBHOOK_CHEMIN,
+                                        secret_token=bot.WEBHOOK_SECRET)
+        await app.start()
+        async with httpx.AsyncClient(timeout=30) as client:
+            refus = await client.post(url, json=message(1, 'intrus'),
+                                      headers={'X-Telegram-Bot-Api-Secret-Token': 'mauvais'})
+            print(f"Secret invalide : HTTP {refus.status_code}")
+
+            async def utilisateur(updates):
+                for donnees in updates:
+                    futur = asyncio.get_running_loop().create_future()
+                    en_cours[donnees['update_id']] = futur
+                    recues[donnees['update_id']] = time.perf_counter()
+                    reponse = await client.post(url, json=donnees, headers=entetes)
+                    reponse.raise_for_status()
+                    latences.append(await asyncio.wait_for(futur, 30))
+
+            debut = time.perf_counter()
+            await asyncio.gather(*(utilisateur(updates) for updates in sequences))
+            duree = time.perf_counter() - debut
+        await app.updater.stop()
+        await app.stop()
+    bot.db.fermer()
+
+    print(f"{len(latences)} mises à jour, {len(sequences)} utilisateurs, {api.appels} appels API")
+    print(f"débit         {len(latences) / duree:>10.0f} mises à jour/s")
+    print(f"latence p50   {centile(latences, 50) * 1000:>10.1f} ms")
+    print(f"latence p99   {centile(latences, 99) * 1000:>10.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('nb_utilisateurs', type=int, nargs='?', default=50,
+                        help="utilisateurs simulés en parallèle (scénario synthétique)")
+    parser.add_argument('tours', type=int, nargs='?', default=5,
+                        help="répétitions du scénario par utilisateur")
+    parser.add_argument('fichier', nargs='?',
+                        help="fichier JSONL d'Updates enregistrées à rejouer à la place du scénario")
+    options = parser.parse_args()
+    if options.fichier:
+        sequences = list(lire_fichier(os.path.join(LANCEMENT, options.fichier)).values())
+    else:
+        sequences = [list(scenario(1000 + u, options.tours)) for u in range(options.nb_utilisateurs)]
+    asyncio.run(charger(sequences))
+
+
+if __name__ == '__main__':
+    main()
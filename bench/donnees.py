@@ -0,0 +1,146 @@
+"""Jeu de données synthétique d'une agence, inséré avec le vrai schéma de
+Database : agents, clients, relances (passées, du jour, à venir), règles
+récurrentes et historique. Reproductible (graine fixe).
+
+Usage : python -m bench.donnees chemin.db [echelle]
+"""
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+from database import Database, normaliser_telephone, occurrence_suivante
+
+PRENOMS = ['Jean', 'Marie', 'Pierre', 'Sophie', 'Luc', 'Camille', 'Nadia', 'Karim', 'Julie', 'Hugo',
+           'Inès', 'Léo', 'Chloé', 'Mehdi', 'Emma', 'Noah']
+NOMS = ['Martin', 'Bernard', 'Dubois', 'Thomas', 'Robert', 'Richard', 'Petit', 'Durand', 'Leroy', 'Moreau',
+        'Fontaine', 'Garcia', 'Roux', 'Faure', 'Mercier', 'Nguyen']
+DESTINATIONS = ['Martinique', 'Guadeloupe', 'Crète', 'Maroc', 'Bali', 'Islande', 'Japon', 'Canada',
+                'Lisbonne', 'New York', 'Réunion', 'Sénégal']
+SOURCES = ['Instagram', 'Site web', 'Salon', 'Bouche à oreille', 'Facebook', 'Import']
+DEMANDES = ['Séjour', 'Circuit', 'Croisière', 'Vol sec', 'Voyage de noces']
+STATUTS = ['en_cours'] * 6 + ['converti'] * 2 + ['perdu']
+ACTIONS = [('création', 'Client créé'), ('relance ajoutée', 'Relance programmée'),
+           ('relance effectuée', 'Relance effectuée'), ('appel', 'Appel sortant'),
+           ('devis', 'Devis envoyé'), ('statut', 'Statut modifié')]
+
+# Volumes de référence (echelle = 1)
+VOLUMES = {'agents': 200, 'clients': 100_000, 'relances': 1_000_000, 'historique': 5_000_000}
+TAILLE_LOT = 50_000
+
+
+def volumes(echelle=1.0, **forces):
+    """Volumes à l'échelle donnée ; `forces` remplace un volume précis"""
+    resultat = {nom: max(1, int(nb * echelle)) for nom, nb in VOLUMES.items()}
+    resultat.update({nom: nb for nom, nb in forces.items() if nb is not None})
+    return resultat
+
+
+def _par_lots(db, requete, lignes):
+    lot = []
+    for ligne in lignes:
+        lot.append(ligne)
+        if len(lot) >= TAILLE_LOT:
+            with db.transaction():
+                db.c.executemany(requete, lot)
+            lot = []
+    if lot:
+        with db.transaction():
+            db.c.executemany(requete, lot)
+
+
+def generer(chemin, agents, clients, relances, historique, graine=2024, journal=print):
+    """Crée la base `chemin` et la remplit ; renvoie la durée par table (s)"""
+    hasard = random.Random(graine)
+    aujourd_hui = date.today()
+    maintenant = datetime.now()
+    db = Database(chemin)
+    durees = {}
+
+    def chrono(nom, requete, lignes):
+        debut = time.perf_counter()
+        _par_lots(db, requete, lignes)
+        durees[nom] = time.perf_counter() - debut
+        journal(f"  {nom:<11} {durees[nom]:>7.1f} s")
+
+    chrono('agents', 'INSERT INTO agents (nom, telegram_id, role) VALUES (?, ?, ?)',
+           ((f'Agent {a}', 100_000 + a, 'agent') for a in range(agents)))
+
+    def lignes_clients():
+        for i in range(clients):
+            tel = f'06{hasard.randint(0, 99_999_999):08d}'
+            normalise = normaliser_telephone(tel)
+            cree = maintenant - timedelta(days=hasard.randint(0, 730), seconds=hasard.randint(0, 86_399))
+            yield (f'{hasard.choice(PRENOMS)} {hasard.choice(NOMS)} {i}', tel, f'client{i}@exemple.fr',
+                   hasard.choice(SOURCES), hasard.choice(DEMANDES), hasard.choice(DESTINATIONS),
+                   hasard.choice(STATUTS), cree, hasard.randint(1, agents), normalise, normalise[::-1])
+
+    chrono('clients', '''
+        INSERT INTO clients (nom, telephone, email, source, type_demande, destination, statut, date_creation,
+                             agent_id, telephone_normalise, telephone_inverse)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', lignes_clients())
+
+    def lignes_relances():
+        for _ in range(relances):
+            # Un an d'échéances passées, deux mois à venir ; les passées sont surtout faites
+            decalage = hasard.randint(-365, 60)
+            echeance = aujourd_hui + timedelta(days=decalage)
+            faite = decalage < 0 and hasard.random() < 0.9
+            heure = f'{hasard.randint(8, 18):02d}:{hasard.choice((0, 15, 30, 45)):02d}' \
+                if hasard.random() < 0.1 else None
+            yield (hasard.randint(1, clients), echeance.isoformat(), hasard.choice(('date_precise', '7j avant')),
+                   'effectuee' if faite else 'programmee', '', maintenant,
+                   maintenant if faite else None, 'effectuee' if faite else None, heure)
+
+    chrono('relances', '''
+        INSERT INTO relances (client_id, date_relance, type_relance, statut, notes, date_creation, date_effectuee,
+                              resultat, heure_relance)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', lignes_relances())
+
+    def lignes_regles():
+        for _ in range(max(1, clients // 50)):
+            depart = aujourd_hui + timedelta(days=hasard.randint(10, 120))
+            if hasard.random() < 0.5:
+                intervalle, jalons = hasard.choice((3, 7, 14)), None
+            else:
+                intervalle, jalons = None, '30,15,7,1'
+            prochaine = occurrence_suivante(intervalle, jalons, aujourd_hui.isoformat(), depart.isoformat(),
+                                            aujourd_hui.isoformat())
+            yield (hasard.randint(1, clients), intervalle, jalons, aujourd_hui.isoformat(), depart.isoformat(),
+                   prochaine, maintenant)
+
+    chrono('regles', '''
+        INSERT INTO regles_relance (client_id, intervalle, jalons, date_debut, date_reference, prochaine_date,
+                                    date_creation)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', lignes_regles())
+
+    def lignes_historique():
+        for _ in range(historique):
+            action, details = hasard.choice(ACTIONS)
+            quand = maintenant - timedelta(days=hasard.randint(0, 730), seconds=hasard.randint(0, 86_399))
+            yield (hasard.randint(1, clients), action, details, quand, hasard.randint(1, agents))
+
+    chrono('historique', '''
+        INSERT INTO historique (client_id, action, details, date_action, agent_id)
+        VALUES (?, ?, ?, ?, ?)
+    ''', lignes_historique())
+
+    debut = time.perf_counter()
+    db.recalculer_priorites()
+    durees['finalisation'] = time.perf_counter() - debut
+    db.fermer()
+    return durees
+
+
+def main():
+    chemin = sys.argv[1]
+    echelle = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    print(f"Génération ({volumes(echelle)}) dans {chemin}")
+    generer(chemin, **volumes(echelle))
+
+
+if __name__ == '__main__':
+    main()
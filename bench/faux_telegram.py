@@ -0,0 +1,467 @@
+"""Faux serveur de l'API Bot Telegram, pour les essais de charge hors ligne.
+
+Le vrai bot (main.py, en polling) est lancé dans un sous-processus avec
+API_BOT_URL pointant sur ce serveur : getUpdates, sendMessage,
+editMessageText, answerCallbackQuery... sont servis localement, avec
+- une latence réglable (fixe + gigue aléatoire) sur chaque appel ;
+- des limites de débit à la Telegram (par conversation et globale) et des
+  réponses 429 injectées au hasard, avec retry_after ; les appels reçus
+  pendant une pause imposée, une fois le 429 reçu par le bot, sont comptés
+  (appels_pendant_pause : le bot devrait n'en faire aucun) ;
+- des agents simulés qui rejouent les parcours création de client et
+  relance (ajout pour aujourd'hui, liste du jour, marquée effectuée) :
+  chaque étape attend la réponse du bot avant la suivante, et les boutons
+  sont pris dans le dernier clavier reçu.
+
+Mesure le débit (étapes/s), la latence par étape (p50 / p99), les appels par
+méthode, le comportement face aux limites et la mémoire du bot (VmRSS).
+
+Usage : python -m bench.faux_telegram [--agents 100] [--tours 3] [--scenario relance]
+                                      [--latence-ms 30] [--gigue-ms 20] [--taux-429 0.01]
+                                      [--externe]
+Avec --externe, aucun bot n'est lancé : démarrer main.py avec
+API_BOT_URL=http://127.0.0.1:PORT et un TOKEN quelconque.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import random
+import signal
+import sys
+import tempfile
+import time
+from datetime import date
+from urllib.parse import parse_qsl, urlsplit
+
+from envoi import SeauJetons
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PREMIER_AGENT = 10_000
+
+# Étapes : (nom, genre, valeur, attendu). Un bouton dont la valeur se termine
+# par « _ » est cherché par préfixe dans le dernier clavier reçu ; `attendu`
+# est cherché dans le texte ou les boutons des messages envoyés ou modifiés
+# par le bot (None : n'importe quelle réponse).
+CREATION_CLIENT = [
+    ('menu', 'texte', '/start', 'GESTION DES RELANCES'),
+    ('nouveau_client', 'bouton', 'nouveau_client', 'nom complet'),
+    ('nom', 'texte', 'Client {agent}-{tour}', 'téléphone'),
+    ('telephone', 'texte', '07{agent:04d}{tour:04d}', 'email'),
+    ('email', 'texte', 'client{agent}.{tour}@exemple.fr', 'source'),
+    ('source', 'texte', 'Site web', 'type de demande'),
+    ('type_demande', 'texte', 'Séjour', 'destination'),
+    ('destination', 'texte', 'Lisbonne', 'ajouter_relance_'),
+]
+RELANCE = CREATION_CLIENT + [
+    ('ajouter_relance', 'bouton', 'ajouter_relance_', 'TYPE DE RELANCE'),
+    ('type_relance', 'bouton', 'type_relance_date', 'date précise'),
+    ('date', 'texte', '{aujourd_hui}', 'Relance ajoutée'),
+    ('retour_menu', 'bouton', 'menu_principal', 'GESTION DES RELANCES'),
+    ('relances_jour', 'bouton', 'relances_jour', 'marquer_relance_'),
+    # La liste est réaffichée sans la relance (message modifié)
+    ('marquer', 'bouton', 'marquer_relance_', None),
+]
+SCENARIOS = {'creation_client': CREATION_CLIENT, 'relance': RELANCE}
+
+# Méthodes qui écrivent dans une conversation : soumises aux limites de débit
+ENVOIS = {'sendMessage', 'editMessageText', 'editMessageReplyMarkup', 'sendDocument', 'sendPhoto'}
+ENTIERS = {'chat_id', 'message_id', 'offset', 'limit', 'timeout'}
+JSON = {'reply_markup', 'allowed_updates'}
+# Délai laissé au bot, après la réponse 429, pour prendre en compte la pause (s)
+TOLERANCE_PAUSE = 0.5
+
+
+def centile(valeurs, p):
+    valeurs = sorted(valeurs)
+    return valeurs[min(len(valeurs) - 1, int(len(valeurs) * p / 100))] if valeurs else 0
+
+
+def lire_parametres(entetes, corps, requete):
+    """Paramètres d'un appel : JSON, formulaire (HTTPXRequest de PTB) ou query string"""
+    type_corps = entetes.get('content-type', '')
+    if type_corps.startswith('application/json'):
+        return json.loads(corps or b'{}')
+    if type_corps.startswith('multipart/'):
+        # Envoi de fichier : le contenu n'est pas analysé
+        return {}
+    parametres = dict(parse_qsl(requete))
+    parametres.update(parse_qsl(corps.decode()))
+    for cle, valeur in parametres.items():
+        if cle in JSON:
+            parametres[cle] = json.loads(valeur)
+        elif cle in ENTIERS and valeur.lstrip('-').isdigit():
+            parametres[cle] = int(valeur)
+    return parametres
+
+
+class Conversation:
+    """Ce que l'agent simulé voit de sa conversation avec le bot"""
+
+    def __init__(self):
+        self.messages = {}
+        self.dernier_clavier = None
+        self.recus = []
+        self.signal = asyncio.Event()
+
+    def recevoir(self, message):
+        self.messages[message['message_id']] = message
+        if message.get('reply_markup'):
+            self.dernier_clavier = message['message_id']
+        self.recus.append(message)
+        self.signal.set()
+
+    def bouton(self, valeur):
+        """callback_data du dernier clavier qui correspond à `valeur`, et son message"""
+        message = self.messages.get(self.dernier_clavier)
+        if message is None:
+            return valeur, None
+        if valeur.endswith('_'):
+            for donnees in boutons(message):
+                if donnees.startswith(valeur):
+                    return donnees, message
+        return valeur, message
+
+
+def boutons(message):
+    clavier = (message.get('reply_markup') or {}).get('inline_keyboard', [])
+    return [b.get('callback_data', '') for ligne in clavier for b in ligne]
+
+
+def correspond(message, attendu):
+    return attendu is None or attendu in message.get('text', '') or any(attendu in b for b in boutons(message))
+
+
+class FauxTelegram:
+    def __init__(self, latence=0.03, gigue=0.02, taux_429=0.0, retry_after=2, debit_chat=1, rafale_chat=5,
+                 debit_global=30, rafale_global=40, graine=2024):
+        self.latence = latence
+        self.gigue = gigue
+        self.taux_429 = taux_429
+        self.retry_after = retry_after
+        self.hasard = random.Random(graine)
+        self._limites_chat = (debit_chat, rafale_chat)
+        self._seau_global = SeauJetons(debit_global, rafale_global) if debit_global else None
+        self._seaux_chat = {}
+        self.pause_jusqua = 0.0
+        self.pause_annoncee = math.inf
+        self.updates = []
+        self._nouvelles = asyncio.Event()
+        self._ids_update = itertools.count(1)
+        self._ids_message = itertools.count(1)
+        self.conversations = {}
+        self.premier_polling = asyncio.Event()
+        self.appels = {}
+        self.compteurs = {'429_injectes': 0, '429_limite_chat': 0, '429_limite_globale': 0,
+                          'appels_en_vol': 0, 'appels_pendant_pause': 0}
+
+    def conversation(self, chat_id):
+        conversation = self.conversations.get(chat_id)
+        if conversation is None:
+            conversation = self.conversations[chat_id] = Conversation()
+        return conversation
+
+    # ----- Côté agents simulés -----
+    def publier(self, contenu):
+        """Ajoute une mise à jour (message ou callback_query) pour le prochain getUpdates"""
+        update = {'update_id': next(self._ids_update), **contenu}
+        self.updates.append(update)
+        self._nouvelles.set()
+
+    def texte(self, agent, texte):
+        expediteur = {'id': agent, 'is_bot': False, 'first_name': f'Agent {agent}'}
+        contenu = {'message_id': next(self._ids_message), 'date': int(time.time()), 'text': texte,
+                   'chat': {'id': agent, 'type': 'private'}, 'from': expediteur}
+        if texte.startswith('/'):
+            contenu['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(texte.split()[0])}]
+        self.publier({'message': contenu})
+
+    def clic(self, agent, donnees, message):
+        expediteur = {'id': agent, 'is_bot': False, 'first_name': f'Agent {agent}'}
+        if message is None:
+            message = {'message_id': 0, 'date': int(time.time()), 'chat': {'id': agent, 'type': 'private'}}
+        self.publier({'callback_query': {'id': str(next(self._ids_update)), 'chat_instance': str(agent),
+                                         'from': expediteur, 'data': donnees, 'message': message}})
+
+    # ----- Côté bot : l'API -----
+    async def traiter(self, methode, parametres):
+        """Renvoie (statut HTTP, corps JSON)"""
+        self.appels[methode] = self.appels.get(methode, 0) + 1
+        if methode == 'getUpdates':
+            return 200, {'ok': True, 'result': await self._get_updates(parametres)}
+        # Limites évaluées à l'arrivée de la requête, la réponse part après la latence
+        refus = self._limiter(parametres['chat_id']) if methode in ENVOIS and 'chat_id' in parametres else None
+        await asyncio.sleep(self.latence + self.hasard.uniform(0, self.gigue))
+        if refus:
+            # À partir d'ici, le bot sait qu'il doit attendre
+            self.pause_annoncee = min(self.pause_annoncee, time.monotonic())
+            return 429, {'ok': False, 'error_code': 429, 'description': f'Too Many Requests: retry after {refus}',
+                         'parameters': {'retry_after': refus}}
+        if methode == 'getMe':
+            resultat = {'id': 1, 'is_bot': True, 'first_name': 'Faux bot', 'username': 'faux_relances_bot'}
+        elif methode == 'sendMessage':
+            resultat = self._message(parametres, next(self._ids_message))
+        elif methode in ('editMessageText', 'editMessageReplyMarkup'):
+            conversation = self.conversation(parametres.get('chat_id'))
+            ancien = conversation.messages.get(parametres.get('message_id'), {})
+            if methode == 'editMessageReplyMarkup':
+                parametres = {**parametres, 'text': ancien.get('text', '')}
+            resultat = self._message(parametres, parametres.get('message_id', 0))
+        else:
+            resultat = True
+        return 200, {'ok': True, 'result': resultat}
+
+    def _message(self, parametres, message_id):
+        chat_id = parametres.get('chat_id', 0)
+        message = {'message_id': message_id, 'date': int(time.time()), 'text': parametres.get('text', ''),
+                   'chat': {'id': chat_id, 'type': 'private'},
+                   'from': {'id': 1, 'is_bot': True, 'first_name': 'Faux bot'}}
+        if parametres.get('reply_markup'):
+            message['reply_markup'] = parametres['reply_markup']
+        self.conversation(chat_id).recevoir(message)
+        return message
+
+    async def _get_updates(self, parametres):
+        self.premier_polling.set()
+        decalage = parametres.get('offset', 0)
+        if decalage:
+            # Telegram oublie les mises à jour confirmées
+            self.updates = [u for u in self.updates if u['update_id'] >= decalage]
+        if not self.updates and parametres.get('timeout'):
+            self._nouvelles.clear()
+            try:
+                await asyncio.wait_for(self._nouvelles.wait(), parametres['timeout'])
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:parametres.get('limit', 100)]
+
+    def _limiter(self, chat_id):
+        """None si l'envoi passe, sinon le retry_after à renvoyer"""
+        maintenant = time.monotonic()
+        if maintenant < self.pause_jusqua:
+            # Les requêtes déjà parties quand le 429 arrive ne sont pas des fautes du bot
+            if maintenant > self.pause_annoncee + TOLERANCE_PAUSE:
+                self.compteurs['appels_pendant_pause'] += 1
+            else:
+                self.compteurs['appels_en_vol'] += 1
+            return math.ceil(self.pause_jusqua - maintenant)
+        if self.taux_429 and self.hasard.random() < self.taux_429:
+            self.compteurs['429_injectes'] += 1
+            return self._suspendre(self.retry_after)
+        debit, rafale = self._limites_chat
+        if debit:
+            seau = self._seaux_chat.get(chat_id)
+            if seau is None:
+                seau = self._seaux_chat[chat_id] = SeauJetons(debit, rafale)
+            attente = seau.reserver()
+            if attente > 0:
+                seau.jetons += 1
+                self.compteurs['429_limite_chat'] += 1
+                return self._suspendre(math.ceil(attente))
+        if self._seau_global is not None:
+            attente = self._seau_global.reserver()
+            if attente > 0:
+                self._seau_global.jetons += 1
+                self.compteurs['429_limite_globale'] += 1
+                return self._suspendre(math.ceil(attente))
+        return None
+
+    def _suspendre(self, duree):
+        maintenant = time.monotonic()
+        if maintenant >= self.pause_jusqua:
+            self.pause_annoncee = math.inf
+        self.pause_jusqua = max(self.pause_jusqua, maintenant + duree)
+        return duree
+
+    # ----- HTTP -----
+    async def servir(self, hote, port):
+        return await asyncio.start_server(self._connexion, hote, port)
+
+    async def _connexion(self, lecteur, ecrivain):
+        # HTTP/1.1 avec keep-alive : plusieurs requêtes par connexion
+        try:
+            while True:
+                ligne = await lecteur.readline()
+                if not ligne.strip():
+                    break
+                _, cible, _ = ligne.decode('latin-1').split(' ', 2)
+                entetes = {}
+                while (entete := (await lecteur.readline()).strip()):
+                    nom, _, valeur = entete.decode('latin-1').partition(':')
+                    entetes[nom.strip().lower()] = valeur.strip()
+                corps = await lecteur.readexactly(int(entetes.get('content-length', '0')))
+                adresse = urlsplit(cible)
+                methode = adresse.path.rsplit('/', 1)[-1]
+                if adresse.path.startswith('/bot'):
+                    statut, reponse = await self.traiter(methode, lire_parametres(entetes, corps, adresse.query))
+                else:
+                    statut, reponse = 404, {'ok': False, 'error_code': 404, 'description': 'Not Found'}
+                contenu = json.dumps(reponse).encode()
+                ecrivain.write(f'HTTP/1.1 {statut} {"OK" if statut == 200 else "Erreur"}\r\n'
+                               f'Content-Type: application/json\r\nContent-Length: {len(contenu)}\r\n\r\n'
+                               .encode() + contenu)
+                await ecrivain.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Bot arrêté, ou getUpdates encore en attente quand le serveur s'arrête
+            pass
+        finally:
+            ecrivain.close()
+
+
+class AgentSimule:
+    def __init__(self, serveur, agent, etapes, tours, pause, delai_max):
+        self.serveur = serveur
+        self.agent = agent
+        self.etapes = etapes
+        self.tours = tours
+        self.pause = pause
+        self.delai_max = delai_max
+        self.latences = {}
+        self.sans_reponse = 0
+
+    async def jouer(self):
+        conversation = self.serveur.conversation(self.agent)
+        aujourd_hui = date.today().strftime('%d/%m/%Y')
+        for tour in range(self.tours):
+            for nom, genre, valeur, attendu in self.etapes:
+                conversation.recus.clear()
+                debut = time.perf_counter()
+                if genre == 'texte':
+                    self.serveur.texte(self.agent, valeur.format(agent=self.agent, tour=tour,
+                                                                 aujourd_hui=aujourd_hui))
+                else:
+                    self.serveur.clic(self.agent, *conversation.bouton(valeur))
+                if await self._attendre(conversation, attendu, debut):
+                    self.latences.setdefault(nom, []).append(time.perf_counter() - debut)
+                else:
+                    # Parcours désynchronisé : on reprend au tour suivant
+                    self.sans_reponse += 1
+                    break
+                if self.pause:
+                    await asyncio.sleep(random.uniform(0.5, 1.5) * self.pause)
+
+    async def _attendre(self, conversation, attendu, debut):
+        vus = 0
+        while True:
+            if any(correspond(message, attendu) for message in conversation.recus[vus:]):
+                return True
+            vus = len(conversation.recus)
+            reste = debut + self.delai_max - time.perf_counter()
+            if reste <= 0:
+                return False
+            conversation.signal.clear()
+            try:
+                await asyncio.wait_for(conversation.signal.wait(), reste)
+            except asyncio.TimeoutError:
+                return False
+
+
+def memoire_mo(pid):
+    """VmRSS du processus, en Mo (Linux)"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for ligne in f:
+                if ligne.startswith('VmRSS:'):
+                    return int(ligne.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+async def lancer_bot(port, dossier):
+    environnement = {**os.environ, 'TOKEN': '123456:faux-telegram', 'ADMIN_IDS': '1',
+                     'API_BOT_URL': f'http://127.0.0.1:{port}', 'PYTHONPATH': RACINE}
+    journal = open(os.path.join(dossier, 'bot.log'), 'wb')
+    return await asyncio.create_subprocess_exec(sys.executable, os.path.join(RACINE, 'main.py'), cwd=dossier,
+                                                env=environnement, stdout=journal, stderr=asyncio.subprocess.STDOUT)
+
+
+async def arreter_bot(processus):
+    # run_polling s'arrête proprement sur SIGINT (persistance puis base fermées)
+    processus.send_signal(signal.SIGINT)
+    try:
+        await asyncio.wait_for(processus.wait(), 30)
+    except asyncio.TimeoutError:
+        processus.kill()
+        await processus.wait()
+
+
+async def charger(options):
+    serveur = FauxTelegram(options.latence_ms / 1000, options.gigue_ms / 1000, options.taux_429,
+                           options.retry_after, options.debit_chat, options.rafale_chat,
+                           options.debit_global, options.rafale_global)
+    http = await serveur.servir('127.0.0.1', options.port)
+    print(f"Faux Telegram sur http://127.0.0.1:{options.port}")
+    processus = None
+    if not options.externe:
+        dossier = tempfile.mkdtemp()
+        processus = await lancer_bot(options.port, dossier)
+        print(f"Bot lancé (pid {processus.pid}), journal : {os.path.join(dossier, 'bot.log')}")
+    await asyncio.wait_for(serveur.premier_polling.wait(), 60)
+
+    echantillons = []
+
+    async def surveiller():
+        while True:
+            echantillons.append(memoire_mo(processus.pid))
+            await asyncio.sleep(1)
+
+    surveillance = asyncio.create_task(surveiller()) if processus else None
+    agents = [AgentSimule(serveur, PREMIER_AGENT + i, SCENARIOS[options.scenario], options.tours,
+                          options.pause_ms / 1000, options.delai_max) for i in range(options.agents)]
+    debut = time.perf_counter()
+    await asyncio.gather(*(agent.jouer() for agent in agents))
+    duree = time.perf_counter() - debut
+
+    if surveillance:
+        surveillance.cancel()
+        memoire_fin = memoire_mo(processus.pid)
+        await arreter_bot(processus)
+    http.close()
+    await http.wait_closed()
+
+    latences = {}
+    for agent in agents:
+        for nom, valeurs in agent.latences.items():
+            latences.setdefault(nom, []).extend(valeurs)
+    nb_etapes = sum(len(valeurs) for valeurs in latences.values())
+    print(f"\n{options.agents} agents x {options.tours} tours ({options.scenario}) en {duree:.1f} s")
+    print(f"débit              {nb_etapes / duree:>10.1f} étapes/s")
+    print(f"sans réponse       {sum(agent.sans_reponse for agent in agents):>10d} parcours interrompus")
+    print("\nLatence par étape (envoi de l'agent -> réponse du bot) :")
+    for nom, _, _, _ in SCENARIOS[options.scenario]:
+        valeurs = latences.get(nom, [])
+        print(f"  {nom:<16} n {len(valeurs):>6}   p50 {centile(valeurs, 50) * 1000:>8.1f} ms"
+              f"   p99 {centile(valeurs, 99) * 1000:>8.1f} ms")
+    print("\nAppels API :", ', '.join(f'{m} {n}' for m, n in sorted(serveur.appels.items())))
+    print("Limites :", ', '.join(f'{nom} {n}' for nom, n in serveur.compteurs.items()))
+    mesures = [m for m in echantillons if m is not None]
+    if mesures:
+        print(f"Mémoire du bot : début {mesures[0]:.0f} Mo, max {max(mesures):.0f} Mo, fin {memoire_fin:.0f} Mo")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--agents', type=int, default=100)
+    parser.add_argument('--tours', type=int, default=3)
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='relance')
+    parser.add_argument('--pause-ms', type=float, default=0, help="temps de réflexion moyen entre deux étapes")
+    parser.add_argument('--delai-max', type=float, default=120, help="attente maximale d'une réponse (s)")
+    parser.add_argument('--latence-ms', type=float, default=30)
+    parser.add_argument('--gigue-ms', type=float, default=20)
+    parser.add_argument('--taux-429', type=float, default=0.0, help="part des envois refusés au hasard")
+    parser.add_argument('--retry-after', type=int, default=2)
+    # Un peu plus tolérant que l'Expediteur du bot : il ne devrait jamais les dépasser (0 : sans limite)
+    parser.add_argument('--debit-chat', type=float, default=1)
+    parser.add_argument('--rafale-chat', type=float, default=5)
+    parser.add_argument('--debit-global', type=float, default=30)
+    parser.add_argument('--rafale-global', type=float, default=40)
+    parser.add_argument('--externe', action='store_true', help="ne pas lancer le bot")
+    asyncio.run(charger(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
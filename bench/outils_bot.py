@@ -0,0 +1,71 @@
+"""Outils communs aux bancs qui pilotent le bot hors ligne : fausse API Bot
+en mémoire et fabrication de mises à jour (JSON brut de l'API Bot)."""
+import collections
+import itertools
+import json
+import time
+
+from telegram.request import BaseRequest
+
+
+class FausseApiBot(BaseRequest):
+    """Répond localement à tous les appels de l'API Bot et les compte
+    (au total et par méthode)."""
+
+    def __init__(self):
+        self.appels = 0
+        self.par_methode = collections.Counter()
+        self._ids = itertools.count(1)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        self.appels += 1
+        methode = url.rsplit('/', 1)[-1]
+        self.par_methode[methode] += 1
+        parametres = request_data.parameters if request_data else {}
+        if methode == 'getMe':
+            resultat = {'id': 1, 'is_bot': True, 'first_name': 'bot', 'username': 'relanceavent_bot'}
+        elif methode in ('sendMessage', 'editMessageText'):
+            resultat = {'message_id': next(self._ids), 'date': int(time.time()),
+                        'chat': {'id': parametres.get('chat_id', 0), 'type': 'private'},
+                        'text': parametres.get('text', '')}
+        else:
+            resultat = True
+        return 200, json.dumps({'ok': True, 'result': resultat}).encode()
+
+
+_ids = itertools.count(1)
+
+
+def message(utilisateur, texte):
+    return {'update_id': next(_ids), 'message': {
+        'message_id': next(_ids), 'date': int(time.time()), 'text': texte,
+        'chat': {'id': utilisateur, 'type': 'private'},
+        'from': {'id': utilisateur, 'is_bot': False, 'first_name': f'Agent {utilisateur}'}}}
+
+
+def bouton(utilisateur, donnees):
+    return {'update_id': next(_ids), 'callback_query': {
+        'id': str(next(_ids)), 'chat_instance': str(utilisateur), 'data': donnees,
+        'from': {'id': utilisateur, 'is_bot': False, 'first_name': f'Agent {utilisateur}'},
+        'message': {'message_id': 1, 'date': int(time.time()), 'text': 'menu',
+                    'chat': {'id': utilisateur, 'type': 'private'}}}}
+
+
+def scenario(utilisateur, tours):
+    for tour in range(tours):
+        yield bouton(utilisateur, 'nouveau_client')
+        yield message(utilisateur, f'Client {utilisateur}-{tour}')
+        yield message(utilisateur, f'06{utilisateur:04d}{tour:04d}')
+        yield message(utilisateur, f'client{utilisateur}.{tour}@exemple.fr')
+        yield message(utilisateur, 'Site web')
+        yield message(utilisateur, 'Séjour')
+        yield message(utilisateur, 'Lisbonne')
+        yield bouton(utilisateur, 'relances_jour')
+        yield bouton(utilisateur, 'statistiques')
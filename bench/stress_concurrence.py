@@ -0,0 +1,167 @@
+"""Test de charge de la concurrence : des milliers de mises à jour de
+nombreux agents, entrelacées au hasard (l'ordre propre à chaque agent étant
+conservé), traitées en parallèle par l'application.
+
+Vérifie ensuite :
+- aucune écriture perdue : chaque client saisi existe une et une seule fois,
+  avec les champs saisis par le même agent, et son entrée d'historique ;
+- aucun curseur corrompu : chaque agent termine son parcours sans étape en
+  cours ;
+- ensemble des admins cohérent avec la table agents après des ajouts et
+  suppressions concurrents.
+
+Usage : python -m bench.stress_concurrence [nb_agents] [tours] [--sans-ordre]
+
+--sans-ordre remplace le processeur par utilisateur par le traitement
+concurrent simple de PTB, pour montrer ce que le test détecte.
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+os.chdir(tempfile.mkdtemp())
+os.environ.setdefault('TOKEN', '123456:stress')
+os.environ['ADMIN_IDS'] = '1,2,3'
+
+from telegram import Update  # noqa: E402
+from telegram.ext import TypeHandler  # noqa: E402
+
+import main as bot  # noqa: E402
+from bench.outils_bot import FausseApiBot, bouton, message, scenario  # noqa: E402
+from envoi import Expediteur  # noqa: E402
+
+NOUVEAUX_ADMINS = range(900000, 900040)
+
+
+def entrelacer(sequences, graine=1):
+    """Fusion aléatoire de plusieurs séquences, chacune gardant son ordre"""
+    hasard = random.Random(graine)
+    restantes = [list(reversed(s)) for s in sequences if s]
+    resultat = []
+    while restantes:
+        i = hasard.randrange(len(restantes))
+        resultat.append(restantes[i].pop())
+        if not restantes[i]:
+            restantes[i] = restantes[-1]
+            restantes.pop()
+    return resultat
+
+
+async def traiter(app, mises_a_jour):
+    """Place les mises à jour dans la file de l'application et attend la fin"""
+    restant = len(mises_a_jour)
+    fini = asyncio.Event()
+
+    async def compter(update, context):
+        nonlocal restant
+        restant -= 1
+        if restant == 0:
+            fini.set()
+
+    gestionnaire = TypeHandler(Update, compter)
+    app.add_handler(gestionnaire, group=1)
+    for donnees in mises_a_jour:
+        await app.update_queue.put(Update.de_json(donnees, app.bot))
+    await asyncio.wait_for(fini.wait(), 600)
+    app.remove_handler(gestionnaire, group=1)
+
+
+def ajout_admin(admin, tid):
+    return [bouton(admin, 'ajouter_admin'), message(admin, str(tid)), message(admin, f'Admin {tid}')]
+
+
+async def stresser(nb_agents, tours):
+    bot.expediteur = Expediteur(debit_global=1e6, debit_chat=1e6, capacite_chat=1e6,
+                                debit_groupe=1e6, capacite_groupe=1e6)
+    app = bot.construire_application(requete=FausseApiBot())
+    agents = [1000 + a for a in range(nb_agents)]
+    erreurs = []
+
+    async with app:
+        await app.start()
+
+        # 1. Saisies de clients entrelacées + ajouts d'admins concurrents
+        sequences = [list(scenario(agent, tours)) for agent in agents]
+        ajouts = {1: [], 2: [], 3: []}
+        for i, tid in enumerate(NOUVEAUX_ADMINS):
+            # Deux admins ajoutent le même telegram_id
+            ajouts[1 + i % 3] += ajout_admin(1 + i % 3, tid)
+            ajouts[1 + (i + 1) % 3] += ajout_admin(1 + (i + 1) % 3, tid)
+        sequences += ajouts.values()
+        mises_a_jour = entrelacer(sequences)
+        debut = time.perf_counter()
+        await traiter(app, mises_a_jour)
+        duree = time.perf_counter() - debut
+        print(f"{len(mises_a_jour)} mises à jour de {len(sequences)} séquences en {duree:.1f} s "
+              f"({len(mises_a_jour) / duree:.0f}/s)")
+
+        # 2. Suppressions concurrentes de la moitié des nouveaux admins
+        a_supprimer = [(aid, tid) for aid, _, tid, _ in await bot.db.get_all_agents()
+                       if tid in NOUVEAUX_ADMINS and tid % 2 == 0]
+        suppressions = [[bouton(1 + i % 3, f'confirmer_suppression_admin_{aid}')]
+                        for i, (aid, _) in enumerate(a_supprimer)]
+        await traiter(app, entrelacer(suppressions, graine=2))
+
+        await app.stop()
+
+        clients = await bot.db.en_transaction(
+            lambda db: db.c.execute('SELECT nom, telephone, email, destination FROM clients').fetchall())
+        historique = await bot.db.en_transaction(
+            lambda db: db.c.execute("SELECT COUNT(*) FROM historique WHERE action = 'création'").fetchone()[0])
+        agents_db = {tid for _, _, tid, _ in await bot.db.get_all_agents()}
+
+        # Écritures perdues ou mélangées entre étapes
+        attendus = {}
+        for agent in agents:
+            for tour in range(tours):
+                attendus[f'Client {agent}-{tour}'] = (f'06{agent:04d}{tour:04d}',
+                                                      f'client{agent}.{tour}@exemple.fr', 'Lisbonne')
+        vus = {}
+        for nom, telephone, email, destination in clients:
+            vus[nom] = vus.get(nom, 0) + 1
+            if nom in attendus and attendus[nom] != (telephone, email, destination):
+                erreurs.append(f"champs mélangés pour {nom} : {(telephone, email, destination)}")
+        perdus = [nom for nom in attendus if nom not in vus]
+        doubles = [nom for nom, nb in vus.items() if nb > 1]
+        if perdus:
+            erreurs.append(f"{len(perdus)} clients perdus (ex. {perdus[:3]})")
+        if doubles:
+            erreurs.append(f"{len(doubles)} clients en double (ex. {doubles[:3]})")
+        if historique != len(clients):
+            erreurs.append(f"historique : {historique} entrées pour {len(clients)} clients")
+
+        # Curseurs (étape en cours) corrompus
+        for agent in agents:
+            donnees = app.user_data.get(agent, {})
+            if donnees.get('etape'):
+                erreurs.append(f"agent {agent} bloqué à l'étape {donnees['etape']!r}")
+
+        # Ensemble des admins contre la table agents
+        if set(bot.ADMIN_IDS) != agents_db:
+            erreurs.append(f"admins en mémoire {len(bot.ADMIN_IDS)} != en base {len(agents_db)}")
+        attendus_admins = {1, 2, 3} | {tid for tid in NOUVEAUX_ADMINS if tid % 2}
+        if agents_db != attendus_admins:
+            erreurs.append(f"admins en base inattendus : {sorted(agents_db ^ attendus_admins)[:5]}")
+
+    bot.db.fermer()
+    print(f"{len(clients)} clients / {len(attendus)} attendus, {len(agents_db)} admins")
+    for erreur in erreurs[:20]:
+        print(f"❌ {erreur}")
+    print("✅ aucune incohérence" if not erreurs else f"❌ {len(erreurs)} incohérences")
+    return not erreurs
+
+
+def main():
+    arguments = [a for a in sys.argv[1:] if not a.startswith('--')]
+    nb_agents = int(arguments[0]) if arguments else 200
+    tours = int(arguments[1]) if len(arguments) > 1 else 3
+    if '--sans-ordre' in sys.argv:
+        bot.ProcesseurParUtilisateur = lambda concurrence: concurrence
+    sys.exit(0 if asyncio.run(stresser(nb_agents, tours)) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+"""Banc de référence reproductible, pour comparer deux versions.
+
+1. Génère une agence synthétique (bench.donnees) dans une base temporaire :
+   par défaut 200 agents, 100k clients, 1M relances, 5M lignes d'historique
+   (--echelle pour réduire, ou un volume précis par table).
+2. Chronomètre chaque méthode publique de Database, sur des arguments tirés
+   au hasard (graine fixe). Les méthodes sans cas de mesure sont listées
+   dans « non_mesurees » : une nouvelle méthode ne passe pas inaperçue.
+3. Pilote les handlers de main.py de bout en bout (mises à jour JSON ->
+   Application -> base -> fausse API Bot en mémoire), scénario par scénario.
+
+Résultat : JSON (durées en ms, p50 / p95 / p99) sur la sortie standard ou
+dans --sortie ; le résumé lisible va sur la sortie d'erreur.
+
+Usage : python -m bench.suite [--echelle 0.1] [--clients N] [--relances N] [--historique N]
+                              [--agents N] [--repetitions 30] [--sortie fichier.json] [--sans-handlers]
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+# main.py ouvre relances.db dans le dossier courant
+LANCEMENT = os.getcwd()
+os.chdir(tempfile.mkdtemp())
+os.environ.setdefault('TOKEN', '123456:suite')
+os.environ['ADMIN_IDS'] = '1'
+CHEMIN = os.path.abspath('relances.db')
+
+from bench.donnees import DESTINATIONS, NOMS, PRENOMS, generer, volumes  # noqa: E402
+from database import Database  # noqa: E402
+
+ADMIN = 1
+RECHERCHES = ['martin', 'sophie dubois', 'crete', 'inst', '0612', '4567', 'zzzz']
+
+
+def repartition(durees):
+    """Statistiques d'une série de durées (s), en ms"""
+    triees = sorted(durees)
+
+    def centile(p):
+        return triees[min(len(triees) - 1, max(0, round(p / 100 * len(triees)) - 1))] * 1000
+
+    return {
+        'n': len(triees),
+        'min': round(triees[0] * 1000, 3),
+        'p50': round(centile(50), 3),
+        'p95': round(centile(95), 3),
+        'p99': round(centile(99), 3),
+        'max': round(triees[-1] * 1000, 3),
+        'moyenne': round(sum(triees) / len(triees) * 1000, 3),
+    }
+
+
+class Tirages:
+    """Arguments aléatoires mais reproductibles, tirés dans le jeu de données"""
+
+    def __init__(self, db, graine=7):
+        self.hasard = random.Random(graine)
+        self.nb_clients = db.c.execute('SELECT MAX(id) FROM clients').fetchone()[0]
+        self.nb_agents = db.c.execute('SELECT MAX(id) FROM agents').fetchone()[0]
+        self.programmees = [rid for (rid,) in db.c.execute(
+            "SELECT id FROM relances WHERE statut = 'programmee' ORDER BY random() LIMIT 20000")]
+        self._tid = 500_000
+        self.agents_crees = []
+
+    def client(self):
+        return self.hasard.randint(1, self.nb_clients)
+
+    def agent(self):
+        return self.hasard.randint(1, self.nb_agents)
+
+    def relance(self):
+        # Chaque relance programmée ne sert qu'une fois (certaines mesures la clôturent)
+        return self.programmees.pop() if self.programmees else 1
+
+    def relances(self, nb=50):
+        return [self.relance() for _ in range(nb)]
+
+    def recherche(self):
+        return self.hasard.choice(RECHERCHES)
+
+    def date_future(self):
+        return (date.today() + timedelta(days=self.hasard.randint(1, 60))).isoformat()
+
+    def nouveau_tid(self):
+        self._tid += 1
+        return self._tid
+
+    def nouveau_client(self):
+        i = self.hasard.randint(0, 10 ** 6)
+        return (f'{self.hasard.choice(PRENOMS)} {self.hasard.choice(NOMS)} B{i}', f'07{i:08d}',
+                f'bench{i}@exemple.fr', 'Salon', 'Séjour', self.hasard.choice(DESTINATIONS))
+
+
+def _supprimer_agent(t):
+    if not t.agents_crees:
+        return ((0,), {})
+    return ((t.agents_crees.pop(),), {})
+
+
+# Méthode (ou variante « nom[variante] ») -> tirage de (args, kwargs)
+CAS_DB = {
+    'ajouter_agent': lambda t: ((t.nouveau_tid(), 'Agent bench'), {}),
+    'get_agent': lambda t: ((100_000 + t.agent() - 1,), {}),
+    'get_agent_by_id': lambda t: ((t.agent(),), {}),
+    'get_all_agents': lambda t: ((), {}),
+    'supprimer_agent': _supprimer_agent,
+    'ajouter_client': lambda t: (t.nouveau_client() + (t.agent(),), {}),
+    'get_client': lambda t: ((t.client(),), {}),
+    'get_fiche_client': lambda t: ((t.client(),), {}),
+    'clients_existants': lambda t: (([f'06{t.hasard.randint(0, 99_999_999):08d}' for _ in range(100)],
+                                     [f'client{t.client()}@exemple.fr' for _ in range(100)]), {}),
+    'importer_clients': lambda t: (([t.nouveau_client() for _ in range(100)], t.agent()), {}),
+    'rechercher_clients': lambda t: ((t.recherche(),), {}),
+    'rechercher_clients_page': lambda t: ((t.recherche(),), {}),
+    'get_clients_par_statut': lambda t: ((t.hasard.choice(('en_cours', 'converti', 'perdu')),), {}),
+    'update_client_statut': lambda t: ((t.client(), t.hasard.choice(('en_cours', 'converti'))), {}),
+    'ajouter_relance': lambda t: ((t.client(), t.date_future()), {}),
+    'recalculer_priorites': lambda t: ((), {}),
+    'get_relances_du_jour': lambda t: ((), {}),
+    'get_relances_du_jour_page': lambda t: ((), {}),
+    'get_relances_a_venir': lambda t: ((7,), {}),
+    'get_relances_en_retard': lambda t: ((), {}),
+    'get_relances_en_retard_page': lambda t: ((), {}),
+    'get_resume_quotidien': lambda t: ((7,), {}),
+    'get_relances_horaires': lambda t: ((datetime.now(), datetime.now() + timedelta(hours=6)), {}),
+    'get_relance_horaire': lambda t: ((t.relance(),), {}),
+    'marquer_relance_effectuee': lambda t: ((t.relance(), 'effectuee'), {}),
+    'ajouter_regle_relance': lambda t: ((t.client(), (date.today() + timedelta(days=45)).isoformat(), 7), {}),
+    'materialiser_regles': lambda t: ((), {}),
+    'get_relances_client': lambda t: ((t.client(),), {}),
+    'ajouter_historique': lambda t: ((t.client(), 'appel', 'Appel sortant', t.agent()), {}),
+    'get_historique_client': lambda t: ((t.client(),), {}),
+    'get_historique_client_page': lambda t: ((t.client(),), {}),
+    'archiver_historique': lambda t: (((date.today() - timedelta(days=365)).isoformat(),), {}),
+    'compacter': lambda t: ((), {}),
+    'nb_historique_archive': lambda t: ((t.client(),), {}),
+    'get_historique_archive_page': lambda t: ((t.client(),), {}),
+    'lignes_export[relances agent]': lambda t: (('relances',), {'agent_id': t.agent()}),
+    'lignes_export[historique mois]': lambda t: (('historique',), {
+        'debut': (date.today() - timedelta(days=30)).isoformat(), 'agent_id': t.agent()}),
+    'ajouter_client_journalise': lambda t: (t.nouveau_client() + (t.agent(),), {}),
+    'ajouter_relance_journalisee': lambda t: ((t.client(), t.date_future(), 'date_precise', 'bench'), {}),
+    'ajouter_regle_relance_journalisee': lambda t: (
+        (t.client(), (date.today() + timedelta(days=45)).isoformat(), 'bench'), {'jalons': '30,15,7,1'}),
+    'marquer_relance_effectuee_journalisee': lambda t: ((t.relance(), 'effectuee'), {}),
+    'effectuer_relances': lambda t: ((t.relances(),), {}),
+    'reporter_relances': lambda t: ((t.relances(), 3), {}),
+    'reassigner_relances': lambda t: ((t.relances(), t.agent()), {}),
+    'charger_etat': lambda t: (('user', t.hasard.randint(1, 100)), {}),
+    'enregistrer_etats': lambda t: (([('user', i, '{"etape": null}', time.time_ns()) for i in range(1, 101)],), {}),
+    'supprimer_etat': lambda t: (('user', t.hasard.randint(1, 100)), {}),
+    'get_statistiques': lambda t: ((), {}),
+    'get_statistiques[agent]': lambda t: ((t.agent(),), {}),
+}
+# Pas des requêtes : gestion de la connexion
+HORS_MESURE = {'transaction', 'fermer'}
+
+
+def methodes_publiques():
+    return sorted(nom for nom, membre in inspect.getmembers(Database, inspect.isfunction)
+                  if not nom.startswith('_') and nom not in HORS_MESURE)
+
+
+def mesurer_base(repetitions):
+    db = Database(CHEMIN, initialiser=False)
+    tirages = Tirages(db)
+    resultats = {}
+    for cas, tirer in CAS_DB.items():
+        methode = getattr(db, cas.split('[')[0])
+        durees = []
+        for _ in range(repetitions):
+            args, kwargs = tirer(tirages)
+            debut = time.perf_counter()
+            resultat = methode(*args, **kwargs)
+            if inspect.isgenerator(resultat):
+                for _ in resultat:
+                    pass
+            durees.append(time.perf_counter() - debut)
+        if cas == 'ajouter_agent':
+            tirages.agents_crees = [aid for (aid,) in db.c.execute(
+                'SELECT id FROM agents WHERE telegram_id >= 500000')]
+        resultats[cas] = repartition(durees)
+        print(f"  {cas:<40} p50 {resultats[cas]['p50']:>9.2f} ms   p99 {resultats[cas]['p99']:>9.2f} ms",
+              file=sys.stderr)
+    db.fermer()
+    mesurees = {cas.split('[')[0] for cas in CAS_DB}
+    return resultats, [nom for nom in methodes_publiques() if nom not in mesurees]
+
+
+# ----- Handlers de bout en bout -----
+def scenarios(tirages, outils):
+    """Nom -> fonction qui fabrique la suite de mises à jour d'une répétition"""
+    bouton, message = outils.bouton, outils.message
+
+    def creation():
+        nom, tel, email, source, demande, destination = tirages.nouveau_client()
+        return [bouton(ADMIN, 'nouveau_client'), message(ADMIN, nom), message(ADMIN, tel), message(ADMIN, email),
+                message(ADMIN, source), message(ADMIN, demande), message(ADMIN, destination)]
+
+    def relance_date():
+        cid = tirages.client()
+        jour = (date.today() + timedelta(days=tirages.hasard.randint(1, 60))).strftime('%d/%m/%Y')
+        return [bouton(ADMIN, f'ajouter_relance_{cid}'), bouton(ADMIN, 'type_relance_date'), message(ADMIN, jour)]
+
+    def selection():
+        ids = tirages.relances(5)
+        return ([bouton(ADMIN, 'relances_retard'), bouton(ADMIN, 'selection_debut_retard')]
+                + [bouton(ADMIN, f'selection_choisir_{rid}') for rid in ids] + [bouton(ADMIN, 'selection_effectuer')])
+
+    return {
+        'menu': lambda: [bouton(ADMIN, 'menu_principal')],
+        'relances_jour': lambda: [bouton(ADMIN, 'relances_jour')],
+        'relances_retard': lambda: [bouton(ADMIN, 'relances_retard')],
+        'relances_7j': lambda: [bouton(ADMIN, 'relances_7j')],
+        'statistiques': lambda: [bouton(ADMIN, 'statistiques')],
+        'voir_client': lambda: [bouton(ADMIN, f'voir_client_{tirages.client()}')],
+        'historique_client': lambda: [bouton(ADMIN, f'historique_{tirages.client()}')],
+        'recherche': lambda: [bouton(ADMIN, 'rechercher'), message(ADMIN, tirages.recherche())],
+        'creation_client': creation,
+        'ajout_relance_date': relance_date,
+        'selection_effectuer': selection,
+    }
+
+
+async def mesurer_handlers(repetitions):
+    from telegram import Update
+
+    import main as bot
+    from bench import outils_bot
+    from envoi import Expediteur
+
+    # Sans limite de débit : on mesure le bot, pas l'attente imposée par Telegram
+    bot.expediteur = Expediteur(debit_global=1e6, debit_chat=1e6, capacite_chat=1e6,
+                                debit_groupe=1e6, capacite_groupe=1e6)
+    api = outils_bot.FausseApiBot()
+    app = bot.construire_application(requete=api)
+    lecture = Database(CHEMIN, initialiser=False)
+    tirages = Tirages(lecture, graine=11)
+    lecture.fermer()
+    resultats = {}
+    async with app:
+        for nom, fabriquer in scenarios(tirages, outils_bot).items():
+            durees = []
+            appels = api.appels
+            for _ in range(repetitions):
+                mises_a_jour = [Update.de_json(donnees, app.bot) for donnees in fabriquer()]
+                debut = time.perf_counter()
+                for update in mises_a_jour:
+                    await app.process_update(update)
+                durees.append(time.perf_counter() - debut)
+            resultats[nom] = repartition(durees)
+            resultats[nom]['appels_api'] = (api.appels - appels) / repetitions
+            print(f"  {nom:<40} p50 {resultats[nom]['p50']:>9.2f} ms   p99 {resultats[nom]['p99']:>9.2f} ms",
+                  file=sys.stderr)
+    # Comme après run_polling : l'écrivain se vide tant que la boucle tourne encore
+    await bot.fermer_base(app)
+    return resultats, dict(api.par_methode)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--echelle', type=float, default=1.0)
+    for table in ('agents', 'clients', 'relances', 'historique'):
+        parser.add_argument(f'--{table}', type=int)
+    parser.add_argument('--repetitions', type=int, default=30)
+    parser.add_argument('--graine', type=int, default=2024)
+    parser.add_argument('--sortie')
+    parser.add_argument('--sans-handlers', action='store_true')
+    options = parser.parse_args()
+
+    taille = volumes(options.echelle, agents=options.agents, clients=options.clients,
+                     relances=options.relances, historique=options.historique)
+    print(f"Génération : {taille}", file=sys.stderr)
+    debut = time.perf_counter()
+    generation = generer(CHEMIN, graine=options.graine, journal=lambda texte: print(texte, file=sys.stderr), **taille)
+    resultat = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'environnement': {'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+                          'plateforme': platform.platform()},
+        'parametres': {**taille, 'repetitions': options.repetitions, 'graine': options.graine},
+        'generation_s': {nom: round(duree, 2) for nom, duree in generation.items()},
+        'taille_base_mo': round(os.path.getsize(CHEMIN) / 2 ** 20, 1),
+    }
+    print(f"Base générée en {time.perf_counter() - debut:.0f} s ({resultat['taille_base_mo']} Mo)\n"
+          f"\nMéthodes de Database :", file=sys.stderr)
+    resultat['database'], resultat['non_mesurees'] = mesurer_base(options.repetitions)
+    if resultat['non_mesurees']:
+        print(f"Sans cas de mesure : {', '.join(resultat['non_mesurees'])}", file=sys.stderr)
+    if not options.sans_handlers:
+        print("\nHandlers (bout en bout) :", file=sys.stderr)
+        resultat['handlers'], resultat['appels_api'] = asyncio.run(mesurer_handlers(options.repetitions))
+
+    texte = json.dumps(resultat, indent=2, ensure_ascii=False)
+    if options.sortie:
+        with open(os.path.join(LANCEMENT, options.sortie), 'w', encoding='utf-8') as fichier:
+            fichier.write(texte + '\n')
+    else:
+        print(texte)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+import threading
+from collections import OrderedDict
+
+
+class CacheLRU:
+    """Cache borné (les entrées les moins récemment lues sont évincées),
+    utilisable depuis plusieurs threads.
+
+    Chaque clé a une version, incrémentée par invalider(). Un lecteur prend
+    un jeton avant d'aller chercher la donnée et le passe à ecrire() : si la
+    clé a été invalidée entre-temps, la valeur (devenue périmée) n'est pas
+    mise en cache.
+    """
+
+    # Au-delà, les versions sont oubliées d'un coup (changement d'époque)
+    MAX_VERSIONS = 100000
+
+    def __init__(self, capacite=1000):
+        self.capacite = capacite
+        self._entrees = OrderedDict()
+        self._versions = {}
+        self._epoque = 0
+        self._verrou = threading.Lock()
+        self.succes = 0
+        self.echecs = 0
+
+    def jeton(self, cle):
+        with self._verrou:
+            return self._epoque, self._versions.get(cle, 0)
+
+    def lire(self, cle):
+        with self._verrou:
+            entree = self._entrees.get(cle)
+            if entree is not None and entree[0] == (self._epoque, self._versions.get(cle, 0)):
+                self._entrees.move_to_end(cle)
+                self.succes += 1
+                return entree[1]
+            self.echecs += 1
+            return None
+
+    def ecrire(self, cle, jeton, valeur):
+        with self._verrou:
+            if jeton != (self._epoque, self._versions.get(cle, 0)):
+                return
+            self._entrees[cle] = (jeton, valeur)
+            self._entrees.move_to_end(cle)
+            while len(self._entrees) > self.capacite:
+                self._entrees.popitem(last=False)
+
+    def invalider(self, cle):
+        with self._verrou:
+            self._entrees.pop(cle, None)
+            self._versions[cle] = self._versions.get(cle, 0) + 1
+            if len(self._versions) > self.MAX_VERSIONS:
+                self._epoque += 1
+                self._versions.clear()
+                self._entrees.clear()
+
+    def statistiques(self):
+        with self._verrou:
+            total = self.succes + self.echecs
+            return {
+                'taille': len(self._entrees),
+                'capacite': self.capacite,
+                'succes': self.succes,
+                'echecs': self.echecs,
+                'taux_succes': self.succes / total if total else 0.0,
+            }
@@ -0,0 +1,96 @@
+import asyncio
+import threading
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class ProcesseurParUtilisateur(BaseUpdateProcessor):
+    """Traite les mises à jour en parallèle entre utilisateurs, mais une par
+    une et dans l'ordre d'arrivée pour un même utilisateur : la machine à
+    états de user_data (`etape`) ne voit jamais deux messages du même agent
+    en même temps.
+
+    Le verrou d'un utilisateur est pris avant la place d'exécution : les
+    messages en attente d'un agent très actif n'occupent pas les places des
+    autres. `max_en_attente` borne le nombre total de mises à jour en cours
+    ou en attente.
+    """
+
+    def __init__(self, max_concurrent_updates, max_en_attente=None):
+        super().__init__(max_en_attente or max_concurrent_updates * 16)
+        self._places = asyncio.Semaphore(max_concurrent_updates)
+        self._verrous = {}
+
+    @staticmethod
+    def _cle(update):
+        if isinstance(update, Update):
+            if update.effective_user is not None:
+                return ('user', update.effective_user.id)
+            if update.effective_chat is not None:
+                return ('chat', update.effective_chat.id)
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        cle = self._cle(update)
+        if cle is None:
+            async with self._places:
+                await coroutine
+            return
+        # asyncio.Lock sert ses demandeurs dans l'ordre : l'ordre d'arrivée est conservé
+        entree = self._verrous.get(cle)
+        if entree is None:
+            entree = self._verrous[cle] = [asyncio.Lock(), 0]
+        entree[1] += 1
+        try:
+            async with entree[0]:
+                async with self._places:
+                    await coroutine
+        finally:
+            entree[1] -= 1
+            if entree[1] == 0:
+                del self._verrous[cle]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+class EnsembleAdmins:
+    """Ensemble des telegram_id administrateurs, partagé par les handlers.
+
+    Les lectures et modifications sont protégées par un verrou (appelable
+    depuis n'importe quel thread) ; l'itération porte sur une copie. Pour
+    garder la base et l'ensemble cohérents, les handlers font l'écriture en
+    base et la mise à jour de l'ensemble sous `async with admins.modification:`.
+    """
+
+    def __init__(self, ids=()):
+        self._ids = set(ids)
+        self._verrou = threading.Lock()
+        self.modification = asyncio.Lock()
+
+    def ajouter(self, tid):
+        with self._verrou:
+            self._ids.add(tid)
+
+    def retirer(self, tid):
+        with self._verrou:
+            self._ids.discard(tid)
+
+    def __contains__(self, tid):
+        with self._verrou:
+            return tid in self._ids
+
+    def __iter__(self):
+        with self._verrou:
+            return iter(sorted(self._ids))
+
+    def __len__(self):
+        with self._verrou:
+            return len(self._ids)
+
+    def __repr__(self):
+        return repr(list(self))
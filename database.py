@@ -1,16 +1,259 @@
+import json
+import logging
 import sqlite3
 import os
-from datetime import datetime, timedelta
+import re
+import zlib
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+from metriques import CurseurInstrumente, metriques
+
+logger = logging.getLogger(__name__)
+
+FORMAT_SAISIE = '%d/%m/%Y'
+
+# Modes de stockage : 'wal' (journal WAL, lecteurs non bloqués par l'écrivain)
+# ou 'classique' (journal rollback par défaut de SQLite)
+MODE_DEFAUT = os.environ.get('DB_MODE', 'wal')
+# Compteurs matérialisés pour le tableau de bord (tenus à jour par triggers)
+COMPTEURS_DEFAUT = os.environ.get('DB_COMPTEURS', '0') == '1'
+
+PRAGMAS_WAL = (
+    'PRAGMA journal_mode = WAL',
+    # En WAL, NORMAL ne synchronise qu'aux checkpoints : une coupure peut perdre
+    # les dernières transactions mais jamais corrompre la base
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA mmap_size = 67108864',
+    'PRAGMA wal_autocheckpoint = 1000',
+)
+
+
+def ecriture(methode):
+    """Marque une méthode de Database qui modifie la base (routée vers l'écrivain)"""
+    methode.ecriture = True
+    return methode
+
+
+def normaliser_telephone(telephone):
+    """Ne garde que les chiffres ; +33 / 0033 devient 0 (numéros français)"""
+    chiffres = re.sub(r'\D', '', telephone or '')
+    if chiffres.startswith('00'):
+        chiffres = chiffres[2:]
+    if chiffres.startswith('33') and len(chiffres) == 11:
+        chiffres = '0' + chiffres[2:]
+    return chiffres
+
+
+def requete_fts(recherche):
+    """Transforme une saisie libre en requête FTS5 : chaque mot devient un préfixe"""
+    mots = re.findall(r'\w+', recherche)
+    return ' '.join(f'"{mot}"*' for mot in mots)
+
+
+def date_vers_iso(valeur):
+    """Convertit une date (objet date ou texte JJ/MM/AAAA / AAAA-MM-JJ) en AAAA-MM-JJ"""
+    if isinstance(valeur, datetime):
+        return valeur.date().isoformat()
+    if isinstance(valeur, date):
+        return valeur.isoformat()
+    try:
+        return datetime.strptime(valeur, FORMAT_SAISIE).date().isoformat()
+    except ValueError:
+        return date.fromisoformat(valeur).isoformat()
+
+
+def date_affichage(valeur):
+    """Convertit une date stockée AAAA-MM-JJ en JJ/MM/AAAA pour l'affichage"""
+    try:
+        return date.fromisoformat(valeur).strftime(FORMAT_SAISIE)
+    except (TypeError, ValueError):
+        return valeur
+
+
+# Priorité d'une relance selon son échéance : rang numérique (0 = le plus
+# urgent) pour les tris, libellé pour l'affichage
+PRIORITES = ('urgent', 'haute', 'moyenne', 'basse')
+RANG_PRIORITE_SQL = (
+    "CASE WHEN date_relance < :aujourd_hui THEN 0 WHEN date_relance <= :j3 THEN 1 "
+    "WHEN date_relance <= :j7 THEN 2 ELSE 3 END"
+)
+
+
+PRIORITE_SQL = ('CASE ' + RANG_PRIORITE_SQL + ' '
+                + ' '.join(f"WHEN {rang} THEN '{libelle}'" for rang, libelle in enumerate(PRIORITES)) + ' END')
+
+
+def params_priorite(aujourd_hui=None):
+    """Paramètres nommés de RANG_PRIORITE_SQL / PRIORITE_SQL"""
+    aujourd_hui = aujourd_hui or date.today()
+    return {
+        'aujourd_hui': aujourd_hui.isoformat(),
+        'j3': (aujourd_hui + timedelta(days=3)).isoformat(),
+        'j7': (aujourd_hui + timedelta(days=7)).isoformat(),
+    }
+
+
+def rang_priorite(date_iso, aujourd_hui=None):
+    """Rang de priorité d'une échéance AAAA-MM-JJ (même règle que RANG_PRIORITE_SQL)"""
+    delta = (date.fromisoformat(date_iso) - (aujourd_hui or date.today())).days
+    if delta < 0:
+        return 0
+    if delta <= 3:
+        return 1
+    if delta <= 7:
+        return 2
+    return 3
+
+
+# Règles de relance récurrentes, enregistrées une fois par client : « tous les
+# N jours jusqu'au départ » (intervalle) ou jalons avant la date de référence
+# (jalons '30,15,7,1' pour J-30, J-15, J-7, J-1). Les occurrences ne sont pas
+# stockées : seule la prochaine devient une relance, le jour où elle est due.
+def occurrence_suivante(intervalle, jalons, date_debut, date_reference, apres):
+    """Première occurrence (AAAA-MM-JJ) d'une règle strictement après `apres`,
+    ou None si la règle est terminée. Enregistrée comme fonction SQL."""
+    debut = date.fromisoformat(date_debut)
+    fin = date.fromisoformat(date_reference)
+    apres = date.fromisoformat(apres)
+    if intervalle:
+        pas = max(0, (apres - debut).days // intervalle + 1)
+        jour = debut + timedelta(days=pas * intervalle)
+        return jour.isoformat() if jour <= fin else None
+    for jours_avant in jalons.split(','):
+        # Jalons décroissants : dates croissantes
+        jour = fin - timedelta(days=int(jours_avant))
+        if jour > apres and jour >= debut:
+            return jour.isoformat()
+    return None
+
+
+def libelle_occurrence(intervalle, date_reference, jour):
+    """Type de relance d'une occurrence (même règle que LIBELLE_OCCURRENCE_SQL)"""
+    if intervalle:
+        return f'tous les {intervalle}j'
+    return f'J-{(date.fromisoformat(date_reference) - date.fromisoformat(jour)).days}'
+
+
+LIBELLE_OCCURRENCE_SQL = (
+    "CASE WHEN intervalle IS NOT NULL THEN 'tous les ' || intervalle || 'j' "
+    "ELSE 'J-' || CAST(julianday(date_reference) - julianday(date_relance) AS INTEGER) END"
+)
+
+# Occurrences à venir des règles, déroulées à la lecture par une CTE récursive
+# (à placer après WITH RECURSIVE) ; les lignes dont date_relance <= :limite
+# sont les occurrences de la période. Si la prochaine occurrence est déjà une
+# relance, on part de la suivante. Les occurrences virtuelles commencent à
+# :aujourd_hui : une relance en retard n'engendre pas de retards fictifs
+# (seule une occurrence due pas encore matérialisée peut être passée).
+OCCURRENCES_SQL = '''
+    occurrences(regle_id, client_id, intervalle, jalons, date_debut, date_reference, date_relance) AS (
+        SELECT id, client_id, intervalle, jalons, date_debut, date_reference,
+               CASE WHEN relance_id IS NULL THEN prochaine_date
+                    ELSE occurrence_suivante(intervalle, jalons, date_debut, date_reference,
+                                             max(prochaine_date, date(:aujourd_hui, '-1 day'))) END
+        FROM regles_relance
+        WHERE prochaine_date IS NOT NULL AND prochaine_date <= :limite
+        UNION ALL
+        SELECT regle_id, client_id, intervalle, jalons, date_debut, date_reference,
+               occurrence_suivante(intervalle, jalons, date_debut, date_reference,
+                                   max(date_relance, date(:aujourd_hui, '-1 day')))
+        FROM occurrences
+        WHERE date_relance <= :limite
+    )
+'''
+
+
+# Colonnes d'origine des clients, dans l'ordre attendu par les handlers
+# (les colonnes ajoutées par les migrations ne sont pas renvoyées)
+COLONNES_CLIENT = 'id, nom, telephone, email, source, type_demande, destination, statut, date_creation, agent_id'
+COLONNES_CLIENT_QUALIFIEES = ', '.join('clients.' + col for col in COLONNES_CLIENT.split(', '))
+COLONNES_RELANCE = ('id, client_id, date_relance, type_relance, priorite, statut, notes, '
+                    'date_creation, date_effectuee, resultat')
+COLONNES_RELANCE_R = ', '.join('r.' + col for col in COLONNES_RELANCE.split(', '))
+
+
+# Exports : requête, colonnes filtrables (statut, agent, date) et en-têtes
+EXPORTS = {
+    'clients': (
+        f'SELECT {COLONNES_CLIENT_QUALIFIEES}, agents.nom FROM clients LEFT JOIN agents ON agents.id = clients.agent_id',
+        {'statut': 'clients.statut', 'agent': 'clients.agent_id', 'date': 'clients.date_creation'},
+        'clients.id',
+        COLONNES_CLIENT.split(', ') + ['agent_nom'],
+    ),
+    'relances': (
+        f'SELECT {COLONNES_RELANCE_R}, r.heure_relance, c.nom, c.agent_id '
+        'FROM relances r JOIN clients c ON c.id = r.client_id',
+        {'statut': 'r.statut', 'agent': 'c.agent_id', 'date': 'r.date_relance'},
+        'r.id',
+        COLONNES_RELANCE.split(', ') + ['heure_relance', 'client_nom', 'agent_id'],
+    ),
+    'historique': (
+        'SELECT h.id, h.client_id, c.nom, h.action, h.details, h.date_action, h.agent_id, a.nom '
+        'FROM historique h LEFT JOIN clients c ON c.id = h.client_id LEFT JOIN agents a ON a.id = h.agent_id',
+        {'statut': 'c.statut', 'agent': 'h.agent_id', 'date': 'h.date_action'},
+        'h.id',
+        ['id', 'client_id', 'client_nom', 'action', 'details', 'date_action', 'agent_id', 'agent_nom'],
+    ),
+}
+
+
+def compresser_entrees(entrees):
+    """Entrées d'historique archivées [id, action, details, date_action, agent_id] -> BLOB"""
+    return zlib.compress(json.dumps(entrees, ensure_ascii=False).encode())
+
+
+def decompresser_entrees(donnees):
+    return json.loads(zlib.decompress(donnees))
+
 
 class Database:
-    def __init__(self):
-        db_path = '/app/data/relances.db'
-        if not os.path.exists('/app/data'):
-            db_path = 'relances.db'
-        os.makedirs(os.path.dirname(db_path), exist_ok=True)
-        self.conn = sqlite3.connect(db_path, check_same_thread=False)
-        self.c = self.conn.cursor()
-        self._init_db()
+    # Nombre de résultats de recherche renvoyés, et nombre de correspondances
+    # (les plus récentes) classées par pertinence
+    LIMITE_RECHERCHE = 20
+    TAILLE_PAGE = 8
+    CANDIDATS_RECHERCHE = 500
+    # Archivage de l'historique : lignes déplacées par transaction, et pages
+    # rendues au système par appel à compacter() (4 Ko chacune)
+    TAILLE_LOT_ARCHIVE = 500
+    TAILLE_BLOC_ARCHIVE = 2000
+    PAGES_COMPACTAGE = 2000
+
+    def __init__(self, db_path=None, initialiser=True, mode=None, lecture_seule=False, compteurs=None):
+        if db_path is None:
+            db_path = '/app/data/relances.db'
+            if not os.path.exists('/app/data'):
+                db_path = 'relances.db'
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self.mode = mode or MODE_DEFAUT
+        self.conn = sqlite3.connect(db_path, timeout=5, check_same_thread=False)
+        self.conn.create_function('occurrence_suivante', 5, occurrence_suivante, deterministic=True)
+        # Curseur chronométré (requêtes lentes) seulement si les métriques sont actives
+        self.c = self.conn.cursor(CurseurInstrumente) if metriques.actif else self.conn.cursor()
+        self._profondeur = 0
+        self._compteurs_actifs = None
+        # Fonction appelée avec l'id de chaque client modifié, après le commit
+        # (invalidation des fiches en cache)
+        self.sur_modification_client = None
+        self._clients_modifies = set()
+        if initialiser:
+            # Sans effet sur une base existante tant qu'elle n'a pas été
+            # reconstruite (_activer_vacuum_incremental) ; doit précéder le passage en WAL
+            self.c.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        if self.mode == 'wal':
+            for pragma in PRAGMAS_WAL:
+                self.c.execute(pragma)
+        if lecture_seule:
+            self.c.execute('PRAGMA query_only = ON')
+        if initialiser:
+            self._init_db()
+            self._migrer()
+            self._activer_vacuum_incremental()
+            self._configurer_compteurs(COMPTEURS_DEFAUT if compteurs is None else compteurs)
 
     def _init_db(self):
         # Table agents (admins)
@@ -69,11 +312,364 @@ class Database:
         ''')
         self.conn.commit()
 
+    # ----- Transactions -----
+    @contextmanager
+    def transaction(self):
+        """Regroupe plusieurs écritures en une seule transaction (un seul commit).
+        Les appels imbriqués utilisent des savepoints."""
+        if self._profondeur == 0:
+            self.conn.execute('BEGIN IMMEDIATE')
+        else:
+            self.conn.execute(f'SAVEPOINT sp{self._profondeur}')
+        self._profondeur += 1
+        try:
+            yield self
+        except BaseException:
+            self._profondeur -= 1
+            if self._profondeur == 0:
+                self.conn.rollback()
+                self._clients_modifies.clear()
+            else:
+                self.conn.execute(f'ROLLBACK TO sp{self._profondeur}')
+                self.conn.execute(f'RELEASE sp{self._profondeur}')
+            raise
+        else:
+            self._profondeur -= 1
+            if self._profondeur == 0:
+                self.conn.commit()
+                self._notifier_modifications()
+            else:
+                self.conn.execute(f'RELEASE sp{self._profondeur}')
+
+    def _commit(self):
+        # Dans une transaction, le commit est fait à la sortie du bloc
+        if self._profondeur == 0:
+            self.conn.commit()
+            self._notifier_modifications()
+
+    def _client_modifie(self, client_id):
+        if self.sur_modification_client is not None and client_id is not None:
+            self._clients_modifies.add(client_id)
+
+    def _notifier_modifications(self):
+        # Après le commit seulement : un lecteur qui relit le client voit la nouvelle version
+        if self._clients_modifies:
+            modifies = list(self._clients_modifies)
+            self._clients_modifies.clear()
+            for client_id in modifies:
+                self.sur_modification_client(client_id)
+
+    # ----- Pagination -----
+    def _page(self, requete, params, cles, limite, apres=None, avant=None, decroissant=False):
+        """Pagination par clé (keyset) : `requete` se termine par une clause WHERE,
+        `cles` sont les colonnes (uniques ensemble) qui ordonnent la liste.
+        `apres` / `avant` sont les valeurs de clé du dernier / premier élément
+        de la page courante. Renvoie (lignes, page_precedente, page_suivante)."""
+        colonnes = ', '.join(cles)
+        marqueurs = ', '.join('?' * len(cles))
+        recule = avant is not None
+        if recule:
+            requete += f" AND ({colonnes}) {'>' if decroissant else '<'} ({marqueurs})"
+            params = tuple(params) + tuple(avant)
+        elif apres is not None:
+            requete += f" AND ({colonnes}) {'<' if decroissant else '>'} ({marqueurs})"
+            params = tuple(params) + tuple(apres)
+        # En reculant on parcourt l'index dans l'autre sens puis on remet la page à l'endroit
+        sens = 'DESC' if decroissant != recule else 'ASC'
+        requete += ' ORDER BY ' + ', '.join(f'{col} {sens}' for col in cles) + ' LIMIT ?'
+        self.c.execute(requete, tuple(params) + (limite + 1,))
+        lignes = self.c.fetchall()
+        encore = len(lignes) > limite
+        lignes = lignes[:limite]
+        if recule:
+            lignes.reverse()
+            return lignes, encore, True
+        return lignes, apres is not None, encore
+
+    # ----- Migrations -----
+    # Chaque migration est appliquée une seule fois ; PRAGMA user_version
+    # mémorise le numéro de la dernière migration appliquée.
+    def _migrer(self):
+        version = self.c.execute('PRAGMA user_version').fetchone()[0]
+        for numero, migration in enumerate(self._MIGRATIONS, start=1):
+            if version >= numero:
+                continue
+            with self.transaction():
+                migration(self)
+                self.c.execute(f'PRAGMA user_version = {numero}')
+
+    def _migration_dates_iso(self):
+        # Les dates de relance étaient stockées en JJ/MM/AAAA : on les passe en
+        # AAAA-MM-JJ pour que les comparaisons de texte suivent l'ordre des dates
+        self.c.execute('''
+            UPDATE relances
+            SET date_relance = substr(date_relance, 7, 4) || '-' || substr(date_relance, 4, 2) || '-' || substr(date_relance, 1, 2)
+            WHERE date_relance GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9]'
+        ''')
+        self.c.execute('CREATE INDEX IF NOT EXISTS idx_relances_statut_date ON relances(statut, date_relance)')
+        self.c.execute('CREATE INDEX IF NOT EXISTS idx_relances_client_date ON relances(client_id, date_relance)')
+
+    def _migration_recherche(self):
+        # Téléphone réduit à ses chiffres (et à l'envers, pour chercher par la
+        # fin du numéro) : les correspondances partielles deviennent des
+        # parcours d'index par préfixe
+        self.c.execute('ALTER TABLE clients ADD COLUMN telephone_normalise TEXT')
+        self.c.execute('ALTER TABLE clients ADD COLUMN telephone_inverse TEXT')
+        self.c.execute("SELECT id, telephone FROM clients WHERE telephone IS NOT NULL AND telephone != ''")
+        lignes = [(normaliser_telephone(tel), normaliser_telephone(tel)[::-1], cid) for cid, tel in self.c.fetchall()]
+        self.c.executemany('UPDATE clients SET telephone_normalise = ?, telephone_inverse = ? WHERE id = ?', lignes)
+        self.c.execute('CREATE INDEX idx_clients_telephone ON clients(telephone_normalise)')
+        self.c.execute('CREATE INDEX idx_clients_telephone_inverse ON clients(telephone_inverse)')
+
+        # Index plein texte sur nom, email, destination et source, tenu à jour par triggers
+        self.c.execute('''
+            CREATE VIRTUAL TABLE clients_fts USING fts5(
+                nom, email, destination, source,
+                content='clients', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        ''')
+        self.c.execute('''
+            CREATE TRIGGER clients_fts_ai AFTER INSERT ON clients BEGIN
+                INSERT INTO clients_fts(rowid, nom, email, destination, source)
+                VALUES (new.id, new.nom, new.email, new.destination, new.source);
+            END
+        ''')
+        self.c.execute('''
+            CREATE TRIGGER clients_fts_ad AFTER DELETE ON clients BEGIN
+                INSERT INTO clients_fts(clients_fts, rowid, nom, email, destination, source)
+                VALUES ('delete', old.id, old.nom, old.email, old.destination, old.source);
+            END
+        ''')
+        self.c.execute('''
+            CREATE TRIGGER clients_fts_au AFTER UPDATE OF nom, email, destination, source ON clients BEGIN
+                INSERT INTO clients_fts(clients_fts, rowid, nom, email, destination, source)
+                VALUES ('delete', old.id, old.nom, old.email, old.destination, old.source);
+                INSERT INTO clients_fts(rowid, nom, email, destination, source)
+                VALUES (new.id, new.nom, new.email, new.destination, new.source);
+            END
+        ''')
+        self.c.execute("INSERT INTO clients_fts(clients_fts) VALUES ('rebuild')")
+
+    def _migration_index_statistiques(self):
+        self.c.execute('CREATE INDEX IF NOT EXISTS idx_clients_agent_statut ON clients(agent_id, statut)')
+
+    def _migration_heure_relance(self):
+        # Heure optionnelle (HH:MM) ; l'index partiel ne couvre que les relances
+        # programmées avec une heure, celles que le planificateur charge
+        self.c.execute('ALTER TABLE relances ADD COLUMN heure_relance TEXT')
+        self.c.execute('''
+            CREATE INDEX idx_relances_horaires ON relances(date_relance, heure_relance)
+            WHERE statut = 'programmee' AND heure_relance IS NOT NULL
+        ''')
+
+    def _migration_etats(self):
+        # Données utilisateur / chat / bot de l'application Telegram (persistance)
+        self.c.execute('''
+            CREATE TABLE etats (
+                type TEXT NOT NULL,
+                cle INTEGER NOT NULL,
+                donnees TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                PRIMARY KEY (type, cle)
+            ) WITHOUT ROWID
+        ''')
+
+    def _migration_import(self):
+        # Détection des doublons à l'import : email comparé sans la casse
+        self.c.execute('CREATE INDEX idx_clients_email ON clients(lower(email))')
+
+    def _migration_index_historique(self):
+        # Fiche client (nombre d'entrées) et historique paginé par date
+        self.c.execute('CREATE INDEX idx_historique_client_date ON historique(client_id, date_action)')
+
+    def _migration_rang_priorite(self):
+        # La priorité texte était figée à la création et triée comme du texte ;
+        # le rang numérique est recalculé chaque jour (recalculer_priorites)
+        self.c.execute('ALTER TABLE relances ADD COLUMN rang_priorite INTEGER')
+        self.recalculer_priorites()
+
+    def _migration_regles_relance(self):
+        # Relances récurrentes : une ligne par règle, relances.regle_id relie
+        # l'occurrence en cours à sa règle
+        self.c.execute('''
+            CREATE TABLE regles_relance (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                client_id INTEGER NOT NULL,
+                intervalle INTEGER,
+                jalons TEXT,
+                date_debut TEXT NOT NULL,
+                date_reference TEXT NOT NULL,
+                prochaine_date TEXT,
+                relance_id INTEGER,
+                date_creation TIMESTAMP,
+                FOREIGN KEY(client_id) REFERENCES clients(id) ON DELETE CASCADE
+            )
+        ''')
+        self.c.execute('''
+            CREATE INDEX idx_regles_prochaine ON regles_relance(prochaine_date)
+            WHERE prochaine_date IS NOT NULL
+        ''')
+        self.c.execute('ALTER TABLE relances ADD COLUMN regle_id INTEGER')
+
+    def _migration_archive_historique(self):
+        # Historique ancien, compressé : des blocs d'au plus TAILLE_BLOC_ARCHIVE
+        # entrées par client et par année (assez pour que zlib y gagne) ; l'index
+        # sur la date trouve les lignes à archiver
+        self.c.execute('''
+            CREATE TABLE historique_archive (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                client_id INTEGER NOT NULL,
+                annee TEXT NOT NULL,
+                nb INTEGER NOT NULL,
+                donnees BLOB NOT NULL,
+                FOREIGN KEY(client_id) REFERENCES clients(id) ON DELETE CASCADE
+            )
+        ''')
+        self.c.execute('CREATE INDEX idx_historique_archive_client ON historique_archive(client_id, annee)')
+        self.c.execute('CREATE INDEX idx_historique_date ON historique(date_action)')
+
+    def _activer_vacuum_incremental(self):
+        # Une base créée avant le mode incrémental doit être reconstruite une
+        # fois (VACUUM complet, au démarrage : rien d'autre n'écrit encore)
+        if self.c.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+            return
+        logger.warning("Conversion de %s en vacuum incrémental (VACUUM complet, une seule fois)", self.db_path)
+        self.c.execute('VACUUM')
+
+    _MIGRATIONS = (
+        _migration_dates_iso,
+        _migration_recherche,
+        _migration_index_statistiques,
+        _migration_heure_relance,
+        _migration_etats,
+        _migration_import,
+        _migration_index_historique,
+        _migration_rang_priorite,
+        _migration_regles_relance,
+        _migration_archive_historique,
+    )
+
+    # ----- Compteurs matérialisés -----
+    # compteurs_clients : nombre de clients par (agent, statut, mois de création)
+    # compteurs_relances : nombre de relances programmées par (agent, date)
+    # L'agent 0 regroupe les clients sans agent. Les triggers reportent chaque
+    # écriture sur clients / relances ; get_statistiques n'a plus qu'à sommer
+    # quelques lignes.
+    TRIGGERS_COMPTEURS = (
+        '''CREATE TRIGGER IF NOT EXISTS compteurs_clients_ai AFTER INSERT ON clients BEGIN
+            INSERT INTO compteurs_clients (agent_id, statut, mois, nb)
+            VALUES (coalesce(new.agent_id, 0), new.statut, substr(new.date_creation, 1, 7), 1)
+            ON CONFLICT DO UPDATE SET nb = nb + 1;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS compteurs_clients_ad AFTER DELETE ON clients BEGIN
+            UPDATE compteurs_clients SET nb = nb - 1
+            WHERE agent_id = coalesce(old.agent_id, 0) AND statut = old.statut AND mois = substr(old.date_creation, 1, 7);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS compteurs_clients_au AFTER UPDATE OF statut, agent_id ON clients BEGIN
+            UPDATE compteurs_clients SET nb = nb - 1
+            WHERE agent_id = coalesce(old.agent_id, 0) AND statut = old.statut AND mois = substr(old.date_creation, 1, 7);
+            INSERT INTO compteurs_clients (agent_id, statut, mois, nb)
+            VALUES (coalesce(new.agent_id, 0), new.statut, substr(new.date_creation, 1, 7), 1)
+            ON CONFLICT DO UPDATE SET nb = nb + 1;
+        END''',
+        # Changement d'agent : ses relances programmées changent de portefeuille
+        '''CREATE TRIGGER IF NOT EXISTS compteurs_clients_agent AFTER UPDATE OF agent_id ON clients
+        WHEN coalesce(old.agent_id, 0) != coalesce(new.agent_id, 0) BEGIN
+            UPDATE compteurs_relances SET nb = nb - (
+                SELECT COUNT(*) FROM relances
+                WHERE client_id = new.id AND statut = 'programmee' AND date_relance = compteurs_relances.date_relance
+            )
+            WHERE agent_id = coalesce(old.agent_id, 0) AND date_relance IN (
+                SELECT date_relance FROM relances WHERE client_id = new.id AND statut = 'programmee'
+            );
+            INSERT INTO compteurs_relances (agent_id, date_relance, nb)
+            SELECT coalesce(new.agent_id, 0), date_relance, COUNT(*) FROM relances
+            WHERE client_id = new.id AND statut = 'programmee' GROUP BY date_relance
+            ON CONFLICT DO UPDATE SET nb = nb + excluded.nb;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS compteurs_relances_ai AFTER INSERT ON relances
+        WHEN new.statut = 'programmee' BEGIN
+            INSERT INTO compteurs_relances (agent_id, date_relance, nb)
+            VALUES (coalesce((SELECT agent_id FROM clients WHERE id = new.client_id), 0), new.date_relance, 1)
+            ON CONFLICT DO UPDATE SET nb = nb + 1;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS compteurs_relances_ad AFTER DELETE ON relances
+        WHEN old.statut = 'programmee' BEGIN
+            UPDATE compteurs_relances SET nb = nb - 1
+            WHERE agent_id = coalesce((SELECT agent_id FROM clients WHERE id = old.client_id), 0)
+              AND date_relance = old.date_relance;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS compteurs_relances_au AFTER UPDATE OF statut, date_relance, client_id ON relances BEGIN
+            UPDATE compteurs_relances SET nb = nb - 1
+            WHERE old.statut = 'programmee'
+              AND agent_id = coalesce((SELECT agent_id FROM clients WHERE id = old.client_id), 0)
+              AND date_relance = old.date_relance;
+            INSERT INTO compteurs_relances (agent_id, date_relance, nb)
+            SELECT coalesce((SELECT agent_id FROM clients WHERE id = new.client_id), 0), new.date_relance, 1
+            WHERE new.statut = 'programmee'
+            ON CONFLICT DO UPDATE SET nb = nb + 1;
+        END''',
+        # Les dates écoulées sans relance programmée disparaissent de la table
+        '''CREATE TRIGGER IF NOT EXISTS compteurs_relances_vide AFTER UPDATE OF nb ON compteurs_relances
+        WHEN new.nb <= 0 BEGIN
+            DELETE FROM compteurs_relances WHERE agent_id = new.agent_id AND date_relance = new.date_relance;
+        END''',
+    )
+
+    def _configurer_compteurs(self, actifs):
+        existe = self._table_existe('compteurs_clients')
+        if not actifs:
+            if existe:
+                # Désactivés : on supprime tout plutôt que de laisser des compteurs périmés
+                with self.transaction():
+                    for trigger in ('compteurs_clients_ai', 'compteurs_clients_ad', 'compteurs_clients_au',
+                                    'compteurs_clients_agent', 'compteurs_relances_ai', 'compteurs_relances_ad',
+                                    'compteurs_relances_au'):
+                        self.c.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+                    self.c.execute('DROP TABLE compteurs_clients')
+                    self.c.execute('DROP TABLE compteurs_relances')
+            return
+        if existe:
+            return
+        with self.transaction():
+            self.c.execute('''
+                CREATE TABLE compteurs_clients (
+                    agent_id INTEGER, statut TEXT, mois TEXT, nb INTEGER NOT NULL,
+                    PRIMARY KEY (agent_id, statut, mois)
+                ) WITHOUT ROWID
+            ''')
+            self.c.execute('''
+                CREATE TABLE compteurs_relances (
+                    agent_id INTEGER, date_relance TEXT, nb INTEGER NOT NULL,
+                    PRIMARY KEY (agent_id, date_relance)
+                ) WITHOUT ROWID
+            ''')
+            # Remplissage initial à partir des données existantes
+            self.c.execute('''
+                INSERT INTO compteurs_clients (agent_id, statut, mois, nb)
+                SELECT coalesce(agent_id, 0), statut, substr(date_creation, 1, 7), COUNT(*)
+                FROM clients GROUP BY 1, 2, 3
+            ''')
+            self.c.execute('''
+                INSERT INTO compteurs_relances (agent_id, date_relance, nb)
+                SELECT coalesce(c.agent_id, 0), r.date_relance, COUNT(*)
+                FROM relances r LEFT JOIN clients c ON r.client_id = c.id
+                WHERE r.statut = 'programmee' GROUP BY 1, 2
+            ''')
+            for trigger in self.TRIGGERS_COMPTEURS:
+                self.c.execute(trigger)
+
+    def _table_existe(self, nom):
+        self.c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (nom,))
+        return self.c.fetchone() is not None
+
     # ----- Gestion des agents -----
+    @ecriture
     def ajouter_agent(self, telegram_id, nom="", role="agent"):
         self.c.execute('INSERT OR IGNORE INTO agents (telegram_id, nom, role) VALUES (?, ?, ?)',
                       (telegram_id, nom, role))
-        self.conn.commit()
+        self._commit()
         return self.c.lastrowid
 
     def get_agent(self, telegram_id):
@@ -88,118 +684,427 @@ class Database:
         self.c.execute('SELECT * FROM agents')
         return self.c.fetchall()
 
+    @ecriture
     def supprimer_agent(self, agent_id):
         self.c.execute('DELETE FROM agents WHERE id = ?', (agent_id,))
-        self.conn.commit()
+        self._commit()
 
     # ----- Gestion des clients -----
+    @ecriture
     def ajouter_client(self, nom, telephone='', email='', source='', type_demande='', destination='', agent_id=None):
+        tel_normalise = normaliser_telephone(telephone)
         self.c.execute('''
-            INSERT INTO clients (nom, telephone, email, source, type_demande, destination, date_creation, agent_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (nom, telephone, email, source, type_demande, destination, datetime.now(), agent_id))
-        self.conn.commit()
+            INSERT INTO clients (nom, telephone, email, source, type_demande, destination, date_creation, agent_id,
+                                 telephone_normalise, telephone_inverse)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (nom, telephone, email, source, type_demande, destination, datetime.now(), agent_id,
+              tel_normalise, tel_normalise[::-1]))
+        self._commit()
         return self.c.lastrowid
 
     def get_client(self, client_id):
-        self.c.execute('SELECT * FROM clients WHERE id = ?', (client_id,))
+        self.c.execute(f'SELECT {COLONNES_CLIENT} FROM clients WHERE id = ?', (client_id,))
         return self.c.fetchone()
 
-    def rechercher_clients(self, recherche):
-        self.c.execute('''
-            SELECT * FROM clients
-            WHERE nom LIKE ? OR telephone LIKE ? OR email LIKE ?
-            ORDER BY date_creation DESC
-        ''', (f'%{recherche}%', f'%{recherche}%', f'%{recherche}%'))
+    def get_fiche_client(self, client_id):
+        """Tout ce qu'affiche la fiche, en une requête : renvoie (client,
+        relances, nb_historique) ou None. Les 3 relances les plus utiles :
+        d'abord celles à faire (la plus ancienne échéance en premier), puis les
+        dernières effectuées."""
+        self.c.execute(f'''
+            SELECT {COLONNES_CLIENT_QUALIFIEES},
+                   (SELECT COUNT(*) FROM historique h WHERE h.client_id = clients.id),
+                   r.*
+            FROM clients
+            LEFT JOIN (
+                SELECT {COLONNES_RELANCE},
+                       ROW_NUMBER() OVER (ORDER BY statut = 'programmee' DESC,
+                                          CASE WHEN statut = 'programmee' THEN date_relance END,
+                                          date_relance DESC) AS rang
+                FROM relances WHERE client_id = ?
+            ) r ON r.rang <= 3
+            WHERE clients.id = ?
+            ORDER BY r.rang
+        ''', (client_id, client_id))
+        lignes = self.c.fetchall()
+        if not lignes:
+            return None
+        client, nb_historique = lignes[0][:10], lignes[0][10]
+        relances = [ligne[11:21] for ligne in lignes if ligne[11] is not None]
+        return client, relances, nb_historique
+
+    def clients_existants(self, telephones, emails):
+        """Parmi les téléphones normalisés et emails (en minuscules) donnés,
+        renvoie ceux qui existent déjà : (set de téléphones, set d'emails)"""
+        trouves = []
+        for colonne, valeurs in (('telephone_normalise', list(telephones)), ('lower(email)', list(emails))):
+            existants = set()
+            for i in range(0, len(valeurs), 500):
+                morceau = valeurs[i:i + 500]
+                self.c.execute(f'SELECT {colonne} FROM clients WHERE {colonne} IN ({",".join("?" * len(morceau))})',
+                               morceau)
+                existants.update(ligne[0] for ligne in self.c.fetchall())
+            trouves.append(existants)
+        return tuple(trouves)
+
+    @ecriture
+    def importer_clients(self, clients, agent_id=None, details='Import de fichier'):
+        """Insère un lot de clients (nom, telephone, email, source, type_demande,
+        destination) et leurs entrées d'historique, en deux requêtes groupées.
+        Renvoie le nombre de clients insérés."""
+        maintenant = datetime.now()
+        lignes = []
+        for nom, telephone, email, source, type_demande, destination in clients:
+            tel_normalise = normaliser_telephone(telephone)
+            lignes.append((nom, telephone, email, source, type_demande, destination, maintenant, agent_id,
+                           tel_normalise, tel_normalise[::-1]))
+        with self.transaction():
+            self.c.execute('SELECT COALESCE(MAX(id), 0) FROM clients')
+            dernier_id = self.c.fetchone()[0]
+            self.c.executemany('''
+                INSERT INTO clients (nom, telephone, email, source, type_demande, destination, date_creation, agent_id,
+                                     telephone_normalise, telephone_inverse)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', lignes)
+            # Les ids sont croissants : les clients du lot sont ceux au-delà de dernier_id
+            self.c.execute('''
+                INSERT INTO historique (client_id, action, details, date_action, agent_id)
+                SELECT id, 'import', ?, ?, ? FROM clients WHERE id > ?
+            ''', (details, maintenant, agent_id, dernier_id))
+        return len(lignes)
+
+    def rechercher_clients(self, recherche, limite=None):
+        limite = limite or self.LIMITE_RECHERCHE
+        recherche = recherche.strip()
+        chiffres = normaliser_telephone(recherche)
+        # Saisie numérique : recherche par début ou fin de numéro
+        if len(chiffres) >= 3 and not re.search(r'[^\d\s+().-]', recherche):
+            self.c.execute(f'''
+                SELECT {COLONNES_CLIENT} FROM clients
+                WHERE (telephone_normalise >= ? AND telephone_normalise < ?)
+                   OR (telephone_inverse >= ? AND telephone_inverse < ?)
+                ORDER BY telephone_normalise = ? DESC, id DESC
+                LIMIT ?
+            ''', (chiffres, chiffres + ':', chiffres[::-1], chiffres[::-1] + ':', chiffres, limite))
+            return self.c.fetchall()
+
+        requete = requete_fts(recherche)
+        if not requete:
+            return []
+        # Les correspondances sont lues de la plus récente à la plus ancienne et
+        # seules les CANDIDATS_RECHERCHE premières sont classées (bm25, le nom
+        # pèse le plus) : le coût reste borné quelle que soit la taille de la table
+        self.c.execute(f'''
+            SELECT {COLONNES_CLIENT}
+            FROM (
+                SELECT rowid AS fts_id, bm25(clients_fts, 10.0, 5.0, 2.0, 1.0) AS score
+                FROM clients_fts WHERE clients_fts MATCH ?
+                ORDER BY rowid DESC LIMIT ?
+            )
+            JOIN clients ON clients.id = fts_id
+            ORDER BY score, fts_id DESC
+            LIMIT ?
+        ''', (requete, self.CANDIDATS_RECHERCHE, limite))
         return self.c.fetchall()
 
+    def rechercher_clients_page(self, recherche, limite=None, apres=None, avant=None):
+        """Résultats de recherche par pages, dans l'ordre de rechercher_clients.
+        Chaque ligne se termine par sa clé de pagination, qui sert de curseur
+        (tuple à un élément) : l'id pour une recherche par téléphone (du plus
+        récent au plus ancien), le rang de pertinence sinon."""
+        limite = limite or self.TAILLE_PAGE
+        recherche = recherche.strip()
+        chiffres = normaliser_telephone(recherche)
+        if len(chiffres) >= 3 and not re.search(r'[^\d\s+().-]', recherche):
+            requete = f'''
+                SELECT {COLONNES_CLIENT}, id AS cle FROM clients
+                WHERE ((telephone_normalise >= ? AND telephone_normalise < ?)
+                    OR (telephone_inverse >= ? AND telephone_inverse < ?))
+            '''
+            params = (chiffres, chiffres + ':', chiffres[::-1], chiffres[::-1] + ':')
+            return self._page(requete, params, ('id',), limite, apres, avant, decroissant=True)
+
+        requete_texte = requete_fts(recherche)
+        if not requete_texte:
+            return [], False, False
+        # Mêmes candidats et même classement que rechercher_clients ; le rang
+        # (bm25 puis le plus récent) est unique et sert de clé de pagination
+        requete = f'''
+            SELECT * FROM (
+                SELECT {COLONNES_CLIENT_QUALIFIEES}, ROW_NUMBER() OVER (ORDER BY score, fts_id DESC) AS cle
+                FROM (
+                    SELECT rowid AS fts_id, bm25(clients_fts, 10.0, 5.0, 2.0, 1.0) AS score
+                    FROM clients_fts WHERE clients_fts MATCH ?
+                    ORDER BY rowid DESC LIMIT ?
+                )
+                JOIN clients ON clients.id = fts_id
+            )
+            WHERE TRUE
+        '''
+        return self._page(requete, (requete_texte, self.CANDIDATS_RECHERCHE), ('cle',), limite, apres, avant)
+
     def get_clients_par_statut(self, statut):
-        self.c.execute('SELECT * FROM clients WHERE statut = ? ORDER BY date_creation DESC', (statut,))
+        self.c.execute(f'SELECT {COLONNES_CLIENT} FROM clients WHERE statut = ? ORDER BY date_creation DESC', (statut,))
         return self.c.fetchall()
 
+    @ecriture
     def update_client_statut(self, client_id, statut):
         self.c.execute('UPDATE clients SET statut = ? WHERE id = ?', (statut, client_id))
-        self.conn.commit()
+        self._client_modifie(client_id)
+        self._commit()
 
     # ----- Gestion des relances -----
-    def ajouter_relance(self, client_id, date_relance, type_relance='personnalisee', notes=''):
+    @ecriture
+    def ajouter_relance(self, client_id, date_relance, type_relance='personnalisee', notes='', heure=None):
+        # Les dates sont stockées en AAAA-MM-JJ (triables et indexables)
+        date_relance = date_vers_iso(date_relance)
         # Calcul de la priorité en fonction de la date
-        try:
-            date_obj = datetime.strptime(date_relance, '%d/%m/%Y')
-            aujourd_hui = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-            delta = (date_obj - aujourd_hui).days
-            if delta < 0:
-                priorite = 'urgent'
-            elif delta == 0:
-                priorite = 'haute'
-            elif delta <= 3:
-                priorite = 'haute'
-            elif delta <= 7:
-                priorite = 'moyenne'
-            else:
-                priorite = 'basse'
-        except:
-            priorite = 'moyenne'
+        rang = rang_priorite(date_relance)
 
         self.c.execute('''
-            INSERT INTO relances (client_id, date_relance, type_relance, priorite, notes, date_creation)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (client_id, date_relance, type_relance, priorite, notes, datetime.now()))
-        self.conn.commit()
+            INSERT INTO relances (client_id, date_relance, type_relance, priorite, notes, date_creation, heure_relance,
+                                  rang_priorite)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (client_id, date_relance, type_relance, PRIORITES[rang], notes, datetime.now(), heure, rang))
+        self._client_modifie(client_id)
+        self._commit()
         return self.c.lastrowid
 
+    @ecriture
+    def recalculer_priorites(self, aujourd_hui=None):
+        """Remet à jour rang et libellé de priorité des relances programmées
+        selon leur échéance, en une requête ; seules les relances dont le rang
+        change sont réécrites. Renvoie leur nombre."""
+        self.c.execute(f'''
+            UPDATE relances
+            SET rang_priorite = {RANG_PRIORITE_SQL}, priorite = {PRIORITE_SQL}
+            WHERE statut = 'programmee' AND rang_priorite IS NOT {RANG_PRIORITE_SQL}
+        ''', params_priorite(aujourd_hui))
+        nb = self.c.rowcount
+        self._commit()
+        return nb
+
     def get_relances_du_jour(self):
-        aujourd_hui = datetime.now().strftime('%d/%m/%Y')
-        self.c.execute('''
-            SELECT r.*, c.nom FROM relances r
+        aujourd_hui = date.today().isoformat()
+        self.c.execute(f'''
+            SELECT {COLONNES_RELANCE_R}, c.nom FROM relances r
             JOIN clients c ON r.client_id = c.id
             WHERE r.date_relance = ? AND r.statut = 'programmee'
-            ORDER BY r.priorite DESC
+            ORDER BY r.rang_priorite, r.id
         ''', (aujourd_hui,))
         return self.c.fetchall()
 
+    def get_relances_du_jour_page(self, limite=None, apres=None, avant=None):
+        """Relances du jour par pages, les plus urgentes d'abord ; chaque ligne se
+        termine par le rang de priorité, le curseur est le couple (rang, id)"""
+        requete = f'''
+            SELECT {COLONNES_RELANCE_R}, c.nom, r.rang_priorite FROM relances r
+            JOIN clients c ON r.client_id = c.id
+            WHERE r.statut = 'programmee' AND r.date_relance = ?
+        '''
+        return self._page(requete, (date.today().isoformat(),), ('r.rang_priorite', 'r.id'),
+                          limite or self.TAILLE_PAGE, apres, avant)
+
     def get_relances_a_venir(self, jours=7):
-        from datetime import datetime, timedelta
-        aujourd_hui = datetime.now()
-        date_limite = (aujourd_hui + timedelta(days=jours)).strftime('%d/%m/%Y')
-        aujourd_hui_str = aujourd_hui.strftime('%d/%m/%Y')
-        self.c.execute('''
-            SELECT r.*, c.nom FROM relances r
+        """Relances programmées des `jours` prochains jours, y compris les
+        occurrences des règles récurrentes pas encore créées (id à None)"""
+        aujourd_hui = date.today()
+        params = params_priorite(aujourd_hui)
+        params['limite'] = (aujourd_hui + timedelta(days=jours)).isoformat()
+        self.c.execute(f'''
+            WITH RECURSIVE {OCCURRENCES_SQL}
+            SELECT {COLONNES_RELANCE_R}, c.nom FROM relances r
             JOIN clients c ON r.client_id = c.id
-            WHERE r.date_relance BETWEEN ? AND ? AND r.statut = 'programmee'
-            ORDER BY r.date_relance ASC
-        ''', (aujourd_hui_str, date_limite))
+            WHERE r.statut = 'programmee' AND r.date_relance BETWEEN :aujourd_hui AND :limite
+            UNION ALL
+            SELECT NULL, o.client_id, o.date_relance, {LIBELLE_OCCURRENCE_SQL}, {PRIORITE_SQL}, 'programmee', '',
+                   NULL, NULL, NULL, c.nom
+            FROM occurrences o
+            JOIN clients c ON o.client_id = c.id
+            WHERE o.date_relance BETWEEN :aujourd_hui AND :limite
+            ORDER BY 3
+        ''', params)
         return self.c.fetchall()
 
     def get_relances_en_retard(self):
-        aujourd_hui = datetime.now().strftime('%d/%m/%Y')
-        self.c.execute('''
-            SELECT r.*, c.nom FROM relances r
+        aujourd_hui = date.today().isoformat()
+        self.c.execute(f'''
+            SELECT {COLONNES_RELANCE_R}, c.nom FROM relances r
             JOIN clients c ON r.client_id = c.id
-            WHERE r.date_relance < ? AND r.statut = 'programmee'
+            WHERE r.statut = 'programmee' AND r.date_relance < ?
             ORDER BY r.date_relance ASC
         ''', (aujourd_hui,))
         return self.c.fetchall()
 
+    def get_relances_en_retard_page(self, limite=None, apres=None, avant=None):
+        """Relances en retard par pages, de la plus ancienne à la plus récente ;
+        le curseur est le couple (date_relance, id)"""
+        requete = f'''
+            SELECT {COLONNES_RELANCE_R}, c.nom FROM relances r
+            JOIN clients c ON r.client_id = c.id
+            WHERE r.statut = 'programmee' AND r.date_relance < ?
+        '''
+        return self._page(requete, (date.today().isoformat(),), ('r.date_relance', 'r.id'),
+                          limite or self.TAILLE_PAGE, apres, avant)
+
+    def get_resume_quotidien(self, jours=7, max_retard=5, max_jour=20, max_par_date=2):
+        """Données du rappel quotidien de tous les agents, en une requête.
+        Chaque ligne : (agent_id, telegram_id, categorie, date_relance, nom, total)
+        avec categorie 'retard', 'jour' ou 'a_venir' ; agent_id vaut 0 pour les
+        clients sans agent. Seules les premières relances de chaque catégorie
+        (de chaque date pour 'a_venir') sont renvoyées, `total` donne le nombre
+        complet. Les occurrences à venir des règles récurrentes sont comptées
+        comme des relances (id à None)."""
+        aujourd_hui = date.today()
+        self.c.execute(f'''
+            WITH RECURSIVE {OCCURRENCES_SQL}, echeances AS (
+                SELECT coalesce(c.agent_id, 0) AS agent_id, r.id, r.date_relance, c.nom
+                FROM relances r
+                JOIN clients c ON r.client_id = c.id
+                WHERE r.statut = 'programmee' AND r.date_relance <= :limite
+                UNION ALL
+                SELECT coalesce(c.agent_id, 0), NULL, o.date_relance, c.nom
+                FROM occurrences o
+                JOIN clients c ON o.client_id = c.id
+                WHERE o.date_relance <= :limite
+            ), dues AS (
+                SELECT *,
+                       CASE WHEN date_relance < :aujourd_hui THEN 'retard'
+                            WHEN date_relance = :aujourd_hui THEN 'jour'
+                            ELSE 'a_venir' END AS categorie
+                FROM echeances
+            ), classees AS (
+                SELECT *,
+                       ROW_NUMBER() OVER groupe AS rang,
+                       COUNT(*) OVER (PARTITION BY agent_id, categorie,
+                                      CASE WHEN categorie = 'a_venir' THEN date_relance END) AS total
+                FROM dues
+                WINDOW groupe AS (PARTITION BY agent_id, categorie,
+                                  CASE WHEN categorie = 'a_venir' THEN date_relance END
+                                  ORDER BY date_relance, id)
+            )
+            SELECT d.agent_id, a.telegram_id, d.categorie, d.date_relance, d.nom, d.total
+            FROM classees d
+            LEFT JOIN agents a ON a.id = d.agent_id
+            WHERE d.rang <= CASE d.categorie WHEN 'retard' THEN :max_retard
+                                             WHEN 'jour' THEN :max_jour
+                                             ELSE :max_par_date END
+            ORDER BY d.agent_id, d.date_relance, d.id
+        ''', {'aujourd_hui': aujourd_hui.isoformat(), 'limite': (aujourd_hui + timedelta(days=jours)).isoformat(),
+              'max_retard': max_retard, 'max_jour': max_jour, 'max_par_date': max_par_date})
+        return self.c.fetchall()
+
+    # Relances à heure fixe : colonnes lues par le planificateur
+    REQUETE_HORAIRES = '''
+        SELECT r.id, r.client_id, r.date_relance, r.heure_relance, c.nom, a.telegram_id
+        FROM relances r INDEXED BY idx_relances_horaires
+        JOIN clients c ON r.client_id = c.id
+        LEFT JOIN agents a ON a.id = c.agent_id
+        WHERE r.statut = 'programmee' AND r.heure_relance IS NOT NULL
+    '''
+
+    def get_relances_horaires(self, debut, fin):
+        """Relances à heure fixe dont l'échéance est dans ]debut, fin] (datetimes).
+        Parcours de l'index partiel idx_relances_horaires, jamais de la table entière."""
+        self.c.execute(self.REQUETE_HORAIRES + '''
+              AND (r.date_relance, r.heure_relance) > (?, ?)
+              AND (r.date_relance, r.heure_relance) <= (?, ?)
+            ORDER BY r.date_relance, r.heure_relance
+        ''', (debut.date().isoformat(), debut.strftime('%H:%M'), fin.date().isoformat(), fin.strftime('%H:%M')))
+        return self.c.fetchall()
+
+    def get_relance_horaire(self, relance_id):
+        self.c.execute(self.REQUETE_HORAIRES + ' AND r.id = ?', (relance_id,))
+        return self.c.fetchone()
+
+    @ecriture
     def marquer_relance_effectuee(self, relance_id, resultat='', notes=''):
         self.c.execute('''
             UPDATE relances
             SET statut = 'effectuee', date_effectuee = ?, resultat = ?, notes = ?
             WHERE id = ?
+            RETURNING client_id, regle_id, date_relance
         ''', (datetime.now(), resultat, notes, relance_id))
-        self.conn.commit()
+        for client_id, regle_id, date_r in self.c.fetchall():
+            self._client_modifie(client_id)
+            if regle_id is not None:
+                self._avancer_regle(regle_id, relance_id, date_r)
+        self._commit()
+
+    # ----- Relances récurrentes -----
+    @ecriture
+    def ajouter_regle_relance(self, client_id, date_reference, intervalle=None, jalons=None):
+        """Enregistre une règle (voir occurrence_suivante), à partir de demain.
+        Renvoie (regle_id, prochaine_date), prochaine_date à None si la règle
+        n'a aucune occurrence à venir (rien n'est alors enregistré)."""
+        date_reference = date_vers_iso(date_reference)
+        aujourd_hui = date.today().isoformat()
+        prochaine = occurrence_suivante(intervalle, jalons, aujourd_hui, date_reference, aujourd_hui)
+        if prochaine is None:
+            return None, None
+        self.c.execute('''
+            INSERT INTO regles_relance (client_id, intervalle, jalons, date_debut, date_reference, prochaine_date,
+                                        date_creation)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (client_id, intervalle, jalons, aujourd_hui, date_reference, prochaine, datetime.now()))
+        self._commit()
+        return self.c.lastrowid, prochaine
+
+    @ecriture
+    def materialiser_regles(self, aujourd_hui=None):
+        """Crée, en une requête, la relance de chaque règle dont la prochaine
+        occurrence est due (une seule par règle). Renvoie leur nombre."""
+        params = params_priorite(aujourd_hui)
+        params['maintenant'] = datetime.now()
+        self.c.execute(f'''
+            INSERT INTO relances (client_id, date_relance, type_relance, priorite, rang_priorite, notes, date_creation,
+                                  regle_id)
+            SELECT client_id, date_relance, {LIBELLE_OCCURRENCE_SQL}, {PRIORITE_SQL}, {RANG_PRIORITE_SQL}, '',
+                   :maintenant, id
+            FROM (SELECT *, prochaine_date AS date_relance FROM regles_relance
+                  WHERE prochaine_date <= :aujourd_hui AND relance_id IS NULL)
+            RETURNING id, regle_id, client_id
+        ''', params)
+        creees = self.c.fetchall()
+        self.c.executemany('UPDATE regles_relance SET relance_id = ? WHERE id = ?',
+                           [(rid, regle_id) for rid, regle_id, _ in creees])
+        for _, _, client_id in creees:
+            self._client_modifie(client_id)
+        self._commit()
+        return len(creees)
+
+    def _avancer_regle(self, regle_id, relance_id, date_relance):
+        """L'occurrence `relance_id` est faite : la règle passe à la suivante,
+        sans rattraper celles déjà passées ; créée tout de suite si elle est due"""
+        self.c.execute('''
+            SELECT intervalle, jalons, date_debut, date_reference FROM regles_relance
+            WHERE id = ? AND relance_id = ?
+        ''', (regle_id, relance_id))
+        regle = self.c.fetchone()
+        if regle is None:
+            # Relance marquée deux fois : la règle a déjà avancé
+            return
+        aujourd_hui = date.today()
+        veille = (aujourd_hui - timedelta(days=1)).isoformat()
+        prochaine = occurrence_suivante(*regle, max(date_relance, veille))
+        self.c.execute('UPDATE regles_relance SET prochaine_date = ?, relance_id = NULL WHERE id = ?',
+                       (prochaine, regle_id))
+        if prochaine is not None and prochaine <= aujourd_hui.isoformat():
+            self.materialiser_regles(aujourd_hui)
 
     def get_relances_client(self, client_id):
-        self.c.execute('SELECT * FROM relances WHERE client_id = ? ORDER BY date_relance DESC', (client_id,))
+        self.c.execute(f'SELECT {COLONNES_RELANCE} FROM relances WHERE client_id = ? ORDER BY date_relance DESC', (client_id,))
         return self.c.fetchall()
 
     # ----- Historique -----
+    @ecriture
     def ajouter_historique(self, client_id, action, details, agent_id=None):
         self.c.execute('''
             INSERT INTO historique (client_id, action, details, date_action, agent_id)
             VALUES (?, ?, ?, ?, ?)
         ''', (client_id, action, details, datetime.now(), agent_id))
-        self.conn.commit()
+        self._client_modifie(client_id)
+        self._commit()
 
     def get_historique_client(self, client_id):
         self.c.execute('''
@@ -210,67 +1115,323 @@ class Database:
         ''', (client_id,))
         return self.c.fetchall()
 
-    # ----- Statistiques -----
-    def get_statistiques(self, agent_id=None):
-        stats = {}
-        # Clients convertis ce mois
-        debut_mois = datetime.now().replace(day=1).strftime('%Y-%m-%d')
-        if agent_id:
-            self.c.execute('''
-                SELECT COUNT(*) FROM clients
-                WHERE statut = "converti" AND date_creation >= ? AND agent_id = ?
-            ''', (debut_mois, agent_id))
-        else:
-            self.c.execute('''
-                SELECT COUNT(*) FROM clients
-                WHERE statut = "converti" AND date_creation >= ?
-            ''', (debut_mois,))
-        stats['convertis_mois'] = self.c.fetchone()[0]
+    def get_historique_client_page(self, client_id, limite=None, apres=None, avant=None):
+        """Historique d'un client, du plus récent au plus ancien, une page à la
+        fois (id, action, details, date_action, agent_nom). `apres` / `avant`
+        sont les id de la dernière / première entrée de la page affichée."""
+        curseurs = []
+        for hid in (apres, avant):
+            ligne = None
+            if hid is not None:
+                self.c.execute('SELECT date_action, id FROM historique WHERE id = ?', (hid,))
+                ligne = self.c.fetchone()
+            curseurs.append(ligne)
+        return self._page('''
+            SELECT h.id, h.action, h.details, h.date_action, a.nom FROM historique h
+            LEFT JOIN agents a ON a.id = h.agent_id
+            WHERE h.client_id = ?
+        ''', (client_id,), ('h.date_action', 'h.id'), limite or self.TAILLE_PAGE, *curseurs, decroissant=True)
 
-        # Clients en cours
-        if agent_id:
+    # ----- Archivage de l'historique -----
+    @ecriture
+    def archiver_historique(self, avant, taille_lot=None):
+        """Déplace au plus `taille_lot` entrées d'historique antérieures à
+        `avant` (AAAA-MM-JJ) vers historique_archive, les plus anciennes
+        d'abord, en une transaction courte. Renvoie le nombre déplacé : à
+        rappeler tant qu'il vaut `taille_lot`."""
+        with self.transaction():
             self.c.execute('''
-                SELECT COUNT(*) FROM clients
-                WHERE statut = "en_cours" AND agent_id = ?
-            ''', (agent_id,))
-        else:
+                SELECT id, client_id, action, details, date_action, agent_id FROM historique
+                WHERE date_action < ? ORDER BY date_action LIMIT ?
+            ''', (date_vers_iso(avant), taille_lot or self.TAILLE_LOT_ARCHIVE))
+            lignes = self.c.fetchall()
+            if not lignes:
+                return 0
+            groupes = {}
+            for hid, client_id, action, details, date_action, agent_id in lignes:
+                groupes.setdefault((client_id or 0, str(date_action)[:4]), []).append(
+                    [hid, action, details, str(date_action), agent_id])
+            # Un bloc encore incomplet de la même année est complété ; un bloc plein
+            # n'est plus réécrit (coût d'un lot borné, même pour un long historique)
             self.c.execute('''
-                SELECT COUNT(*) FROM clients
-                WHERE statut = "en_cours"
-            ''')
-        stats['en_cours'] = self.c.fetchone()[0]
+                SELECT a.id, a.client_id, a.annee, a.donnees FROM json_each(?) j
+                JOIN historique_archive a ON a.client_id = json_extract(j.value, '$[0]')
+                                         AND a.annee = json_extract(j.value, '$[1]')
+                WHERE a.nb < ?
+                ORDER BY a.id
+            ''', (json.dumps(list(groupes)), self.TAILLE_BLOC_ARCHIVE))
+            blocs = {(client_id, annee): (bid, donnees) for bid, client_id, annee, donnees in self.c.fetchall()}
+            nouveaux, completes = [], []
+            for (client_id, annee), entrees in groupes.items():
+                if (client_id, annee) in blocs:
+                    bid, donnees = blocs[(client_id, annee)]
+                    entrees = decompresser_entrees(donnees) + entrees
+                    completes.append((len(entrees), compresser_entrees(entrees), bid))
+                else:
+                    nouveaux.append((client_id, annee, len(entrees), compresser_entrees(entrees)))
+            self.c.executemany('UPDATE historique_archive SET nb = ?, donnees = ? WHERE id = ?', completes)
+            self.c.executemany('INSERT INTO historique_archive (client_id, annee, nb, donnees) VALUES (?, ?, ?, ?)',
+                               nouveaux)
+            self.c.execute('DELETE FROM historique WHERE id IN (SELECT value FROM json_each(?))',
+                           (json.dumps([ligne[0] for ligne in lignes]),))
+            for client_id, _ in groupes:
+                self._client_modifie(client_id)
+        return len(lignes)
 
-        # Relances en retard
-        aujourd_hui = datetime.now().strftime('%d/%m/%Y')
-        if agent_id:
-            self.c.execute('''
-                SELECT COUNT(*) FROM relances r
-                JOIN clients c ON r.client_id = c.id
-                WHERE r.date_relance < ? AND r.statut = "programmee" AND c.agent_id = ?
-            ''', (aujourd_hui, agent_id))
-        else:
+    @ecriture
+    def compacter(self, pages=None):
+        """Rend au système au plus `pages` pages libres (vacuum incrémental).
+        Renvoie le nombre de pages libérées : à rappeler tant qu'il est non nul."""
+        libres = self.c.execute('PRAGMA freelist_count').fetchone()[0]
+        # Chaque exécution du PRAGMA libère une page (sqlite3 ne fait qu'un pas par execute)
+        for _ in range(min(libres, pages or self.PAGES_COMPACTAGE)):
+            self.c.execute('PRAGMA incremental_vacuum')
+        self._commit()
+        return libres - self.c.execute('PRAGMA freelist_count').fetchone()[0]
+
+    def nb_historique_archive(self, client_id):
+        self.c.execute('SELECT COALESCE(SUM(nb), 0) FROM historique_archive WHERE client_id = ?', (client_id,))
+        return self.c.fetchone()[0]
+
+    def get_historique_archive_page(self, client_id, page=0, limite=None):
+        """Entrées archivées d'un client, de la plus récente à la plus ancienne
+        (id, action, details, date_action, agent_nom), page numéro `page`.
+        Renvoie (entrees, page_precedente, page_suivante)."""
+        limite = limite or self.TAILLE_PAGE
+        self.c.execute('SELECT donnees FROM historique_archive WHERE client_id = ?', (client_id,))
+        entrees = [entree for (donnees,) in self.c.fetchall() for entree in decompresser_entrees(donnees)]
+        entrees.sort(key=lambda entree: (entree[3], entree[0]), reverse=True)
+        selection = entrees[page * limite:(page + 1) * limite]
+        self.c.execute('SELECT id, nom FROM agents WHERE id IN (SELECT value FROM json_each(?))',
+                       (json.dumps(sorted({entree[4] for entree in selection if entree[4] is not None})),))
+        noms = dict(self.c.fetchall())
+        selection = [(hid, action, details, date_action, noms.get(agent_id))
+                     for hid, action, details, date_action, agent_id in selection]
+        return selection, page > 0, len(entrees) > (page + 1) * limite
+
+    # ----- Export -----
+    def lignes_export(self, table, statut=None, agent_id=None, debut=None, fin=None, taille_lot=1000):
+        """Générateur de lots d'au plus `taille_lot` lignes de `table` (voir
+        EXPORTS), filtrés par statut, agent et dates incluses (debut / fin).
+        Le curseur est parcouru au fil de l'eau : la mémoire ne dépend pas du
+        nombre de lignes. Curseur dédié : self.c reste utilisable."""
+        requete, colonnes, ordre, _ = EXPORTS[table]
+        conditions, params = [], []
+        if statut:
+            conditions.append(f'{colonnes["statut"]} = ?')
+            params.append(statut)
+        if agent_id is not None:
+            conditions.append(f'{colonnes["agent"]} = ?')
+            params.append(agent_id)
+        if debut:
+            conditions.append(f'{colonnes["date"]} >= ?')
+            params.append(date_vers_iso(debut))
+        if fin:
+            # Fin incluse : on s'arrête avant le lendemain (les horodatages ont une heure)
+            conditions.append(f'{colonnes["date"]} < ?')
+            params.append((date.fromisoformat(date_vers_iso(fin)) + timedelta(days=1)).isoformat())
+        if conditions:
+            requete += ' WHERE ' + ' AND '.join(conditions)
+        curseur = self.conn.cursor()
+        try:
+            curseur.execute(f'{requete} ORDER BY {ordre}', params)
+            while True:
+                lot = curseur.fetchmany(taille_lot)
+                if not lot:
+                    return
+                yield lot
+        finally:
+            curseur.close()
+
+    # ----- Opérations composées (une transaction, un commit) -----
+    @ecriture
+    def ajouter_client_journalise(self, nom, telephone='', email='', source='', type_demande='', destination='', agent_id=None):
+        with self.transaction():
+            cid = self.ajouter_client(nom, telephone, email, source, type_demande, destination, agent_id)
+            self.ajouter_historique(cid, "création", "Client créé", agent_id)
+        return cid
+
+    @ecriture
+    def ajouter_relance_journalisee(self, client_id, date_relance, type_relance, details, agent_id=None, notes='',
+                                    heure=None):
+        with self.transaction():
+            rid = self.ajouter_relance(client_id, date_relance, type_relance, notes, heure)
+            self.ajouter_historique(client_id, "relance ajoutée", details, agent_id)
+        return rid
+
+    @ecriture
+    def ajouter_regle_relance_journalisee(self, client_id, date_reference, details, intervalle=None, jalons=None,
+                                          agent_id=None):
+        with self.transaction():
+            regle_id, prochaine = self.ajouter_regle_relance(client_id, date_reference, intervalle, jalons)
+            if regle_id is not None:
+                self.ajouter_historique(client_id, "relance récurrente", details, agent_id)
+        return regle_id, prochaine
+
+    @ecriture
+    def marquer_relance_effectuee_journalisee(self, relance_id, resultat='', notes='', agent_id=None):
+        with self.transaction():
+            self.c.execute('SELECT client_id, date_relance FROM relances WHERE id = ?', (relance_id,))
+            relance = self.c.fetchone()
+            if not relance:
+                return None
+            client_id, date_r = relance
+            self.marquer_relance_effectuee(relance_id, resultat, notes)
+            self.ajouter_historique(client_id, "relance effectuée",
+                                    f"Relance du {date_affichage(date_r)} effectuée", agent_id)
+        return client_id
+
+    # ----- Actions groupées (sélection multiple) -----
+    # Une requête ensembliste sur les relances choisies (passées en un seul
+    # paramètre JSON), l'historique inséré en lot, le tout en une transaction.
+    def _journaliser_lot(self, entrees, agent_id):
+        """entrees : couples (client_id, action, details)"""
+        maintenant = datetime.now()
+        self.c.executemany('''
+            INSERT INTO historique (client_id, action, details, date_action, agent_id)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(cid, action, details, maintenant, agent_id) for cid, action, details in entrees])
+        for cid, _, _ in entrees:
+            self._client_modifie(cid)
+
+    @ecriture
+    def effectuer_relances(self, relance_ids, resultat='', notes='', agent_id=None):
+        """Marque effectuées les relances programmées parmi `relance_ids`.
+        Renvoie les id effectivement marqués."""
+        with self.transaction():
             self.c.execute('''
-                SELECT COUNT(*) FROM relances
-                WHERE date_relance < ? AND statut = "programmee"
-            ''', (aujourd_hui,))
-        stats['retard'] = self.c.fetchone()[0]
+                UPDATE relances
+                SET statut = 'effectuee', date_effectuee = ?, resultat = ?, notes = ?
+                WHERE id IN (SELECT value FROM json_each(?)) AND statut = 'programmee'
+                RETURNING id, client_id, regle_id, date_relance
+            ''', (datetime.now(), resultat, notes, json.dumps(list(relance_ids))))
+            lignes = self.c.fetchall()
+            self._journaliser_lot([(cid, "relance effectuée", f"Relance du {date_affichage(date_r)} effectuée")
+                                   for _, cid, _, date_r in lignes], agent_id)
+            for rid, _, regle_id, date_r in lignes:
+                if regle_id is not None:
+                    self._avancer_regle(regle_id, rid, date_r)
+        return [ligne[0] for ligne in lignes]
+
+    @ecriture
+    def reporter_relances(self, relance_ids, jours, agent_id=None):
+        """Reporte de `jours` jours les relances programmées parmi `relance_ids`
+        (à partir d'aujourd'hui pour celles en retard). Renvoie les lignes
+        (id, client_id, date_relance, heure_relance) reportées."""
+        # Les expressions de SET voient l'ancienne date : la priorité est
+        # calculée sur la nouvelle, pour les seules relances reportées
+        nouvelle_date = "date(max(date_relance, :aujourd_hui), :decalage)"
+        with self.transaction():
+            self.c.execute(f'''
+                UPDATE relances
+                SET date_relance = {nouvelle_date},
+                    rang_priorite = {RANG_PRIORITE_SQL.replace('date_relance', nouvelle_date)},
+                    priorite = {PRIORITE_SQL.replace('date_relance', nouvelle_date)}
+                WHERE id IN (SELECT value FROM json_each(:ids)) AND statut = 'programmee'
+                RETURNING id, client_id, date_relance, heure_relance
+            ''', {**params_priorite(), 'decalage': f'+{int(jours)} days', 'ids': json.dumps(list(relance_ids))})
+            lignes = self.c.fetchall()
+            self._journaliser_lot([(cid, "relance reportée", f"Relance reportée au {date_affichage(date_r)}")
+                                   for _, cid, date_r, _ in lignes], agent_id)
+        return lignes
 
-        # Relances aujourd'hui
-        aujourd_hui = datetime.now().strftime('%d/%m/%Y')
-        if agent_id:
+    @ecriture
+    def reassigner_relances(self, relance_ids, nouvel_agent_id, agent_id=None):
+        """Confie à `nouvel_agent_id` les clients des relances `relance_ids`.
+        Renvoie (clients, relances) : les id des clients qui changent d'agent et
+        ceux de leurs relances programmées à heure fixe, dont le rappel doit
+        désormais aller au nouvel agent."""
+        with self.transaction():
+            self.c.execute('SELECT nom, telegram_id FROM agents WHERE id = ?', (nouvel_agent_id,))
+            agent = self.c.fetchone()
+            if agent is None:
+                return [], []
             self.c.execute('''
-                SELECT COUNT(*) FROM relances r
-                JOIN clients c ON r.client_id = c.id
-                WHERE r.date_relance = ? AND r.statut = "programmee" AND c.agent_id = ?
-            ''', (aujourd_hui, agent_id))
-        else:
+                UPDATE clients SET agent_id = ?
+                WHERE id IN (SELECT client_id FROM relances WHERE id IN (SELECT value FROM json_each(?)))
+                  AND agent_id IS NOT ?
+                RETURNING id
+            ''', (nouvel_agent_id, json.dumps(list(relance_ids)), nouvel_agent_id))
+            clients = [cid for (cid,) in self.c.fetchall()]
+            self._journaliser_lot([(cid, "client réassigné", f"Client confié à {agent[0] or agent[1]}")
+                                   for cid in clients], agent_id)
             self.c.execute('''
-                SELECT COUNT(*) FROM relances
-                WHERE date_relance = ? AND statut = "programmee"
-            ''', (aujourd_hui,))
-        stats['aujourd_hui'] = self.c.fetchone()[0]
+                SELECT id FROM relances
+                WHERE client_id IN (SELECT value FROM json_each(?))
+                  AND statut = 'programmee' AND heure_relance IS NOT NULL
+            ''', (json.dumps(clients),))
+            relances = [rid for (rid,) in self.c.fetchall()]
+        return clients, relances
+
+    # ----- États persistants (user_data, chat_data, bot_data) -----
+    def charger_etat(self, type_etat, cle, version_connue=0):
+        """Renvoie (version, donnees) si l'état stocké est plus récent que version_connue"""
+        self.c.execute('SELECT version, donnees FROM etats WHERE type = ? AND cle = ? AND version > ?',
+                       (type_etat, cle, version_connue))
+        return self.c.fetchone()
+
+    @ecriture
+    def enregistrer_etats(self, lignes):
+        """lignes : suite de (type, cle, donnees, version) ; une version plus
+        ancienne que celle stockée n'écrase rien"""
+        self.c.executemany('''
+            INSERT INTO etats (type, cle, donnees, version) VALUES (?, ?, ?, ?)
+            ON CONFLICT (type, cle) DO UPDATE SET donnees = excluded.donnees, version = excluded.version
+            WHERE excluded.version > etats.version
+        ''', lignes)
+        self._commit()
+
+    @ecriture
+    def supprimer_etat(self, type_etat, cle):
+        self.c.execute('DELETE FROM etats WHERE type = ? AND cle = ?', (type_etat, cle))
+        self._commit()
+
+    # ----- Statistiques -----
+    def get_statistiques(self, agent_id=None):
+        debut_mois = date.today().replace(day=1)
+        aujourd_hui = date.today().isoformat()
+        if self._compteurs_actifs is None:
+            self._compteurs_actifs = self._table_existe('compteurs_clients')
+        if self._compteurs_actifs:
+            return self._statistiques_compteurs(agent_id, debut_mois.strftime('%Y-%m'), aujourd_hui)
+
+        # Un seul passage par table, tous les compteurs en agrégation conditionnelle
+        filtre_agent = 'AND c.agent_id = :agent' if agent_id else ''
+        self.c.execute(f'''
+            SELECT cl.convertis_mois, cl.en_cours, rl.retard, rl.aujourd_hui
+            FROM (
+                SELECT
+                    COALESCE(SUM(c.statut = 'converti' AND c.date_creation >= :debut_mois), 0) AS convertis_mois,
+                    COALESCE(SUM(c.statut = 'en_cours'), 0) AS en_cours
+                FROM clients c
+                WHERE c.statut IN ('converti', 'en_cours') {filtre_agent}
+            ) cl, (
+                SELECT
+                    COALESCE(SUM(r.date_relance < :jour), 0) AS retard,
+                    COALESCE(SUM(r.date_relance = :jour), 0) AS aujourd_hui
+                FROM relances r
+                {'JOIN clients c ON r.client_id = c.id' if agent_id else ''}
+                WHERE r.statut = 'programmee' AND r.date_relance <= :jour {filtre_agent}
+            ) rl
+        ''', {'debut_mois': debut_mois.isoformat(), 'jour': aujourd_hui, 'agent': agent_id})
+        convertis_mois, en_cours, retard, du_jour = self.c.fetchone()
+        return {'convertis_mois': convertis_mois, 'en_cours': en_cours, 'retard': retard, 'aujourd_hui': du_jour}
 
-        return stats
+    def _statistiques_compteurs(self, agent_id, mois, aujourd_hui):
+        filtre_agent = 'AND agent_id = :agent' if agent_id else ''
+        self.c.execute(f'''
+            SELECT
+                (SELECT COALESCE(SUM(nb), 0) FROM compteurs_clients
+                 WHERE statut = 'converti' AND mois >= :mois {filtre_agent}),
+                (SELECT COALESCE(SUM(nb), 0) FROM compteurs_clients
+                 WHERE statut = 'en_cours' {filtre_agent}),
+                (SELECT COALESCE(SUM(nb), 0) FROM compteurs_relances
+                 WHERE date_relance < :jour {filtre_agent}),
+                (SELECT COALESCE(SUM(nb), 0) FROM compteurs_relances
+                 WHERE date_relance = :jour {filtre_agent})
+        ''', {'mois': mois, 'jour': aujourd_hui, 'agent': agent_id})
+        convertis_mois, en_cours, retard, du_jour = self.c.fetchone()
+        return {'convertis_mois': convertis_mois, 'en_cours': en_cours, 'retard': retard, 'aujourd_hui': du_jour}
 
     # ----- Fermeture -----
     def fermer(self):
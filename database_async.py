@@ -0,0 +1,186 @@
+import asyncio
+import functools
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from database import Database
+from metriques import metriques
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncDatabase:
+    """Version awaitable de Database.
+
+    Chaque méthode publique de Database est disponible en coroutine
+    (`await db.get_client(cid)`). Les lectures s'exécutent dans un pool de
+    threads borné ; chaque thread ouvre sa propre connexion SQLite (en lecture
+    seule), si bien qu'aucun curseur n'est partagé entre deux handlers
+    concurrents. Les écritures passent par un écrivain unique qui regroupe
+    les écritures en attente dans une même transaction (group commit).
+    L'API synchrone reste accessible via `db.sync` (scripts, démarrage).
+    """
+
+    def __init__(self, db_path=None, max_workers=None, mode=None, fenetre_commit_ms=None):
+        if max_workers is None:
+            max_workers = int(os.environ.get('DB_WORKERS', '4'))
+        if fenetre_commit_ms is None:
+            fenetre_commit_ms = float(os.environ.get('DB_GROUP_COMMIT_MS', '0'))
+        # Connexion principale : crée le schéma et applique les migrations
+        self.sync = Database(db_path, mode=mode)
+        self.db_path = self.sync.db_path
+        self.mode = self.sync.mode
+        self._local = threading.local()
+        self._verrou = threading.Lock()
+        self._connexions = []
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='db-lecture')
+        self._ecrivain = _Ecrivain(Database(self.db_path, initialiser=False, mode=self.mode),
+                                   fenetre_commit_ms / 1000)
+        self._ecrivain.start()
+
+    def _db_du_thread(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = Database(self.db_path, initialiser=False, mode=self.mode, lecture_seule=True)
+            self._local.db = db
+            with self._verrou:
+                self._connexions.append(db)
+        return db
+
+    def _appeler(self, nom, args, kwargs):
+        return self._mesurer(nom, getattr(self._db_du_thread(), nom), args, kwargs)
+
+    @staticmethod
+    def _mesurer(nom, fonction, args, kwargs):
+        # Durée d'exécution dans le thread (hors attente), par méthode
+        if metriques.actif:
+            return metriques.chronometrer('db', nom, fonction, *args, **kwargs)
+        return fonction(*args, **kwargs)
+
+    async def executer(self, nom, /, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        if getattr(getattr(Database, nom), 'ecriture', False):
+            return await self._ecrivain.soumettre(loop, lambda db: self._mesurer(nom, getattr(db, nom), args, kwargs))
+        return await loop.run_in_executor(self._executor, functools.partial(self._appeler, nom, args, kwargs))
+
+    async def en_transaction(self, fonction, /, *args, **kwargs):
+        """Exécute `fonction(db, *args, **kwargs)` sur la connexion d'écriture,
+        dans une seule transaction : tout est validé ensemble ou rien ne l'est."""
+        loop = asyncio.get_running_loop()
+        return await self._ecrivain.soumettre(
+            loop, lambda db: self._mesurer(fonction.__qualname__, fonction, (db,) + args, kwargs))
+
+    def sur_modification_client(self, fonction):
+        """`fonction(client_id)` sera appelée (depuis le thread d'écriture) après
+        chaque commit qui modifie un client, ses relances ou son historique"""
+        self.sync.sur_modification_client = fonction
+        self._ecrivain.db.sur_modification_client = fonction
+
+    async def en_lecture(self, fonction, /, *args, **kwargs):
+        """Exécute `fonction(db, *args, **kwargs)` dans le pool de lecture, sur la
+        connexion (en lecture seule) du thread : pour les parcours longs, qui
+        ne doivent pas retenir l'écrivain."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, lambda: self._mesurer(fonction.__qualname__, fonction, (self._db_du_thread(),) + args, kwargs))
+
+    def __getattr__(self, nom):
+        if nom.startswith('_') or not callable(getattr(Database, nom, None)):
+            raise AttributeError(nom)
+
+        async def methode(*args, **kwargs):
+            return await self.executer(nom, *args, **kwargs)
+
+        methode.__name__ = nom
+        # Mise en cache : __getattr__ n'est plus appelé pour ce nom
+        setattr(self, nom, methode)
+        return methode
+
+    def fermer(self):
+        self._ecrivain.arreter()
+        self._executor.shutdown(wait=True)
+        with self._verrou:
+            for db in self._connexions:
+                db.fermer()
+            self._connexions.clear()
+        self.sync.fermer()
+
+
+class _Ecrivain(threading.Thread):
+    """Thread unique qui possède la connexion d'écriture.
+
+    Il prend toutes les écritures en attente (plus celles qui arrivent pendant
+    la fenêtre de group commit) et les exécute dans une seule transaction :
+    un seul commit, donc un seul fsync, pour tout le lot. Chaque écriture a
+    son propre savepoint, l'échec de l'une n'annule pas les autres.
+    """
+
+    TAILLE_LOT_MAX = 500
+
+    def __init__(self, db, fenetre):
+        super().__init__(name='db-ecriture', daemon=True)
+        self.db = db
+        self.fenetre = fenetre
+        self._file = queue.Queue()
+
+    def soumettre(self, loop, travail):
+        futur = loop.create_future()
+        self._file.put((travail, loop, futur))
+        return futur
+
+    def arreter(self):
+        self._file.put(None)
+        self.join()
+        self.db.fermer()
+
+    def _prendre_lot(self):
+        premier = self._file.get()
+        if premier is None:
+            return None
+        lot = [premier]
+        limite = time.monotonic() + self.fenetre
+        while len(lot) < self.TAILLE_LOT_MAX:
+            restant = limite - time.monotonic()
+            try:
+                travail = self._file.get(timeout=restant) if restant > 0 else self._file.get_nowait()
+            except queue.Empty:
+                break
+            if travail is None:
+                # Arrêt demandé : on termine le lot en cours puis on s'arrête
+                self._file.put(None)
+                break
+            lot.append(travail)
+        return lot
+
+    def run(self):
+        while True:
+            lot = self._prendre_lot()
+            if lot is None:
+                return
+            resultats = []
+            try:
+                with self.db.transaction():
+                    for travail, _, _ in lot:
+                        try:
+                            with self.db.transaction():
+                                resultats.append((travail(self.db), None))
+                        except Exception as e:
+                            resultats.append((None, e))
+            except Exception as e:
+                logger.exception("Échec du commit groupé (%d écritures)", len(lot))
+                resultats = [(None, e)] * len(lot)
+            for (_, loop, futur), (resultat, erreur) in zip(lot, resultats):
+                loop.call_soon_threadsafe(_resoudre, futur, resultat, erreur)
+
+
+def _resoudre(futur, resultat, erreur):
+    if futur.cancelled():
+        return
+    if erreur is not None:
+        futur.set_exception(erreur)
+    else:
+        futur.set_result(resultat)
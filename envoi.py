@@ -0,0 +1,184 @@
+import asyncio
+import contextlib
+import logging
+import random
+import time
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metriques import metriques
+
+logger = logging.getLogger(__name__)
+
+
+class SeauJetons:
+    """Seau à jetons : `debit` jetons par seconde, au plus `capacite` en réserve.
+    Chaque appel à prendre() réserve un jeton et attend qu'il soit disponible ;
+    les réservations sont servies dans l'ordre d'arrivée."""
+
+    def __init__(self, debit, capacite):
+        self.debit = debit
+        self.capacite = capacite
+        self.jetons = capacite
+        self.maj = time.monotonic()
+
+    def reserver(self):
+        maintenant = time.monotonic()
+        self.jetons = min(self.capacite, self.jetons + (maintenant - self.maj) * self.debit)
+        self.maj = maintenant
+        self.jetons -= 1
+        return 0 if self.jetons >= 0 else -self.jetons / self.debit
+
+    def plein(self):
+        return self.jetons + (time.monotonic() - self.maj) * self.debit >= self.capacite
+
+    async def prendre(self):
+        attente = self.reserver()
+        if attente > 0:
+            await asyncio.sleep(attente)
+
+
+class Expediteur(BaseRateLimiter):
+    """Point de passage unique de tous les appels à l'API Bot.
+
+    - seau global (30 messages/s) et seau par conversation (1/s en privé,
+      20/min en groupe), appliqués aux requêtes qui visent un chat ;
+    - sur RetryAfter, tous les envois sont suspendus le temps demandé puis la
+      requête est rejouée ;
+    - les erreurs réseau transitoires sont rejouées avec un délai exponentiel
+      et aléatoire ;
+    - compteurs envoyes / reessayes / abandonnes / en_attente.
+    """
+
+    MAX_SEAUX_CHAT = 1024
+
+    def __init__(self, debit_global=30, debit_chat=1, capacite_chat=3, debit_groupe=20 / 60,
+                 capacite_groupe=20, max_tentatives=3, delai_base=0.5, concurrence_diffusion=20):
+        self._seau_global = SeauJetons(debit_global, debit_global)
+        self._debit_chat = (debit_chat, capacite_chat)
+        self._debit_groupe = (debit_groupe, capacite_groupe)
+        self._seaux_chat = {}
+        self._max_tentatives = max_tentatives
+        self._delai_base = delai_base
+        self._concurrence_diffusion = concurrence_diffusion
+        self._reprise = asyncio.Event()
+        self._reprise.set()
+        self.envoyes = 0
+        self.reessayes = 0
+        self.abandonnes = 0
+        self.en_attente = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def compteurs(self):
+        return {
+            'envoyes': self.envoyes,
+            'reessayes': self.reessayes,
+            'abandonnes': self.abandonnes,
+            'en_attente': self.en_attente,
+        }
+
+    def _seau_chat(self, chat_id):
+        seau = self._seaux_chat.get(chat_id)
+        if seau is None:
+            if len(self._seaux_chat) >= self.MAX_SEAUX_CHAT:
+                # On oublie les conversations inactives (seau de nouveau plein)
+                for cle in [cle for cle, s in self._seaux_chat.items() if s.plein()]:
+                    del self._seaux_chat[cle]
+            est_groupe = isinstance(chat_id, str) or chat_id < 0
+            debit, capacite = self._debit_groupe if est_groupe else self._debit_chat
+            seau = self._seaux_chat[chat_id] = SeauJetons(debit, capacite)
+        return seau
+
+    async def _attendre_tour(self, chat_id):
+        self.en_attente += 1
+        try:
+            await self._reprise.wait()
+            if chat_id is not None:
+                await self._seau_chat(chat_id).prendre()
+                await self._seau_global.prendre()
+                # Une pause (RetryAfter) a pu commencer pendant l'attente des jetons
+                await self._reprise.wait()
+        finally:
+            self.en_attente -= 1
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        with contextlib.suppress(ValueError, TypeError):
+            chat_id = int(chat_id)
+        max_tentatives = rate_limit_args or self._max_tentatives
+
+        tentative = 0
+        while True:
+            await self._attendre_tour(chat_id)
+            try:
+                resultat = await self._appeler(callback, args, kwargs, endpoint)
+            except RetryAfter as e:
+                if tentative >= max_tentatives:
+                    self.abandonnes += 1
+                    logger.error("Limite Telegram atteinte sur %s, abandon après %d tentatives", endpoint, tentative)
+                    raise
+                logger.warning("Limite Telegram atteinte sur %s, pause de %s s", endpoint, e.retry_after)
+                self._suspendre(e.retry_after)
+                await self._reprise.wait()
+            except (BadRequest, Forbidden):
+                self.abandonnes += 1
+                raise
+            except NetworkError as e:
+                if tentative >= max_tentatives:
+                    self.abandonnes += 1
+                    raise
+                delai = self._delai_base * 2 ** tentative * random.uniform(0.5, 1.5)
+                logger.info("Erreur réseau sur %s (%s), nouvel essai dans %.2f s", endpoint, e, delai)
+                await asyncio.sleep(delai)
+            else:
+                self.envoyes += 1
+                return resultat
+            tentative += 1
+            self.reessayes += 1
+
+    @staticmethod
+    async def _appeler(callback, args, kwargs, endpoint):
+        if not metriques.actif:
+            return await callback(*args, **kwargs)
+        debut = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        except Exception as e:
+            metriques.incrementer('api_erreurs', f'{endpoint}:{type(e).__name__}')
+            raise
+        finally:
+            metriques.observer('api', endpoint, time.perf_counter() - debut)
+
+    def _suspendre(self, duree):
+        if not self._reprise.is_set():
+            return
+        self._reprise.clear()
+        asyncio.get_running_loop().call_later(duree + 0.1, self._reprise.set)
+
+    async def diffuser(self, bot, chat_ids, texte, **kwargs):
+        """Envoie le même message à plusieurs conversations, au plus
+        `concurrence_diffusion` envois simultanés. Renvoie le nombre de succès."""
+        return await self.diffuser_messages(bot, ((chat_id, texte) for chat_id in chat_ids), **kwargs)
+
+    async def diffuser_messages(self, bot, messages, **kwargs):
+        """Comme diffuser(), avec un texte propre à chaque conversation :
+        `messages` est une suite de couples (chat_id, texte)."""
+        semaphore = asyncio.Semaphore(self._concurrence_diffusion)
+
+        async def envoyer(chat_id, texte):
+            async with semaphore:
+                try:
+                    await bot.send_message(chat_id=chat_id, text=texte, **kwargs)
+                    return True
+                except Exception as e:
+                    logger.warning("Envoi à %s impossible : %s", chat_id, e)
+                    return False
+
+        resultats = await asyncio.gather(*(envoyer(chat_id, texte) for chat_id, texte in messages))
+        return sum(resultats)
@@ -0,0 +1,37 @@
+import csv
+import gzip
+import json
+
+from database import EXPORTS
+
+FORMATS = ('csv', 'jsonl')
+
+
+def exporter(db, chemin, table, format='csv', compresser=False, **filtres):
+    """Écrit l'export de `table` dans `chemin` (CSV ou JSON Lines, gzip en
+    option) lot par lot, depuis un curseur parcouru au fil de l'eau : la
+    mémoire utilisée est la même quelle que soit la taille de la table.
+    `filtres` : statut, agent_id, debut, fin (voir Database.lignes_export).
+    S'exécute dans un thread de lecture (`await db.en_lecture(exporter, ...)`).
+    Renvoie le nombre de lignes écrites."""
+    if table not in EXPORTS:
+        raise ValueError(f"table inconnue : {table}")
+    if format not in FORMATS:
+        raise ValueError(f"format inconnu : {format}")
+    colonnes = EXPORTS[table][3]
+    nb = 0
+    # Niveau 6 : presque la taille du niveau 9, deux à trois fois plus rapide
+    fichier = (gzip.open(chemin, 'wt', compresslevel=6, encoding='utf-8', newline='') if compresser
+               else open(chemin, 'w', encoding='utf-8', newline=''))
+    with fichier as f:
+        if format == 'csv':
+            ecrivain = csv.writer(f)
+            ecrivain.writerow(colonnes)
+        for lot in db.lignes_export(table, **filtres):
+            if format == 'csv':
+                ecrivain.writerows(lot)
+            else:
+                f.writelines(json.dumps(dict(zip(colonnes, ligne)), ensure_ascii=False, default=str) + '\n'
+                             for ligne in lot)
+            nb += len(lot)
+    return nb
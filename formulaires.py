@@ -0,0 +1,107 @@
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+# Toutes les étapes de tous les formulaires, par nom : la valeur de
+# user_data['etape'] y est cherchée directement (un seul accès au dict)
+ETAPES = {}
+
+
+class Etape:
+    """Une question d'un formulaire.
+
+    - nom : valeur de user_data['etape'] pendant cette étape (unique) ;
+    - question : texte envoyé à l'agent ;
+    - champ : clé sous laquelle la réponse est rangée (par défaut le nom) ;
+    - valider : fonction texte -> valeur (sérialisable en JSON, user_data
+      étant persisté) ; si elle lève ValueError, `erreur` est renvoyé et
+      l'étape reste en cours ;
+    - facultatif : 'skip' passe l'étape sans rien enregistrer.
+    """
+
+    __slots__ = ('nom', 'question', 'champ', 'valider', 'facultatif', 'erreur', 'formulaire', 'suivante', 'texte')
+
+    def __init__(self, nom, question, champ=None, valider=None, facultatif=False, erreur="❌ Saisie invalide"):
+        self.nom = nom
+        self.question = question
+        self.champ = champ or nom
+        self.valider = valider
+        self.facultatif = facultatif
+        self.erreur = erreur
+        self.formulaire = None
+        self.suivante = None
+        self.texte = question
+
+
+class Formulaire:
+    """Suite d'étapes saisies au clavier, terminée par `terminer(update,
+    context, valeurs)`.
+
+    Les réponses sont rangées dans user_data[stockage]. Les textes (titre,
+    numérotation « Étape i/n ») et le clavier de retour sont construits une
+    fois pour toutes ; seul un retour qui dépend de la saisie (`retour`
+    appelable, recevant user_data) construit son clavier à chaque message.
+    """
+
+    def __init__(self, etapes, terminer, retour='menu_principal', stockage='saisie', titre=None,
+                 numeroter=False, parse_mode=None):
+        self.etapes = etapes
+        self.terminer = terminer
+        self.retour = retour
+        self.stockage = stockage
+        self.parse_mode = parse_mode
+        self._clavier = None if callable(retour) else self._construire_clavier(retour)
+        for i, etape in enumerate(etapes):
+            if etape.nom in ETAPES:
+                raise ValueError(f"Étape déjà définie : {etape.nom}")
+            etape.formulaire = self
+            etape.suivante = etapes[i + 1] if i + 1 < len(etapes) else None
+            if numeroter:
+                etape.texte = f"Étape {i + 1}/{len(etapes)} - {etape.question}"
+            ETAPES[etape.nom] = etape
+        if titre:
+            etapes[0].texte = f"{titre}\n\n{etapes[0].texte}"
+
+    @staticmethod
+    def _construire_clavier(callback_data):
+        return InlineKeyboardMarkup([[InlineKeyboardButton("🔙 RETOUR", callback_data=callback_data)]])
+
+    def clavier(self, user_data):
+        if self._clavier is not None:
+            return self._clavier
+        return self._construire_clavier(self.retour(user_data))
+
+    async def demarrer(self, update, context, **valeurs):
+        """Ouvre le formulaire depuis un bouton : `valeurs` sont des données
+        déjà connues (client concerné...), transmises à terminer()"""
+        context.user_data[self.stockage] = valeurs
+        premiere = self.etapes[0]
+        context.user_data['etape'] = premiere.nom
+        await update.callback_query.edit_message_text(
+            premiere.texte, reply_markup=self.clavier(context.user_data), parse_mode=self.parse_mode)
+
+    async def recevoir(self, update, context, etape):
+        texte = update.message.text
+        valeurs = context.user_data.setdefault(self.stockage, {})
+        if not (etape.facultatif and texte.strip().lower() == 'skip'):
+            try:
+                valeurs[etape.champ] = etape.valider(texte) if etape.valider else texte
+            except ValueError:
+                await update.message.reply_text(etape.erreur)
+                return
+        suivante = etape.suivante
+        if suivante is None:
+            context.user_data['etape'] = None
+            await self.terminer(update, context, valeurs)
+            return
+        context.user_data['etape'] = suivante.nom
+        await update.message.reply_text(suivante.texte, reply_markup=self.clavier(context.user_data),
+                                        parse_mode=self.parse_mode)
+
+
+async def traiter_saisie(update, context):
+    """Aiguille un message texte vers l'étape en cours de l'agent.
+    Renvoie False si aucune étape n'est en cours."""
+    etape = ETAPES.get(context.user_data.get('etape'))
+    if etape is None:
+        return False
+    await etape.formulaire.recevoir(update, context, etape)
+    return True
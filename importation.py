@@ -0,0 +1,211 @@
+import codecs
+import csv
+import os
+import re
+import zipfile
+
+from database import normaliser_telephone
+
+try:
+    from openpyxl.utils.exceptions import InvalidFileException
+except ImportError:
+    # Sans openpyxl, lire_xlsx lève déjà une ValueError
+    InvalidFileException = ValueError
+
+# En-têtes reconnus (comparés en minuscules, sans accents ni espaces superflus)
+ALIAS_COLONNES = {
+    'nom': ('nom', 'name', 'client', 'nom complet'),
+    'telephone': ('telephone', 'tel', 'phone', 'portable', 'mobile'),
+    'email': ('email', 'e-mail', 'mail', 'courriel'),
+    'source': ('source', 'origine'),
+    'type_demande': ('type_demande', 'type de demande', 'type', 'demande'),
+    'destination': ('destination', 'pays', 'ville'),
+}
+CHAMPS = ('nom', 'telephone', 'email', 'source', 'type_demande', 'destination')
+EMAIL_VALIDE = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+TAILLE_LOT = 500
+MAX_ERREURS_DETAILLEES = 10
+# Fichier refusé (contenu invalide, CSV ou classeur illisible) : import annulé
+ERREURS_FICHIER = (ValueError, csv.Error, zipfile.BadZipFile, InvalidFileException)
+
+
+def _cle_entete(texte):
+    texte = str(texte or '').strip().lower()
+    for accent, lettre in (('é', 'e'), ('è', 'e'), ('ê', 'e'), ('ô', 'o')):
+        texte = texte.replace(accent, lettre)
+    return re.sub(r'\s+', ' ', texte)
+
+
+def lire_csv(chemin):
+    """Lignes d'un CSV, lues au fil de l'eau (UTF-8, sinon Windows-1252 ;
+    séparateur , ; ou tabulation détecté sur le début du fichier)"""
+    with open(chemin, 'rb') as f:
+        debut = f.read(65536)
+    encodage = 'utf-8-sig'
+    try:
+        codecs.getincrementaldecoder('utf-8-sig')().decode(debut)
+    except UnicodeDecodeError:
+        encodage = 'cp1252'
+    echantillon = debut.decode(encodage, errors='ignore')
+    try:
+        dialecte = csv.Sniffer().sniff(echantillon, delimiters=',;\t')
+    except csv.Error:
+        dialecte = csv.excel
+    with open(chemin, newline='', encoding=encodage, errors='replace') as f:
+        yield from csv.reader(f, dialecte)
+
+
+def _texte_cellule(valeur):
+    """Valeur de cellule -> texte. Un nombre entier est écrit sans décimales ;
+    à 9 chiffres, c'est un numéro français dont Excel a retiré le 0 initial
+    (0612345678 saisi comme nombre) : on le remet."""
+    if valeur is None:
+        return ''
+    if isinstance(valeur, float) and valeur.is_integer():
+        valeur = int(valeur)
+    if isinstance(valeur, int) and not isinstance(valeur, bool):
+        texte = str(valeur)
+        return '0' + texte if len(texte) == 9 else texte
+    return str(valeur)
+
+
+def lire_xlsx(chemin):
+    """Lignes de la première feuille d'un classeur, en mode lecture seule
+    (openpyxl ne charge pas tout le classeur en mémoire)"""
+    try:
+        import openpyxl
+    except ImportError:
+        raise ValueError("l'import Excel nécessite openpyxl (pip install openpyxl)")
+    classeur = openpyxl.load_workbook(chemin, read_only=True, data_only=True)
+    try:
+        for ligne in classeur.active.iter_rows(values_only=True):
+            yield [_texte_cellule(valeur) for valeur in ligne]
+    finally:
+        classeur.close()
+
+
+def lire_lignes(chemin):
+    extension = os.path.splitext(chemin)[1].lower()
+    if extension == '.csv':
+        return lire_csv(chemin)
+    if extension == '.xlsx':
+        return lire_xlsx(chemin)
+    raise ValueError("format non pris en charge (CSV ou XLSX)")
+
+
+def normaliser_email(email):
+    email = email.strip().lower()
+    if email and not EMAIL_VALIDE.match(email):
+        raise ValueError(f"email invalide ({email})")
+    return email
+
+
+def valider_telephone(telephone):
+    telephone = telephone.strip()
+    chiffres = normaliser_telephone(telephone)
+    if telephone and not 9 <= len(chiffres) <= 15:
+        raise ValueError(f"téléphone invalide ({telephone})")
+    return telephone, chiffres
+
+
+class ImportClients:
+    """Import de clients depuis un fichier CSV ou XLSX.
+
+    executer(db) s'exécute sur la connexion d'écriture, dans une seule
+    transaction (`await db.en_transaction(import_.executer)`) : le fichier est
+    lu ligne à ligne, validé et normalisé, les doublons (téléphone normalisé
+    ou email, dans la base comme dans le fichier) sont écartés par lots de
+    TAILLE_LOT, et chaque lot est inséré avec son historique en deux requêtes.
+    Les compteurs peuvent être lus pendant l'import pour suivre la progression.
+    """
+
+    def __init__(self, chemin, agent_id=None, nom_fichier=None):
+        self.chemin = chemin
+        self.agent_id = agent_id
+        self.nom_fichier = nom_fichier or os.path.basename(chemin)
+        self.lues = 0
+        self.importees = 0
+        self.doublons = 0
+        self.invalides = 0
+        self.erreurs = []
+        self._telephones_vus = set()
+        self._emails_vus = set()
+
+    def executer(self, db):
+        lignes = lire_lignes(self.chemin)
+        colonnes = self._colonnes(next(lignes, []))
+        lot = []
+        for numero, ligne in enumerate(lignes, start=2):
+            if not any(cellule.strip() for cellule in ligne):
+                continue
+            self.lues += 1
+            try:
+                lot.append(self._client(ligne, colonnes))
+            except ValueError as e:
+                self._erreur(numero, e)
+                continue
+            if len(lot) >= TAILLE_LOT:
+                self._inserer(db, lot)
+                lot = []
+        if lot:
+            self._inserer(db, lot)
+        return self.importees
+
+    def _colonnes(self, entete):
+        positions = {_cle_entete(nom): i for i, nom in enumerate(entete)}
+        colonnes = {}
+        for champ, alias in ALIAS_COLONNES.items():
+            for nom in alias:
+                if nom in positions:
+                    colonnes[champ] = positions[nom]
+                    break
+        if 'nom' not in colonnes:
+            raise ValueError("colonne « nom » introuvable dans la première ligne")
+        return colonnes
+
+    def _client(self, ligne, colonnes):
+        valeurs = {champ: ligne[i].strip() if i < len(ligne) else '' for champ, i in colonnes.items()}
+        if not valeurs['nom']:
+            raise ValueError("nom manquant")
+        telephone, chiffres = valider_telephone(valeurs.get('telephone', ''))
+        email = normaliser_email(valeurs.get('email', ''))
+        return (valeurs['nom'], telephone, email, valeurs.get('source', ''), valeurs.get('type_demande', ''),
+                valeurs.get('destination', '')), chiffres
+
+    def _erreur(self, numero, erreur):
+        self.invalides += 1
+        if len(self.erreurs) < MAX_ERREURS_DETAILLEES:
+            self.erreurs.append(f"ligne {numero} : {erreur}")
+
+    def _inserer(self, db, lot):
+        telephones_base, emails_base = db.clients_existants(
+            {chiffres for _, chiffres in lot if chiffres}, {client[2] for client, _ in lot if client[2]})
+        nouveaux = []
+        for client, chiffres in lot:
+            email = client[2]
+            if (chiffres and (chiffres in telephones_base or chiffres in self._telephones_vus)) or \
+                    (email and (email in emails_base or email in self._emails_vus)):
+                self.doublons += 1
+                continue
+            if chiffres:
+                self._telephones_vus.add(chiffres)
+            if email:
+                self._emails_vus.add(email)
+            nouveaux.append(client)
+        if nouveaux:
+            self.importees += db.importer_clients(nouveaux, self.agent_id, f"Import {self.nom_fichier}")
+
+    def progression(self):
+        return f"📥 Import en cours... {self.lues} lignes lues, {self.importees} clients importés"
+
+    def rapport(self):
+        texte = (f"✅ IMPORT TERMINÉ ({self.nom_fichier})\n\n"
+                 f"📄 {self.lues} lignes lues\n"
+                 f"➕ {self.importees} clients importés\n"
+                 f"♻️ {self.doublons} doublons ignorés\n"
+                 f"❌ {self.invalides} lignes invalides")
+        if self.erreurs:
+            texte += "\n\n" + "\n".join(self.erreurs)
+            if self.invalides > len(self.erreurs):
+                texte += "\n..."
+        return texte
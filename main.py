@@ -1,34 +1,72 @@
+import asyncio
 import logging
+from time import perf_counter
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.helpers import escape_markdown
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
-from database import Database
+from database import EXPORTS, Database, date_affichage, date_vers_iso
+from database_async import AsyncDatabase
+from envoi import Expediteur
+from persistance import SQLitePersistence
+from concurrence import EnsembleAdmins, ProcesseurParUtilisateur
+from formulaires import Etape, Formulaire, traiter_saisie
+from planificateur import PlanificateurRelances
+from importation import ERREURS_FICHIER, ImportClients
+from cache import CacheLRU
+from exportation import FORMATS, exporter
+from metriques import instrumenter_application, metriques, servir_prometheus
 from datetime import datetime, time, timedelta
 import os
+import tempfile
 
 # Configuration
 TOKEN = os.environ.get('TOKEN')
-ADMIN_IDS = [int(x) for x in os.environ.get('ADMIN_IDS', '').split(',') if x]
+ADMIN_IDS = EnsembleAdmins(int(x) for x in os.environ.get('ADMIN_IDS', '').split(',') if x)
 BOT_USERNAME = "@relanceavent_bot"
 
 logging.basicConfig(level=logging.INFO)
-db = Database()
+logger = logging.getLogger(__name__)
+db = AsyncDatabase()
+# Tous les appels à l'API Bot passent par l'expéditeur (limites de débit, reprises)
+expediteur = Expediteur()
+# Rappels individuels des relances à heure fixe (sans agent : envoyés aux admins)
+planificateur = PlanificateurRelances(db, ADMIN_IDS)
+
+# Fiches client rendues (texte, clavier), invalidées à chaque écriture sur le client
+fiches = CacheLRU(int(os.environ.get('CACHE_FICHES', '1000')))
+db.sur_modification_client(fiches.invalider)
 
 # Ajouter les admins dans la base au démarrage
 for tid in ADMIN_IDS:
-    db.ajouter_agent(tid)
+    db.sync.ajouter_agent(tid)
 
-# ---------- Menu principal ----------
-async def menu_principal(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    keyboard = [
+# ---------- Claviers fixes (construits une fois) ----------
+CLAVIER_MENU = InlineKeyboardMarkup([
         [InlineKeyboardButton("➕ NOUVEAU CLIENT", callback_data='nouveau_client')],
         [InlineKeyboardButton("📅 RELANCES AUJOURD'HUI", callback_data='relances_jour')],
         [InlineKeyboardButton("⚠️ RELANCES EN RETARD", callback_data='relances_retard')],
         [InlineKeyboardButton("📋 PROCHAINS 7 JOURS", callback_data='relances_7j')],
         [InlineKeyboardButton("🔍 RECHERCHER CLIENT", callback_data='rechercher')],
+        [InlineKeyboardButton("📥 IMPORTER DES CLIENTS", callback_data='importer_clients')],
+        [InlineKeyboardButton("📤 EXPORTER", callback_data='exporter')],
         [InlineKeyboardButton("📊 STATISTIQUES", callback_data='statistiques')],
         [InlineKeyboardButton("👥 GESTION ADMINS", callback_data='gestion_admins')],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+])
+CLAVIER_RETOUR_MENU = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 RETOUR", callback_data='menu_principal')]])
+
+async def refuser_non_admin(update):
+    """Répond par un refus et renvoie True si l'utilisateur n'est pas administrateur"""
+    if update.effective_user.id in ADMIN_IDS:
+        return False
+    if update.callback_query:
+        await update.callback_query.answer("⛔ Réservé aux administrateurs", show_alert=True)
+    else:
+        await update.message.reply_text("⛔ Réservé aux administrateurs")
+    return True
+
+# ---------- Menu principal ----------
+async def menu_principal(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    reply_markup = CLAVIER_MENU
     texte = "🚀 *GESTION DES RELANCES CLIENTS*\n\nSélectionnez une option :"
     if update.callback_query:
         await update.callback_query.answer()
@@ -37,114 +75,40 @@ async def menu_principal(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(texte, reply_markup=reply_markup, parse_mode='Markdown')
 
 # ---------- Ajout client ----------
-async def nouveau_client(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    context.user_data.clear()
-    context.user_data['etape'] = 'nom'
-    context.user_data['client'] = {}
-    keyboard = [[InlineKeyboardButton("🔙 RETOUR", callback_data='menu_principal')]]
-    await query.edit_message_text(
-        "👤 *NOUVEAU CLIENT*\n\nÉtape 1/6 - Envoyez le *nom complet* :",
-        reply_markup=InlineKeyboardMarkup(keyboard),
-        parse_mode='Markdown'
-    )
-
-async def recevoir_nom(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if context.user_data.get('etape') != 'nom':
-        return
-    context.user_data['client']['nom'] = update.message.text
-    context.user_data['etape'] = 'telephone'
-    keyboard = [[InlineKeyboardButton("🔙 RETOUR", callback_data='menu_principal')]]
-    await update.message.reply_text(
-        "Étape 2/6 - Envoyez le *téléphone* (ou 'skip') :",
-        reply_markup=InlineKeyboardMarkup(keyboard),
-        parse_mode='Markdown'
-    )
-
-async def recevoir_telephone(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if context.user_data.get('etape') != 'telephone':
-        return
-    texte = update.message.text
-    if texte.lower() != 'skip':
-        context.user_data['client']['telephone'] = texte
-    context.user_data['etape'] = 'email'
-    keyboard = [[InlineKeyboardButton("🔙 RETOUR", callback_data='menu_principal')]]
-    await update.message.reply_text(
-        "Étape 3/6 - Envoyez l'*email* (ou 'skip') :",
-        reply_markup=InlineKeyboardMarkup(keyboard),
-        parse_mode='Markdown'
-    )
-
-async def recevoir_email(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if context.user_data.get('etape') != 'email':
-        return
-    texte = update.message.text
-    if texte.lower() != 'skip':
-        context.user_data['client']['email'] = texte
-    context.user_data['etape'] = 'source'
-    keyboard = [[InlineKeyboardButton("🔙 RETOUR", callback_data='menu_principal')]]
-    await update.message.reply_text(
-        "Étape 4/6 - Envoyez la *source* (Instagram, Site web, etc.) ou 'skip' :",
-        reply_markup=InlineKeyboardMarkup(keyboard),
-        parse_mode='Markdown'
-    )
-
-async def recevoir_source(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if context.user_data.get('etape') != 'source':
-        return
-    texte = update.message.text
-    if texte.lower() != 'skip':
-        context.user_data['client']['source'] = texte
-    context.user_data['etape'] = 'type_demande'
-    keyboard = [[InlineKeyboardButton("🔙 RETOUR", callback_data='menu_principal')]]
-    await update.message.reply_text(
-        "Étape 5/6 - Envoyez le *type de demande* (devis, info, réservation) ou 'skip' :",
-        reply_markup=InlineKeyboardMarkup(keyboard),
-        parse_mode='Markdown'
+async def creer_client(update: Update, context: ContextTypes.DEFAULT_TYPE, client):
+    # Le client est rattaché à l'agent qui le crée (rappel quotidien par portefeuille)
+    agent = await db.get_agent(update.effective_user.id)
+    # Ajouter le client et son entrée d'historique (une seule transaction)
+    cid = await db.ajouter_client_journalise(
+        nom=client.get('nom', ''),
+        telephone=client.get('telephone', ''),
+        email=client.get('email', ''),
+        source=client.get('source', ''),
+        type_demande=client.get('type_demande', ''),
+        destination=client.get('destination', ''),
+        agent_id=agent[0] if agent else None
     )
 
-async def recevoir_type_demande(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if context.user_data.get('etape') != 'type_demande':
-        return
-    texte = update.message.text
-    if texte.lower() != 'skip':
-        context.user_data['client']['type_demande'] = texte
-    context.user_data['etape'] = 'destination'
-    keyboard = [[InlineKeyboardButton("🔙 RETOUR", callback_data='menu_principal')]]
-    await update.message.reply_text(
-        "Étape 6/6 - Envoyez la *destination* (ou 'skip') :",
-        reply_markup=InlineKeyboardMarkup(keyboard),
-        parse_mode='Markdown'
-    )
-
-async def recevoir_destination(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if context.user_data.get('etape') != 'destination':
-        return
-    texte = update.message.text
-    if texte.lower() != 'skip':
-        context.user_data['client']['destination'] = texte
-
-    # Ajouter le client
-    cid = db.ajouter_client(
-        nom=context.user_data['client'].get('nom', ''),
-        telephone=context.user_data['client'].get('telephone', ''),
-        email=context.user_data['client'].get('email', ''),
-        source=context.user_data['client'].get('source', ''),
-        type_demande=context.user_data['client'].get('type_demande', ''),
-        destination=context.user_data['client'].get('destination', ''),
-        agent_id=None
-    )
-
-    # Ajouter dans l'historique
-    db.ajouter_historique(cid, "création", "Client créé", None)
-
-    context.user_data['etape'] = None
     await update.message.reply_text(f"✅ Client ajouté avec succès ! ID: `{cid}`", parse_mode='Markdown')
     keyboard = [[InlineKeyboardButton("➕ AJOUTER UNE RELANCE", callback_data=f'ajouter_relance_{cid}')],
                 [InlineKeyboardButton("🔙 MENU", callback_data='menu_principal')]]
     await update.message.reply_text("Que voulez-vous faire ?", reply_markup=InlineKeyboardMarkup(keyboard))
 
+CREATION_CLIENT = Formulaire([
+    Etape('nom', "Envoyez le *nom complet* :"),
+    Etape('telephone', "Envoyez le *téléphone* (ou 'skip') :", facultatif=True),
+    Etape('email', "Envoyez l'*email* (ou 'skip') :", facultatif=True),
+    Etape('source', "Envoyez la *source* (Instagram, Site web, etc.) ou 'skip' :", facultatif=True),
+    Etape('type_demande', "Envoyez le *type de demande* (devis, info, réservation) ou 'skip' :", facultatif=True),
+    Etape('destination', "Envoyez la *destination* (ou 'skip') :", facultatif=True),
+], creer_client, stockage='client', titre="👤 *NOUVEAU CLIENT*", numeroter=True, parse_mode='Markdown')
+
+async def nouveau_client(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    context.user_data.clear()
+    await CREATION_CLIENT.demarrer(update, context)
+
 # ---------- Ajout de relance ----------
 async def ajouter_relance(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -156,6 +120,7 @@ async def ajouter_relance(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [
         [InlineKeyboardButton("📅 Date précise", callback_data='type_relance_date')],
         [InlineKeyboardButton("⏱️ X jours avant une date", callback_data='type_relance_avant')],
+        [InlineKeyboardButton("🔁 Relance récurrente", callback_data='type_relance_recurrente')],
         [InlineKeyboardButton("🔙 RETOUR", callback_data=f'voir_client_{cid}')]
     ]
     await query.edit_message_text(
@@ -170,137 +135,504 @@ async def type_relance_choisi(update: Update, context: ContextTypes.DEFAULT_TYPE
     choix = query.data
     if choix == 'type_relance_date':
         context.user_data['type_relance'] = 'date_precise'
-        keyboard = [[InlineKeyboardButton("🔙 RETOUR", callback_data=f'voir_client_{context.user_data["relance_client_id"]}')]]
-        await query.edit_message_text(
-            "📅 Envoyez la date précise (format JJ/MM/AAAA) :",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-        context.user_data['etape'] = 'date_precise'
+        await RELANCE_DATE.demarrer(update, context)
     elif choix == 'type_relance_avant':
         context.user_data['type_relance'] = 'avant_date'
-        keyboard = [[InlineKeyboardButton("🔙 RETOUR", callback_data=f'voir_client_{context.user_data["relance_client_id"]}')]]
-        await query.edit_message_text(
-            "⏱️ Envoyez le nombre de jours avant la date :",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-        context.user_data['etape'] = 'nb_jours_avant'
+        await RELANCE_AVANT.demarrer(update, context)
+    elif choix == 'type_relance_recurrente':
+        context.user_data['type_relance'] = 'recurrente'
+        await RELANCE_RECURRENTE.demarrer(update, context)
 
-async def recevoir_date_precise(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if context.user_data.get('etape') != 'date_precise':
-        return
-    date_texte = update.message.text
-    try:
-        datetime.strptime(date_texte, '%d/%m/%Y')
-    except:
-        await update.message.reply_text("❌ Format incorrect. Utilisez JJ/MM/AAAA")
-        return
+def valider_date(texte):
+    texte = texte.strip()
+    datetime.strptime(texte, '%d/%m/%Y')
+    return texte
+
+def valider_date_heure(texte):
+    """JJ/MM/AAAA ou JJ/MM/AAAA HH:MM, renvoyé normalisé"""
+    texte = texte.strip()
+    if ' ' in texte:
+        return datetime.strptime(texte, '%d/%m/%Y %H:%M').strftime('%d/%m/%Y %H:%M')
+    return valider_date(texte)
+
+def valider_regle(texte):
+    """'7' (tous les 7 jours) ou 'J-30,J-15,J-7,J-1' -> [intervalle, jalons],
+    jalons normalisés en jours décroissants ('30,15,7,1')"""
+    texte = texte.strip().upper().replace(' ', '')
+    if texte.isdigit():
+        if int(texte) <= 0:
+            raise ValueError(texte)
+        return [int(texte), None]
+    jours = sorted({int(jalon.removeprefix('J-')) for jalon in texte.split(',') if jalon}, reverse=True)
+    if not jours or jours[-1] < 0:
+        raise ValueError(texte)
+    return [None, ','.join(map(str, jours))]
+
+def retour_fiche(user_data):
+    return f'voir_client_{user_data["relance_client_id"]}'
+
+async def creer_relance_date(update: Update, context: ContextTypes.DEFAULT_TYPE, valeurs):
+    date_texte, _, heure = valeurs['date_precise'].partition(' ')
+    heure = heure or None
     cid = context.user_data['relance_client_id']
-    rid = db.ajouter_relance(cid, date_texte, 'date_precise')
-    db.ajouter_historique(cid, "relance ajoutée", f"Relance programmée au {date_texte}", None)
+    rid = await db.ajouter_relance_journalisee(cid, date_texte, 'date_precise', f"Relance programmée au {date_texte}",
+                                               heure=heure)
+    if heure:
+        await planificateur.relance_modifiee(rid)
+        date_texte += f" à {heure}"
     await update.message.reply_text(f"✅ Relance ajoutée pour le {date_texte}")
     await afficher_client(update, context, cid)
 
-async def recevoir_nb_jours_avant(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if context.user_data.get('etape') != 'nb_jours_avant':
-        return
-    try:
-        nb_jours = int(update.message.text)
-    except:
-        await update.message.reply_text("❌ Veuillez entrer un nombre valide")
-        return
-    context.user_data['nb_jours_avant'] = nb_jours
-    context.user_data['etape'] = 'date_reference'
-    keyboard = [[InlineKeyboardButton("🔙 RETOUR", callback_data=f'voir_client_{context.user_data["relance_client_id"]}')]]
-    await update.message.reply_text(
-        f"📅 Envoyez la *date de référence* (JJ/MM/AAAA) :",
-        reply_markup=InlineKeyboardMarkup(keyboard),
-        parse_mode='Markdown'
-    )
-
-async def recevoir_date_reference(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if context.user_data.get('etape') != 'date_reference':
-        return
-    date_texte = update.message.text
-    try:
-        date_ref = datetime.strptime(date_texte, '%d/%m/%Y')
-    except:
-        await update.message.reply_text("❌ Format incorrect. Utilisez JJ/MM/AAAA")
-        return
-    nb_jours = context.user_data['nb_jours_avant']
+async def creer_relance_avant(update: Update, context: ContextTypes.DEFAULT_TYPE, valeurs):
+    nb_jours = valeurs['nb_jours_avant']
+    date_texte = valeurs['date_reference']
+    date_ref = datetime.strptime(date_texte, '%d/%m/%Y')
     date_relance = (date_ref - timedelta(days=nb_jours)).strftime('%d/%m/%Y')
     cid = context.user_data['relance_client_id']
-    rid = db.ajouter_relance(cid, date_relance, f"{nb_jours}j avant")
-    db.ajouter_historique(cid, "relance ajoutée", f"Relance programmée {nb_jours} jours avant le {date_texte}", None)
+    await db.ajouter_relance_journalisee(cid, date_relance, f"{nb_jours}j avant",
+                                         f"Relance programmée {nb_jours} jours avant le {date_texte}")
     await update.message.reply_text(f"✅ Relance ajoutée pour le {date_relance}")
     await afficher_client(update, context, cid)
 
+async def creer_relance_recurrente(update: Update, context: ContextTypes.DEFAULT_TYPE, valeurs):
+    intervalle, jalons = valeurs['regle_recurrence']
+    date_texte = valeurs['date_depart']
+    regle = f"tous les {intervalle} jours" if intervalle else ', '.join(f"J-{j}" for j in jalons.split(','))
+    cid = context.user_data['relance_client_id']
+    regle_id, prochaine = await db.ajouter_regle_relance_journalisee(
+        cid, date_texte, f"Relances {regle} jusqu'au {date_texte}", intervalle=intervalle, jalons=jalons)
+    if regle_id is None:
+        await update.message.reply_text(f"❌ Aucune relance à venir avant le {date_texte}")
+    else:
+        await update.message.reply_text(f"✅ Relances {regle} jusqu'au {date_texte}\n"
+                                        f"Prochaine : {date_affichage(prochaine)}")
+    await afficher_client(update, context, cid)
+
+RELANCE_DATE = Formulaire([
+    Etape('date_precise', "📅 Envoyez la date précise (format JJ/MM/AAAA, ou JJ/MM/AAAA HH:MM pour un rappel à l'heure) :",
+          valider=valider_date_heure, erreur="❌ Format incorrect. Utilisez JJ/MM/AAAA ou JJ/MM/AAAA HH:MM"),
+], creer_relance_date, retour=retour_fiche)
+
+RELANCE_AVANT = Formulaire([
+    Etape('nb_jours_avant', "⏱️ Envoyez le nombre de jours avant la date :",
+          valider=int, erreur="❌ Veuillez entrer un nombre valide"),
+    Etape('date_reference', "📅 Envoyez la *date de référence* (JJ/MM/AAAA) :",
+          valider=valider_date, erreur="❌ Format incorrect. Utilisez JJ/MM/AAAA"),
+], creer_relance_avant, retour=retour_fiche, parse_mode='Markdown')
+
+RELANCE_RECURRENTE = Formulaire([
+    Etape('regle_recurrence', "🔁 Envoyez la règle : un nombre de jours (ex. 7 : tous les 7 jours jusqu'au départ) "
+          "ou des jalons avant le départ (ex. J-30,J-15,J-7,J-1) :",
+          valider=valider_regle, erreur="❌ Règle invalide. Exemples : 7 ou J-30,J-15,J-7,J-1"),
+    Etape('date_depart', "📅 Envoyez la *date de départ* (JJ/MM/AAAA) :",
+          valider=valider_date, erreur="❌ Format incorrect. Utilisez JJ/MM/AAAA"),
+], creer_relance_recurrente, retour=retour_fiche, parse_mode='Markdown')
+
 # ---------- Affichage client ----------
-async def afficher_client(update: Update, context: ContextTypes.DEFAULT_TYPE, client_id):
-    client = db.get_client(client_id)
-    if not client:
-        await update.message.reply_text("❌ Client introuvable")
-        return
+def rendre_fiche(fiche):
+    """(client, relances, nb_historique) -> (texte, clavier) de la fiche"""
+    client, relances, nb_historique = fiche
     cid, nom, tel, email, source, type_demande, destination, statut, date_creation, agent_id = client
-    historique = db.get_historique_client(cid)
-    relances = db.get_relances_client(cid)
-
-    texte = f"👤 *{nom}*\n"
+    # Saisies libres : un _ ou un * casserait le Markdown de toute la fiche
+    texte = f"👤 *{escape_markdown(nom)}*\n"
     if tel:
-        texte += f"📞 {tel}\n"
+        texte += f"📞 {escape_markdown(tel)}\n"
     if email:
-        texte += f"📧 {email}\n"
+        texte += f"📧 {escape_markdown(email)}\n"
     if source:
-        texte += f"📍 Source: {source}\n"
+        texte += f"📍 Source: {escape_markdown(source)}\n"
     if type_demande:
-        texte += f"🎯 Demande: {type_demande}\n"
+        texte += f"🎯 Demande: {escape_markdown(type_demande)}\n"
     if destination:
-        texte += f"✈️ Destination: {destination}\n"
+        texte += f"✈️ Destination: {escape_markdown(destination)}\n"
     texte += f"📅 Créé le: {date_creation[:10]}\n"
-    texte += f"✅ Statut: {statut}\n\n"
+    texte += f"✅ Statut: {escape_markdown(statut)}\n\n"
 
     if relances:
         texte += "⏰ *Relances:*\n"
-        for r in relances[:3]:
+        for r in relances:
             rid, cid, date_r, type_r, priorite, statut_r, notes, date_c, date_e, resultat = r
             emoji = "✅" if statut_r == "effectuee" else "⏳"
-            texte += f"{emoji} {date_r} ({type_r})\n"
+            texte += f"{emoji} {date_affichage(date_r)} ({escape_markdown(type_r or '')})\n"
 
     keyboard = [
         [InlineKeyboardButton("➕ AJOUTER RELANCE", callback_data=f'ajouter_relance_{cid}')],
         [InlineKeyboardButton("✅ CHANGER STATUT", callback_data=f'changer_statut_{cid}')],
-        [InlineKeyboardButton("📋 HISTORIQUE", callback_data=f'historique_{cid}')],
+        [InlineKeyboardButton(f"📋 HISTORIQUE ({nb_historique})", callback_data=f'historique_{cid}')],
         [InlineKeyboardButton("🔙 RETOUR", callback_data='menu_principal')]
     ]
-    await update.message.reply_text(texte, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+    return texte, InlineKeyboardMarkup(keyboard)
 
-# ---------- Relances du jour ----------
-async def relances_jour(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def afficher_client(update: Update, context: ContextTypes.DEFAULT_TYPE, client_id):
+    # Le jeton est pris avant la lecture : une fiche modifiée pendant ce temps n'est pas mise en cache
+    jeton = fiches.jeton(client_id)
+    rendu = fiches.lire(client_id)
+    if rendu is None:
+        # Client, 3 relances et nombre d'entrées d'historique : une seule requête
+        fiche = await db.get_fiche_client(client_id)
+        if not fiche:
+            await update.effective_message.reply_text("❌ Client introuvable")
+            return
+        rendu = rendre_fiche(fiche)
+        fiches.ecrire(client_id, jeton, rendu)
+    texte, reply_markup = rendu
+    await update.effective_message.reply_text(texte, reply_markup=reply_markup, parse_mode='Markdown')
+
+# ---------- Historique client ----------
+# historique_{cid} : première page ; historique_{cid}_{s|p}_{id} : page suivante / précédente
+# (id de la dernière / première entrée affichée)
+async def historique_client(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    cid, _, navigation = query.data.replace('historique_', '', 1).partition('_')
+    cid = int(cid)
+    apres = avant = None
+    if navigation:
+        sens, hid = navigation.split('_')
+        if sens == 's':
+            apres = int(hid)
+        else:
+            avant = int(hid)
+    entrees, precedent, suivant = await db.get_historique_client_page(cid, apres=apres, avant=avant)
+
+    texte = "📋 *HISTORIQUE*\n\n" + (lignes_historique(entrees) or "Aucune entrée.")
+
+    navigation = []
+    if precedent and entrees:
+        navigation.append(InlineKeyboardButton("◀️ PRÉCÉDENT", callback_data=f'historique_{cid}_p_{entrees[0][0]}'))
+    if suivant and entrees:
+        navigation.append(InlineKeyboardButton("SUIVANT ▶️", callback_data=f'historique_{cid}_s_{entrees[-1][0]}'))
+    keyboard = [navigation] if navigation else []
+    if not suivant:
+        # Dernière page : les entrées plus anciennes sont dans les archives
+        nb_archives = await db.nb_historique_archive(cid)
+        if nb_archives:
+            keyboard.append([InlineKeyboardButton(f"🗄️ ARCHIVES ({nb_archives})", callback_data=f'archives_{cid}_0')])
+    keyboard.append([InlineKeyboardButton("🔙 FICHE CLIENT", callback_data=f'voir_client_{cid}')])
+    await envoyer_page(update, texte, InlineKeyboardMarkup(keyboard))
+
+def lignes_historique(entrees):
+    texte = ""
+    for hid, action, details, date_action, agent_nom in entrees:
+        ligne = f"{date_affichage(str(date_action)[:10])} {str(date_action)[11:16]} - {action or ''}"
+        if details:
+            ligne += f" : {details}"
+        if agent_nom:
+            ligne += f" ({agent_nom})"
+        texte += f"• {escape_markdown(ligne)}\n"
+    return texte
+
+# archives_{cid}_{page} : entrées archivées (historique_archive), lues à la demande
+async def archives_client(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    relances = db.get_relances_du_jour()
+    cid, page = map(int, query.data.replace('archives_', '', 1).split('_'))
+    entrees, precedent, suivant = await db.get_historique_archive_page(cid, page)
+
+    texte = "🗄️ *HISTORIQUE ARCHIVÉ*\n\n" + (lignes_historique(entrees) or "Aucune entrée.")
+    navigation = []
+    if precedent:
+        navigation.append(InlineKeyboardButton("◀️ PRÉCÉDENT", callback_data=f'archives_{cid}_{page - 1}'))
+    if suivant:
+        navigation.append(InlineKeyboardButton("SUIVANT ▶️", callback_data=f'archives_{cid}_{page + 1}'))
+    keyboard = [navigation] if navigation else []
+    keyboard.append([InlineKeyboardButton("🔙 HISTORIQUE", callback_data=f'historique_{cid}')])
+    await envoyer_page(update, texte, InlineKeyboardMarkup(keyboard))
+
+# ---------- Listes paginées ----------
+# Une liste = un seul message de Database.TAILLE_PAGE éléments, boutons précédent / suivant.
+# Les boutons de navigation portent le curseur (clé du premier / dernier élément).
+def curseur_vers_texte(curseur):
+    return '_'.join(str(v) for v in curseur)
+
+def texte_vers_curseur(texte, liste):
+    if liste == 'retard':
+        date_r, rid = texte.rsplit('_', 1)
+        return (date_r, int(rid))
+    if liste == 'jour':
+        rang, rid = texte.split('_')
+        return (int(rang), int(rid))
+    return (int(texte),)
+
+def cle_element(liste, element):
+    if liste == 'retard':
+        return (element[2], element[0])  # (date_relance, id)
+    if liste == 'jour':
+        return (element[11], element[0])  # (rang_priorite, id)
+    return (element[-1],)  # id ou rang de pertinence (rechercher_clients_page)
+
+def clavier_page(liste, elements, precedent, suivant, boutons):
+    keyboard = [list(b) for b in boutons]
+    navigation = []
+    if precedent and elements:
+        navigation.append(InlineKeyboardButton(
+            "◀️ PRÉCÉDENT", callback_data=f'page_{liste}_p_{curseur_vers_texte(cle_element(liste, elements[0]))}'))
+    if suivant and elements:
+        navigation.append(InlineKeyboardButton(
+            "SUIVANT ▶️", callback_data=f'page_{liste}_s_{curseur_vers_texte(cle_element(liste, elements[-1]))}'))
+    if navigation:
+        keyboard.append(navigation)
+    keyboard.append([InlineKeyboardButton("🔙 RETOUR", callback_data='menu_principal')])
+    return InlineKeyboardMarkup(keyboard)
+
+async def envoyer_page(update: Update, texte, reply_markup):
+    if update.callback_query:
+        await update.callback_query.edit_message_text(texte, reply_markup=reply_markup, parse_mode='Markdown')
+    else:
+        await update.message.reply_text(texte, reply_markup=reply_markup, parse_mode='Markdown')
+
+def boutons_relances(context, liste, relances):
+    """Un bouton par relance : « effectuée » en un geste, ou case à cocher en
+    mode sélection multiple, suivis des actions de sélection"""
+    selection = context.user_data.get('selection')
+    if not selection or selection['liste'] != liste:
+        boutons = [[InlineKeyboardButton(f"✅ {r[10]}", callback_data=f'marquer_relance_{r[0]}_{r[1]}')]
+                   for r in relances]
+        boutons.append([InlineKeyboardButton("☑️ SÉLECTION MULTIPLE", callback_data=f'selection_debut_{liste}')])
+        return boutons
+    choisis = set(selection['ids'])
+    boutons = [[InlineKeyboardButton(f"{'☑️' if r[0] in choisis else '⬜'} {r[10]}",
+                                     callback_data=f'selection_choisir_{r[0]}')] for r in relances]
+    return boutons + actions_selection(len(choisis))
+
+def actions_selection(nb):
+    return [
+        [InlineKeyboardButton(f"✅ EFFECTUÉES ({nb})", callback_data='selection_effectuer'),
+         InlineKeyboardButton("📆 REPORTER", callback_data='selection_reporter')],
+        [InlineKeyboardButton("👤 RÉASSIGNER", callback_data='selection_reassigner'),
+         InlineKeyboardButton("✖️ FIN DE LA SÉLECTION", callback_data='selection_fin')],
+    ]
+
+async def page_relances_jour(update: Update, context: ContextTypes.DEFAULT_TYPE, apres=None, avant=None):
+    relances, precedent, suivant = await db.get_relances_du_jour_page(apres=apres, avant=avant)
+    if not relances and (apres is not None or avant is not None):
+        # Page vidée (son dernier élément vient d'être traité) : on recule d'une
+        # page, ou on repart de la première si l'on reculait déjà
+        return await page_relances_jour(update, context, avant=apres)
     if not relances:
-        await query.edit_message_text("✅ Aucune relance aujourd'hui.")
-        keyboard = [[InlineKeyboardButton("🔙 RETOUR", callback_data='menu_principal')]]
-        await query.message.reply_text("Retour au menu ?", reply_markup=InlineKeyboardMarkup(keyboard))
+        await envoyer_page(update, "✅ Aucune relance aujourd'hui.", clavier_page('jour', [], False, False, []))
         return
+    texte = "📅 *RELANCES AUJOURD'HUI*\n\n"
+    for r in relances:
+        rid, cid, date_r, type_r, priorite, statut_r, notes, date_c, date_e, resultat, nom, rang = r
+        emoji = "🔴" if priorite == 'urgent' else "🟡" if priorite == 'haute' else "🟢"
+        texte += f"{emoji} *{escape_markdown(nom)}* - {escape_markdown(type_r or '')}\n"
+    boutons = boutons_relances(context, 'jour', relances)
+    await envoyer_page(update, texte, clavier_page('jour', relances, precedent, suivant, boutons))
 
+async def page_relances_retard(update: Update, context: ContextTypes.DEFAULT_TYPE, apres=None, avant=None):
+    relances, precedent, suivant = await db.get_relances_en_retard_page(apres=apres, avant=avant)
+    if not relances and (apres is not None or avant is not None):
+        # Page vidée (son dernier élément vient d'être traité) : on recule d'une
+        # page, ou on repart de la première si l'on reculait déjà
+        return await page_relances_retard(update, context, avant=apres)
+    if not relances:
+        await envoyer_page(update, "✅ Aucune relance en retard.", clavier_page('retard', [], False, False, []))
+        return
+    texte = "⚠️ *RELANCES EN RETARD*\n\n"
     for r in relances:
         rid, cid, date_r, type_r, priorite, statut_r, notes, date_c, date_e, resultat, nom = r
-        emoji = "🔴" if priorite == 'urgent' else "🟡" if priorite == 'haute' else "🟢"
-        texte = f"{emoji} *{nom}* - {type_r}\n"
-        keyboard = [[InlineKeyboardButton("✅ MARQUER EFFECTUÉE", callback_data=f'marquer_relance_{rid}_{cid}')]]
-        await query.message.reply_text(texte, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+        texte += f"🔴 *{escape_markdown(nom)}* - Prévue le {date_affichage(date_r)}\n"
+    boutons = boutons_relances(context, 'retard', relances)
+    await envoyer_page(update, texte, clavier_page('retard', relances, precedent, suivant, boutons))
+
+async def page_recherche(update: Update, context: ContextTypes.DEFAULT_TYPE, apres=None, avant=None):
+    recherche = context.user_data.get('recherche', '')
+    clients, precedent, suivant = await db.rechercher_clients_page(recherche, apres=apres, avant=avant)
+    if not clients:
+        await envoyer_page(update, "❌ Aucun client trouvé.", clavier_page('recherche', [], False, False, []))
+        return
+    texte = "🔍 *RÉSULTATS*\n\n"
+    boutons = []
+    for c in clients:
+        cid, nom, tel, email, source, type_demande, destination, statut, date_c, agent_id, cle = c
+        # Saisies libres : *, _, ` ou [ casseraient le Markdown de toute la page
+        texte += (f"👤 *{escape_markdown(nom)}* (ID: {cid})\n📞 {escape_markdown(tel or '')}\n"
+                  f"📧 {escape_markdown(email or '')}\n✅ {escape_markdown(statut)}\n\n")
+        boutons.append([InlineKeyboardButton(f"📋 {nom}", callback_data=f'voir_client_{cid}')])
+    await envoyer_page(update, texte, clavier_page('recherche', clients, precedent, suivant, boutons))
 
-    keyboard = [[InlineKeyboardButton("🔙 RETOUR", callback_data='menu_principal')]]
-    await query.message.reply_text("Retour au menu ?", reply_markup=InlineKeyboardMarkup(keyboard))
+PAGES = {
+    'jour': page_relances_jour,
+    'retard': page_relances_retard,
+    'recherche': page_recherche,
+}
 
-async def marquer_relance_effectuee(update: Update, context: ContextTypes.DEFAULT_TYPE):
+def page_affichee(message):
+    """(liste, curseur) pour réafficher la page de relances du message à partir
+    de son premier élément, ou None si le message n'est pas une page de relances.
+    Sans bouton précédent, c'est la première page (curseur None)."""
+    if message is None or message.reply_markup is None:
+        return None
+    donnees = [b.callback_data or '' for ligne in message.reply_markup.inline_keyboard for b in ligne]
+    liste = next((d.replace('selection_debut_', '', 1) for d in donnees if d.startswith('selection_debut_')), None)
+    if liste is None:
+        return None
+    for d in donnees:
+        if d.startswith(f'page_{liste}_p_'):
+            # Le bouton précédent porte la clé du premier élément : on repart juste
+            # avant, sans tomber sur la clé d'un autre élément (utilisable aussi
+            # comme `avant` pour revenir à la page précédente)
+            *debut, rid = texte_vers_curseur(d.replace(f'page_{liste}_p_', '', 1), liste)
+            return liste, (*debut, rid - 0.5)
+    return liste, None
+
+async def changer_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    liste, sens, curseur = query.data.replace('page_', '', 1).split('_', 2)
+    curseur = texte_vers_curseur(curseur, liste)
+    if sens == 's':
+        await PAGES[liste](update, context, apres=curseur)
+    else:
+        await PAGES[liste](update, context, avant=curseur)
+
+# ---------- Sélection multiple (relances du jour / en retard) ----------
+# user_data['selection'] = {'liste': 'jour' ou 'retard', 'ids': [...]} : une
+# liste et non un set, user_data étant persisté en JSON. Chaque action est une
+# seule écriture groupée, suivie d'un seul message récapitulatif.
+async def selection_debut(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    liste = query.data.replace('selection_debut_', '')
+    context.user_data['selection'] = {'liste': liste, 'ids': []}
+    await PAGES[liste](update, context)
+
+async def selection_choisir(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    selection = context.user_data.get('selection')
+    if not selection:
+        await query.answer("Sélection terminée")
+        return
+    await query.answer()
+    rid = int(query.data.replace('selection_choisir_', ''))
+    if rid in selection['ids']:
+        selection['ids'].remove(rid)
+    else:
+        selection['ids'].append(rid)
+    if query.message.reply_markup is None:
+        await PAGES[selection['liste']](update, context)
+        return
+    # Seul le clavier change : on coche / décoche le bouton, sans relire la liste
+    keyboard = []
+    for ligne in query.message.reply_markup.inline_keyboard:
+        if ligne[0].callback_data == query.data:
+            coche = '☑️' if rid in selection['ids'] else '⬜'
+            ligne = [InlineKeyboardButton(f"{coche} {ligne[0].text.split(' ', 1)[1]}", callback_data=query.data)]
+        elif ligne[0].callback_data == 'selection_effectuer':
+            ligne = actions_selection(len(selection['ids']))[0]
+        keyboard.append(list(ligne))
+    await query.edit_message_reply_markup(InlineKeyboardMarkup(keyboard))
+
+async def selection_fin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    selection = context.user_data.pop('selection', None)
+    await PAGES[selection['liste'] if selection else 'jour'](update, context)
+
+def relances_choisies(context):
+    selection = context.user_data.get('selection')
+    return selection['ids'] if selection else []
+
+async def resume_selection(update: Update, context: ContextTypes.DEFAULT_TYPE, texte):
+    selection = context.user_data.pop('selection', None) or {'liste': 'jour'}
+    reply_markup = InlineKeyboardMarkup([
+        [InlineKeyboardButton("📋 REVENIR À LA LISTE", callback_data=f"relances_{selection['liste']}")],
+        [InlineKeyboardButton("🔙 MENU", callback_data='menu_principal')],
+    ])
+    await update.effective_message.reply_text(texte, reply_markup=reply_markup)
+
+async def selection_effectuer(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    ids = relances_choisies(context)
+    if not ids:
+        await query.answer("Aucune relance sélectionnée")
+        return
+    await query.answer()
+    agent = await db.get_agent(update.effective_user.id)
+    faites = await db.effectuer_relances(ids, "effectuee", "Marquée par lot", agent[0] if agent else None)
+    for rid in faites:
+        planificateur.annuler(rid)
+    await resume_selection(update, context, f"✅ {len(faites)} relance(s) marquée(s) comme effectuée(s).")
+
+async def selection_reporter(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if not relances_choisies(context):
+        await query.answer("Aucune relance sélectionnée")
+        return
+    await query.answer()
+    await REPORT_SELECTION.demarrer(update, context)
+
+def valider_jours_report(texte):
+    jours = int(texte)
+    if not 0 < jours <= 365:
+        raise ValueError(texte)
+    return jours
+
+async def reporter_selection(update: Update, context: ContextTypes.DEFAULT_TYPE, valeurs):
+    jours = valeurs['jours_report']
+    agent = await db.get_agent(update.effective_user.id)
+    reportees = await db.reporter_relances(relances_choisies(context), jours, agent[0] if agent else None)
+    for rid, cid, date_r, heure in reportees:
+        if heure:
+            await planificateur.relance_modifiee(rid)
+    await resume_selection(update, context, f"📆 {len(reportees)} relance(s) reportée(s) de {jours} jour(s).")
+
+def retour_selection(user_data):
+    return f"relances_{(user_data.get('selection') or {}).get('liste', 'jour')}"
+
+REPORT_SELECTION = Formulaire([
+    Etape('jours_report', "📆 De combien de jours reporter les relances sélectionnées ?",
+          valider=valider_jours_report, erreur="❌ Envoyez un nombre de jours entre 1 et 365"),
+], reporter_selection, retour=retour_selection)
+
+async def selection_reassigner(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if not relances_choisies(context):
+        await query.answer("Aucune relance sélectionnée")
+        return
+    await query.answer()
+    agents = await db.get_all_agents()
+    keyboard = [[InlineKeyboardButton(f"👤 {nom or tid}", callback_data=f'selection_agent_{aid}')]
+                for aid, nom, tid, role in agents]
+    keyboard.append([InlineKeyboardButton("🔙 RETOUR", callback_data=retour_selection(context.user_data))])
+    await query.edit_message_text("👤 À quel agent confier les clients sélectionnés ?",
+                                  reply_markup=InlineKeyboardMarkup(keyboard))
+
+async def selection_agent(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    nouvel_agent = int(query.data.replace('selection_agent_', ''))
+    agent = await db.get_agent(update.effective_user.id)
+    clients, horaires = await db.reassigner_relances(relances_choisies(context), nouvel_agent,
+                                                     agent[0] if agent else None)
+    # Les rappels à heure fixe portent le destinataire : on les reprogramme
+    for rid in horaires:
+        await planificateur.relance_modifiee(rid)
+    await resume_selection(update, context, f"👤 {len(clients)} client(s) réassigné(s).")
+
+# ---------- Relances du jour ----------
+async def relances_jour(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
+    context.user_data.pop('selection', None)
+    await page_relances_jour(update, context)
+
+async def marquer_relance_effectuee(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
     rid, cid = query.data.replace('marquer_relance_', '').split('_')
     rid = int(rid)
     cid = int(cid)
-    db.marquer_relance_effectuee(rid, "effectuee", "Marquée manuellement")
+    await db.marquer_relance_effectuee_journalisee(rid, "effectuee", "Marquée manuellement")
+    planificateur.annuler(rid)
+    page = page_affichee(query.message)
+    if page is not None:
+        # Depuis une liste : la page est réaffichée sans la relance, les autres restent
+        await query.answer("✅ Relance marquée comme effectuée.")
+        liste, curseur = page
+        await PAGES[liste](update, context, apres=curseur)
+        return
+    await query.answer()
     await query.edit_message_text("✅ Relance marquée comme effectuée.")
     await afficher_client(update, context, cid)
 
@@ -308,91 +640,190 @@ async def marquer_relance_effectuee(update: Update, context: ContextTypes.DEFAUL
 async def relances_retard(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    relances = db.get_relances_en_retard()
-    if not relances:
-        await query.edit_message_text("✅ Aucune relance en retard.")
-        keyboard = [[InlineKeyboardButton("🔙 RETOUR", callback_data='menu_principal')]]
-        await query.message.reply_text("Retour au menu ?", reply_markup=InlineKeyboardMarkup(keyboard))
-        return
-
-    for r in relances:
-        rid, cid, date_r, type_r, priorite, statut_r, notes, date_c, date_e, resultat, nom = r
-        texte = f"🔴 *{nom}* - Prévue le {date_r}\n"
-        keyboard = [[InlineKeyboardButton("✅ MARQUER EFFECTUÉE", callback_data=f'marquer_relance_{rid}_{cid}')]]
-        await query.message.reply_text(texte, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
-
-    keyboard = [[InlineKeyboardButton("🔙 RETOUR", callback_data='menu_principal')]]
-    await query.message.reply_text("Retour au menu ?", reply_markup=InlineKeyboardMarkup(keyboard))
+    context.user_data.pop('selection', None)
+    await page_relances_retard(update, context)
 
 # ---------- Prochains 7 jours ----------
 async def relances_7j(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    relances = db.get_relances_a_venir(7)
+    relances = await db.get_relances_a_venir(7)
     if not relances:
         await query.edit_message_text("✅ Aucune relance dans les 7 prochains jours.")
-        keyboard = [[InlineKeyboardButton("🔙 RETOUR", callback_data='menu_principal')]]
-        await query.message.reply_text("Retour au menu ?", reply_markup=InlineKeyboardMarkup(keyboard))
+        await query.message.reply_text("Retour au menu ?", reply_markup=CLAVIER_RETOUR_MENU)
         return
 
     texte = "📋 *RELANCES À VENIR (7j)*\n\n"
     for r in relances:
         rid, cid, date_r, type_r, priorite, statut_r, notes, date_c, date_e, resultat, nom = r
         emoji = "🔴" if priorite == 'urgent' else "🟡" if priorite == 'haute' else "🟢"
-        texte += f"{emoji} *{nom}* - {date_r} ({type_r})\n"
-    keyboard = [[InlineKeyboardButton("🔙 RETOUR", callback_data='menu_principal')]]
-    await query.edit_message_text(texte, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+        # Occurrence d'une relance récurrente, pas encore créée
+        recurrente = " 🔁" if rid is None else ""
+        texte += (f"{emoji} *{escape_markdown(nom)}* - {date_affichage(date_r)} "
+                  f"({escape_markdown(type_r or '')}){recurrente}\n")
+    await query.edit_message_text(texte, reply_markup=CLAVIER_RETOUR_MENU, parse_mode='Markdown')
 
 # ---------- Recherche ----------
+async def lancer_recherche(update: Update, context: ContextTypes.DEFAULT_TYPE, valeurs):
+    context.user_data['recherche'] = valeurs['recherche']
+    await page_recherche(update, context)
+
+RECHERCHE = Formulaire([
+    Etape('recherche', "🔍 Envoyez le nom, téléphone ou email à rechercher :"),
+], lancer_recherche)
+
 async def rechercher(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    context.user_data['etape'] = 'recherche'
-    keyboard = [[InlineKeyboardButton("🔙 RETOUR", callback_data='menu_principal')]]
+    await RECHERCHE.demarrer(update, context)
+
+async def voir_client(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    cid = int(query.data.replace('voir_client_', ''))
+    await afficher_client(update, context, cid)
+
+# ---------- Import de clients ----------
+async def menu_import(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if await refuser_non_admin(update):
+        return
+    query = update.callback_query
+    await query.answer()
     await query.edit_message_text(
-        "🔍 Envoyez le nom, téléphone ou email à rechercher :",
-        reply_markup=InlineKeyboardMarkup(keyboard)
+        "📥 *IMPORT DE CLIENTS*\n\n"
+        "Envoyez un fichier .csv ou .xlsx dont la première ligne contient les colonnes : "
+        "nom, telephone, email, source, type\\_demande, destination (seul le nom est obligatoire).\n"
+        "Les clients déjà présents (même téléphone ou même email) sont ignorés.",
+        reply_markup=CLAVIER_RETOUR_MENU,
+        parse_mode='Markdown'
     )
 
-async def recevoir_recherche(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if context.user_data.get('etape') != 'recherche':
+async def recevoir_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if await refuser_non_admin(update):
         return
-    recherche = update.message.text
-    clients = db.rechercher_clients(recherche)
-    if not clients:
-        await update.message.reply_text("❌ Aucun client trouvé.")
+    document = update.message.document
+    extension = os.path.splitext(document.file_name or '')[1].lower()
+    if extension not in ('.csv', '.xlsx'):
+        await update.message.reply_text("❌ Envoyez un fichier .csv ou .xlsx")
         return
-    for c in clients:
-        cid, nom, tel, email, source, type_demande, destination, statut, date_c, agent_id = c
-        texte = f"👤 *{nom}* (ID: {cid})\n📞 {tel}\n📧 {email}\n✅ {statut}"
-        keyboard = [[InlineKeyboardButton("📋 VOIR FICHE", callback_data=f'voir_client_{cid}')]]
-        await update.message.reply_text(texte, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
-    context.user_data['etape'] = None
+    suivi = await update.message.reply_text("📥 Import en cours...")
+    agent = await db.get_agent(update.effective_user.id)
+    with tempfile.TemporaryDirectory() as dossier:
+        chemin = os.path.join(dossier, 'import' + extension)
+        fichier = await document.get_file()
+        await fichier.download_to_drive(chemin)
+        import_clients = ImportClients(chemin, agent[0] if agent else None, document.file_name)
+        # Tout l'import est une seule transaction sur l'écrivain ; on édite le
+        # même message pour suivre la progression
+        tache = asyncio.ensure_future(db.en_transaction(import_clients.executer))
+        affiche = None
+        while not tache.done():
+            await asyncio.wait({tache}, timeout=3)
+            texte = import_clients.progression()
+            if not tache.done() and texte != affiche:
+                await suivi.edit_text(texte)
+                affiche = texte
+        try:
+            tache.result()
+        except ERREURS_FICHIER as e:
+            await suivi.edit_text(f"❌ Import annulé : {e}")
+            return
+    keyboard = [[InlineKeyboardButton("🔙 MENU", callback_data='menu_principal')]]
+    await suivi.edit_text(import_clients.rapport(), reply_markup=InlineKeyboardMarkup(keyboard))
 
-async def voir_client(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# ---------- Export ----------
+USAGE_EXPORT = ("/export clients|relances|historique [csv|jsonl] [gz] [statut=...] [agent=ID] "
+                "[du=JJ/MM/AAAA] [au=JJ/MM/AAAA]")
+AIDE_EXPORT = (
+    "📤 *EXPORT*\n\n"
+    "Choisissez une table, ou utilisez la commande :\n"
+    f"`{USAGE_EXPORT}`\n"
+    "agent = ID Telegram de l'agent"
+)
+
+async def menu_export(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if await refuser_non_admin(update):
+        return
     query = update.callback_query
     await query.answer()
-    cid = int(query.data.replace('voir_client_', ''))
-    await afficher_client(update, context, cid)
+    keyboard = [[InlineKeyboardButton(f"📄 {table.upper()} (CSV)", callback_data=f'export_{table}')] for table in EXPORTS]
+    keyboard.append([InlineKeyboardButton("🔙 RETOUR", callback_data='menu_principal')])
+    await query.edit_message_text(AIDE_EXPORT, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+
+async def envoyer_export(update: Update, table, format='csv', compresser=False, **filtres):
+    message = update.effective_message
+    suivi = await message.reply_text(f"📤 Export {table} en cours...")
+    nom = f"{table}_{datetime.now():%Y%m%d_%H%M}.{format}" + ('.gz' if compresser else '')
+    # Le fichier est écrit par lots dans un dossier temporaire, depuis un thread de lecture
+    with tempfile.TemporaryDirectory() as dossier:
+        chemin = os.path.join(dossier, nom)
+        nb = await db.en_lecture(exporter, chemin, table, format, compresser, **filtres)
+        with open(chemin, 'rb') as f:
+            await message.reply_document(f, filename=nom, caption=f"📤 {table} : {nb} lignes")
+    await suivi.delete()
+
+async def export_rapide(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if await refuser_non_admin(update):
+        return
+    query = update.callback_query
+    await query.answer()
+    await envoyer_export(update, query.data.replace('export_', ''))
+
+async def lire_options_export(arguments):
+    """Arguments de /export -> (table, format, compresser, filtres) ; ValueError si invalides"""
+    if not arguments or arguments[0] not in EXPORTS:
+        raise ValueError("table attendue : " + ", ".join(EXPORTS))
+    table, format, compresser, filtres = arguments[0], 'csv', False, {}
+    for argument in arguments[1:]:
+        cle, _, valeur = argument.partition('=')
+        if argument in FORMATS:
+            format = argument
+        elif argument == 'gz':
+            compresser = True
+        elif cle == 'statut' and valeur:
+            filtres['statut'] = valeur
+        elif cle == 'agent' and valeur:
+            agent = await db.get_agent(int(valeur)) if valeur.isdigit() else None
+            if agent is None:
+                raise ValueError(f"agent inconnu : {valeur}")
+            filtres['agent_id'] = agent[0]
+        elif cle in ('du', 'au') and valeur:
+            try:
+                filtres['debut' if cle == 'du' else 'fin'] = date_vers_iso(valeur)
+            except ValueError:
+                raise ValueError(f"date invalide : {valeur}")
+        else:
+            raise ValueError(f"option inconnue : {argument}")
+    return table, format, compresser, filtres
+
+async def commande_export(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if await refuser_non_admin(update):
+        return
+    try:
+        table, format, compresser, filtres = await lire_options_export(context.args)
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}\n\nUsage : {USAGE_EXPORT}")
+        return
+    await envoyer_export(update, table, format, compresser, **filtres)
 
 # ---------- Statistiques ----------
 async def statistiques(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    stats = db.get_statistiques()
+    stats = await db.get_statistiques()
     texte = "📊 *STATISTIQUES*\n\n"
     texte += f"📈 Convertis ce mois : {stats['convertis_mois']}\n"
     texte += f"⏳ Clients en cours : {stats['en_cours']}\n"
     texte += f"⚠️ Relances en retard : {stats['retard']}\n"
     texte += f"📅 Relances aujourd'hui : {stats['aujourd_hui']}"
-    keyboard = [[InlineKeyboardButton("🔙 RETOUR", callback_data='menu_principal')]]
-    await query.edit_message_text(texte, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+    await query.edit_message_text(texte, reply_markup=CLAVIER_RETOUR_MENU, parse_mode='Markdown')
 
 # ---------- Gestion des admins ----------
 async def gestion_admins(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
-    agents = db.get_all_agents()
+    if query:
+        await query.answer()
+    agents = await db.get_all_agents()
     texte = "👥 *GESTION DES ADMINISTRATEURS*\n\n"
     
     keyboard = []
@@ -404,7 +835,11 @@ async def gestion_admins(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard.append([InlineKeyboardButton("➕ AJOUTER ADMIN", callback_data='ajouter_admin')])
     keyboard.append([InlineKeyboardButton("🔙 RETOUR", callback_data='menu_principal')])
     
-    await query.edit_message_text(texte, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+    if query:
+        await query.edit_message_text(texte, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+    else:
+        # Appelé après la saisie d'un nouvel admin (message texte)
+        await update.message.reply_text(texte, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
 
 async def supprimer_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -432,149 +867,250 @@ async def confirmer_suppression_admin(update: Update, context: ContextTypes.DEFA
     aid = int(query.data.replace('confirmer_suppression_admin_', ''))
     
     # Récupérer l'agent pour connaître son telegram_id
-    agent = db.get_agent_by_id(aid)
+    agent = await db.get_agent_by_id(aid)
     if agent:
         tid = agent[2]  # telegram_id
-        # Supprimer de la base
-        db.supprimer_agent(aid)
-        # Retirer de ADMIN_IDS si présent
-        if tid in ADMIN_IDS:
-            ADMIN_IDS.remove(tid)
+        # Supprimer de la base et retirer de ADMIN_IDS ensemble
+        async with ADMIN_IDS.modification:
+            await db.supprimer_agent(aid)
+            ADMIN_IDS.retirer(tid)
     
     await query.edit_message_text("✅ Admin supprimé avec succès.")
     await gestion_admins(update, context)
 
+async def enregistrer_admin(update: Update, context: ContextTypes.DEFAULT_TYPE, valeurs):
+    tid = valeurs['nouvel_admin_id']
+    nom = valeurs.get('nouvel_admin_nom', '')
+    # Ajouter aussi dans la liste des admins pour les vérifications
+    async with ADMIN_IDS.modification:
+        await db.ajouter_agent(tid, nom)
+        ADMIN_IDS.ajouter(tid)
+    await update.message.reply_text(f"✅ Admin {tid} ajouté avec succès !")
+    await gestion_admins(update, context)
+
+NOUVEL_ADMIN = Formulaire([
+    Etape('nouvel_admin_id', "➕ Envoyez l'ID Telegram du nouvel admin :", valider=int, erreur="❌ ID invalide."),
+    Etape('nouvel_admin_nom', "📝 Envoyez le nom du nouvel admin (ou 'skip') :", facultatif=True),
+], enregistrer_admin, retour='gestion_admins')
+
 async def ajouter_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    context.user_data['etape'] = 'nouvel_admin_id'
-    keyboard = [[InlineKeyboardButton("🔙 RETOUR", callback_data='gestion_admins')]]
-    await query.edit_message_text(
-        "➕ Envoyez l'ID Telegram du nouvel admin :",
-        reply_markup=InlineKeyboardMarkup(keyboard)
-    )
+    await NOUVEL_ADMIN.demarrer(update, context)
 
-async def recevoir_nouvel_admin_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if context.user_data.get('etape') != 'nouvel_admin_id':
-        return
-    try:
-        tid = int(update.message.text)
-    except:
-        await update.message.reply_text("❌ ID invalide.")
+# ---------- Gestion centralisée des messages ----------
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Les étapes de saisie sont décrites par les formulaires (CREATION_CLIENT, ...)
+    if not context.user_data.get('etape'):
+        await update.message.reply_text("Utilisez les boutons du menu.")
+    elif not await traiter_saisie(update, context):
+        await update.message.reply_text("Action non reconnue.")
+
+# ---------- Cache ----------
+async def commande_cache(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if await refuser_non_admin(update):
         return
-    context.user_data['nouvel_admin_id'] = tid
-    context.user_data['etape'] = 'nouvel_admin_nom'
-    keyboard = [[InlineKeyboardButton("🔙 RETOUR", callback_data='gestion_admins')]]
+    stats = fiches.statistiques()
     await update.message.reply_text(
-        "📝 Envoyez le nom du nouvel admin (ou 'skip') :",
-        reply_markup=InlineKeyboardMarkup(keyboard)
+        f"🗂️ Cache des fiches : {stats['taille']}/{stats['capacite']} entrées\n"
+        f"Succès : {stats['succes']} / échecs : {stats['echecs']} ({stats['taux_succes']:.0%} de succès)"
     )
 
-async def recevoir_nouvel_admin_nom(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if context.user_data.get('etape') != 'nouvel_admin_nom':
-        return
-    nom = update.message.text
-    if nom.lower() == 'skip':
-        nom = ''
-    tid = context.user_data['nouvel_admin_id']
-    db.ajouter_agent(tid, nom)
-    # Ajouter aussi dans la liste des admins pour les vérifications
-    if tid not in ADMIN_IDS:
-        ADMIN_IDS.append(tid)
-    context.user_data['etape'] = None
-    await update.message.reply_text(f"✅ Admin {tid} ajouté avec succès !")
-    await gestion_admins(update, context)
+# ---------- Métriques ----------
+def jauges_metriques():
+    jauges = {f'cache_fiches_{nom}': valeur for nom, valeur in fiches.statistiques().items()}
+    jauges.update({f'envois_{nom}': valeur for nom, valeur in expediteur.compteurs().items()})
+    return jauges
 
-# ---------- Gestion centralisée des messages ----------
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    etape = context.user_data.get('etape')
-    if not etape:
-        await update.message.reply_text("Utilisez les boutons du menu.")
+def lignes_latences(famille, limite=10):
+    lignes = []
+    for cle, histo in list(metriques.histogrammes(famille).items())[:limite]:
+        lignes.append(f"• {cle} : {histo.nb} × {histo.somme / histo.nb * 1000:.1f} ms, "
+                      f"p95 ≤ {histo.quantile(0.95) * 1000:.0f} ms, max {histo.max * 1000:.0f} ms")
+    return lignes or ["• (aucune mesure)"]
+
+async def commande_metriques(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Réservé aux administrateurs")
         return
-    if etape == 'nom':
-        await recevoir_nom(update, context)
-    elif etape == 'telephone':
-        await recevoir_telephone(update, context)
-    elif etape == 'email':
-        await recevoir_email(update, context)
-    elif etape == 'source':
-        await recevoir_source(update, context)
-    elif etape == 'type_demande':
-        await recevoir_type_demande(update, context)
-    elif etape == 'destination':
-        await recevoir_destination(update, context)
-    elif etape == 'recherche':
-        await recevoir_recherche(update, context)
-    elif etape == 'date_precise':
-        await recevoir_date_precise(update, context)
-    elif etape == 'nb_jours_avant':
-        await recevoir_nb_jours_avant(update, context)
-    elif etape == 'date_reference':
-        await recevoir_date_reference(update, context)
-    elif etape == 'nouvel_admin_id':
-        await recevoir_nouvel_admin_id(update, context)
-    elif etape == 'nouvel_admin_nom':
-        await recevoir_nouvel_admin_nom(update, context)
+    # Texte brut : les clés (motifs, noms de méthodes) contiennent des caractères Markdown
+    lignes = ["📈 MÉTRIQUES", ""]
+    if not metriques.actif:
+        lignes += ["Mesures désactivées (METRIQUES=1 pour les activer)", ""]
     else:
-        await update.message.reply_text("Action non reconnue.")
+        lignes += ["Base de données (par méthode, les plus coûteuses) :"] + lignes_latences('db')
+        lignes += ["", "Handlers :"] + lignes_latences('handler')
+        lignes += ["", "API Bot :"] + lignes_latences('api')
+        erreurs = {**metriques.compteurs('api_erreurs'), **metriques.compteurs('handler_erreurs')}
+        if erreurs:
+            lignes += ["", "Erreurs :"] + [f"• {cle} : {nb}" for cle, nb in sorted(erreurs.items())]
+        lentes = metriques.compteurs('requetes_lentes')
+        lignes += ["", f"Requêtes lentes (≥ {metriques.seuil_lent * 1000:.0f} ms) : {sum(lentes.values())}", ""]
+    lignes += [f"{nom} : {valeur:.2f}" if isinstance(valeur, float) else f"{nom} : {valeur}"
+               for nom, valeur in jauges_metriques().items()]
+    await update.message.reply_text("\n".join(lignes))
 
 # ---------- Notifications automatiques ----------
-async def check_relances_quotidien(context: ContextTypes.DEFAULT_TYPE):
-    """Envoie un récapitulatif quotidien à tous les admins"""
-    relances_jour = db.get_relances_du_jour()
-    relances_retard = db.get_relances_en_retard()
-    relances_7j = db.get_relances_a_venir(7)
+def formater_resume(lignes):
+    """Construit le texte du rappel d'un portefeuille à partir de ses lignes
+    (categorie, date_relance, nom, total)"""
+    retard = [l for l in lignes if l[0] == 'retard']
+    jour = [l for l in lignes if l[0] == 'jour']
+    a_venir = [l for l in lignes if l[0] == 'a_venir']
+    message = ""
 
-    message = "📅 *RAPPEL QUOTIDIEN - RELANCES*\n\n"
-
-    if relances_retard:
+    if retard:
         message += "⚠️ *RELANCES EN RETARD*\n"
-        for r in relances_retard[:5]:
-            rid, cid, date_r, type_r, priorite, statut_r, notes, date_c, date_e, resultat, nom = r
-            message += f"• {nom} - {date_r}\n"
-        if len(relances_retard) > 5:
-            message += f"... et {len(relances_retard)-5} autres\n"
+        for categorie, date_r, nom, total in retard:
+            message += f"• {escape_markdown(nom)} - {date_affichage(date_r)}\n"
+        if retard[0][3] > len(retard):
+            message += f"... et {retard[0][3] - len(retard)} autres\n"
         message += "\n"
 
-    if relances_jour:
+    if jour:
         message += "📅 *AUJOURD'HUI*\n"
-        for r in relances_jour:
-            rid, cid, date_r, type_r, priorite, statut_r, notes, date_c, date_e, resultat, nom = r
-            message += f"• {nom}\n"
+        for categorie, date_r, nom, total in jour:
+            message += f"• {escape_markdown(nom)}\n"
+        if jour[0][3] > len(jour):
+            message += f"... et {jour[0][3] - len(jour)} autres\n"
         message += "\n"
     else:
         message += "✅ Aucune relance aujourd'hui.\n\n"
 
     message += "📋 *PROCHAINS JOURS*\n"
     jours = {}
-    for r in relances_7j:
-        rid, cid, date_r, type_r, priorite, statut_r, notes, date_c, date_e, resultat, nom = r
-        if date_r not in jours:
-            jours[date_r] = []
-        jours[date_r].append(nom)
-
-    for date, noms in list(jours.items())[:5]:
-        message += f"• {date} : {', '.join(noms[:2])}"
-        if len(noms) > 2:
-            message += f" et {len(noms)-2} autres"
+    for categorie, date_r, nom, total in a_venir:
+        jours.setdefault(date_r, ([], total))[0].append(escape_markdown(nom))
+    for date_r, (noms, total) in list(jours.items())[:5]:
+        message += f"• {date_affichage(date_r)} : {', '.join(noms)}"
+        if total > len(noms):
+            message += f" et {total - len(noms)} autres"
         message += "\n"
+    return message
 
-    for tid in ADMIN_IDS:
-        try:
-            await context.bot.send_message(chat_id=tid, text=message, parse_mode='Markdown')
-        except:
-            continue
+async def check_relances_quotidien(context: ContextTypes.DEFAULT_TYPE):
+    """Envoie à chaque agent le récapitulatif de son portefeuille ; les clients
+    sans agent sont résumés aux admins"""
+    debut = perf_counter()
+    lignes = await db.get_resume_quotidien(7)
+    duree_requete = perf_counter() - debut
+
+    portefeuilles = {}
+    destinataires = {}
+    for agent_id, telegram_id, categorie, date_r, nom, total in lignes:
+        portefeuilles.setdefault(agent_id, []).append((categorie, date_r, nom, total))
+        if telegram_id is not None:
+            destinataires[agent_id] = telegram_id
+
+    messages = {}
+    for agent_id, portefeuille in portefeuilles.items():
+        if agent_id in destinataires:
+            messages[destinataires[agent_id]] = ("📅 *RAPPEL QUOTIDIEN - RELANCES*\n\n"
+                                                 + formater_resume(portefeuille))
+    if 0 in portefeuilles:
+        non_assignes = "👥 *CLIENTS NON ASSIGNÉS*\n\n" + formater_resume(portefeuilles[0])
+        for tid in ADMIN_IDS:
+            if tid in messages:
+                messages[tid] += "\n" + non_assignes
+            else:
+                messages[tid] = "📅 *RAPPEL QUOTIDIEN - RELANCES*\n\n" + non_assignes
+    duree_rendu = perf_counter() - debut - duree_requete
+
+    envoyes = await expediteur.diffuser_messages(context.bot, messages.items(), parse_mode='Markdown')
+    logger.info(
+        "Rappel quotidien : %d lignes, %d portefeuilles, %d/%d envoyés ; requête %.3f s, rendu %.3f s, envoi %.3f s (%s)",
+        len(lignes), len(portefeuilles), envoyes, len(messages), duree_requete, duree_rendu,
+        perf_counter() - debut - duree_requete - duree_rendu, expediteur.compteurs())
+
+async def preparer_journee(context: ContextTypes.DEFAULT_TYPE = None):
+    """Crée les relances récurrentes devenues dues puis recalcule les priorités"""
+    creees = await db.materialiser_regles()
+    nb = await db.recalculer_priorites()
+    logger.info("Journée préparée : %d relances récurrentes créées, %d priorités mises à jour", creees, nb)
+
+def debut_mois(jour, mois_avant):
+    """Premier jour du mois, `mois_avant` mois avant celui de `jour`"""
+    annee, mois = divmod(jour.year * 12 + jour.month - 1 - mois_avant, 12)
+    return jour.replace(year=annee, month=mois + 1, day=1)
+
+async def archiver_historique(context: ContextTypes.DEFAULT_TYPE = None):
+    """Archive (compressé) l'historique de plus de RETENTION_HISTORIQUE_MOIS mois,
+    par lots courts, puis rend la place libérée au système"""
+    seuil = debut_mois(datetime.now().date(), RETENTION_HISTORIQUE_MOIS)
+    debut = perf_counter()
+    archivees = 0
+    while True:
+        # Chaque lot est une transaction courte : les écritures des agents passent entre deux
+        nb = await db.archiver_historique(seuil)
+        archivees += nb
+        if nb < Database.TAILLE_LOT_ARCHIVE:
+            break
+        await asyncio.sleep(PAUSE_ARCHIVAGE)
+    pages = 0
+    while (nb := await db.compacter()) > 0:
+        pages += nb
+        await asyncio.sleep(PAUSE_ARCHIVAGE)
+    logger.info("Historique avant le %s : %d entrées archivées, %d pages libérées en %.1f s",
+                seuil, archivees, pages, perf_counter() - debut)
+
+serveur_metriques = None
+
+async def demarrer_planificateur(application):
+    global serveur_metriques
+    # Rattrape la préparation de la journée si le bot était arrêté à minuit
+    await preparer_journee()
+    await planificateur.demarrer(application.job_queue)
+    if metriques.actif and METRIQUES_PORT:
+        serveur_metriques = await servir_prometheus(METRIQUES_HOTE, METRIQUES_PORT, jauges_metriques)
+
+async def fermer_base(application):
+    if serveur_metriques is not None:
+        serveur_metriques.close()
+    db.fermer()
 
 # ---------- Main ----------
-def main():
-    print("🚀 Démarrage du bot...")
-    print(f"🤖 Bot: {BOT_USERNAME}")
-    print(f"👥 Admins: {ADMIN_IDS}")
+# Mode webhook : MODE=webhook, WEBHOOK_URL (URL publique, sans le chemin),
+# WEBHOOK_SECRET (obligatoire), PORT et WEBHOOK_CHEMIN facultatifs.
+# Sans MODE=webhook, le bot interroge Telegram (polling) comme avant.
+MODE_WEBHOOK = os.environ.get('MODE', 'polling') == 'webhook'
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+WEBHOOK_PORT = int(os.environ.get('PORT', '8443'))
+WEBHOOK_CHEMIN = os.environ.get('WEBHOOK_CHEMIN', 'telegram')
+# Mises à jour traitées en parallèle entre agents (1 = une par une) ;
+# celles d'un même agent restent traitées dans l'ordre, une à la fois
+CONCURRENCE = int(os.environ.get('CONCURRENCE', '64'))
+# Métriques (METRIQUES=1) : /metrics pour les admins, et au format Prometheus
+# sur http://METRIQUES_HOTE:METRIQUES_PORT/metrics si un port est donné
+METRIQUES_HOTE = os.environ.get('METRIQUES_HOTE', '127.0.0.1')
+METRIQUES_PORT = int(os.environ.get('METRIQUES_PORT', '0'))
+# Racine de l'API Bot (serveur Bot API local, ou bench/faux_telegram.py pour
+# les essais de charge hors ligne), par défaut celle de Telegram
+API_BOT_URL = os.environ.get('API_BOT_URL')
+# Historique plus ancien que RETENTION_HISTORIQUE_MOIS mois (mois entiers)
+# déplacé chaque nuit dans les archives compressées ; 0 : jamais
+RETENTION_HISTORIQUE_MOIS = int(os.environ.get('RETENTION_HISTORIQUE_MOIS', '24'))
+PAUSE_ARCHIVAGE = 0.05
 
-    app = Application.builder().token(TOKEN).build()
+def construire_application(requete=None):
+    """Construit l'application et enregistre les handlers ; `requete` permet
+    de remplacer la couche HTTP vers l'API Bot (bancs de test hors ligne)."""
+    builder = (Application.builder().token(TOKEN).rate_limiter(expediteur).persistence(SQLitePersistence(db))
+               .post_init(demarrer_planificateur).post_shutdown(fermer_base))
+    if requete is not None:
+        builder = builder.request(requete).get_updates_request(requete)
+    if API_BOT_URL:
+        racine = API_BOT_URL.rstrip('/')
+        builder = builder.base_url(f'{racine}/bot').base_file_url(f'{racine}/file/bot')
+    if CONCURRENCE > 1:
+        builder = builder.concurrent_updates(ProcesseurParUtilisateur(CONCURRENCE))
+    app = builder.build()
 
     # Commandes
     app.add_handler(CommandHandler("start", menu_principal))
+    app.add_handler(CommandHandler("export", commande_export))
+    app.add_handler(CommandHandler("cache", commande_cache))
+    app.add_handler(CommandHandler("metrics", commande_metriques))
 
     # Callbacks
     app.add_handler(CallbackQueryHandler(menu_principal, pattern='^menu_principal$'))
@@ -583,6 +1119,9 @@ def main():
     app.add_handler(CallbackQueryHandler(relances_retard, pattern='^relances_retard$'))
     app.add_handler(CallbackQueryHandler(relances_7j, pattern='^relances_7j$'))
     app.add_handler(CallbackQueryHandler(rechercher, pattern='^rechercher$'))
+    app.add_handler(CallbackQueryHandler(menu_import, pattern='^importer_clients$'))
+    app.add_handler(CallbackQueryHandler(menu_export, pattern='^exporter$'))
+    app.add_handler(CallbackQueryHandler(export_rapide, pattern='^export_'))
     app.add_handler(CallbackQueryHandler(statistiques, pattern='^statistiques$'))
     app.add_handler(CallbackQueryHandler(gestion_admins, pattern='^gestion_admins$'))
     app.add_handler(CallbackQueryHandler(ajouter_admin, pattern='^ajouter_admin$'))
@@ -592,19 +1131,69 @@ def main():
     app.add_handler(CallbackQueryHandler(type_relance_choisi, pattern='^type_relance_'))
     app.add_handler(CallbackQueryHandler(marquer_relance_effectuee, pattern='^marquer_relance_'))
     app.add_handler(CallbackQueryHandler(voir_client, pattern='^voir_client_'))
+    app.add_handler(CallbackQueryHandler(historique_client, pattern='^historique_'))
+    app.add_handler(CallbackQueryHandler(archives_client, pattern='^archives_'))
+    app.add_handler(CallbackQueryHandler(changer_page, pattern='^page_'))
+    app.add_handler(CallbackQueryHandler(selection_debut, pattern='^selection_debut_'))
+    app.add_handler(CallbackQueryHandler(selection_choisir, pattern='^selection_choisir_'))
+    app.add_handler(CallbackQueryHandler(selection_effectuer, pattern='^selection_effectuer$'))
+    app.add_handler(CallbackQueryHandler(selection_reporter, pattern='^selection_reporter$'))
+    app.add_handler(CallbackQueryHandler(selection_reassigner, pattern='^selection_reassigner$'))
+    app.add_handler(CallbackQueryHandler(selection_agent, pattern='^selection_agent_'))
+    app.add_handler(CallbackQueryHandler(selection_fin, pattern='^selection_fin$'))
 
     # Messages texte
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    # Fichiers d'import
+    app.add_handler(MessageHandler(filters.Document.ALL, recevoir_document))
+
+    if metriques.actif:
+        instrumenter_application(app)
 
     # Notifications quotidiennes
     job_queue = app.job_queue
     if job_queue:
         # Envoi à 9h00 chaque jour
         job_queue.run_daily(check_relances_quotidien, time=time(hour=9, minute=0), days=(0,1,2,3,4,5,6))
+        # Relances récurrentes dues et priorités selon l'échéance, juste après minuit
+        job_queue.run_daily(preparer_journee, time=time(hour=0, minute=5))
+        if RETENTION_HISTORIQUE_MOIS > 0:
+            # Archivage de l'historique ancien, en dehors des heures d'activité
+            job_queue.run_daily(archiver_historique, time=time(hour=3, minute=30))
+
+    return app
+
+def main():
+    print("🚀 Démarrage du bot...")
+    print(f"🤖 Bot: {BOT_USERNAME}")
+    print(f"👥 Admins: {ADMIN_IDS}")
+
+    if MODE_WEBHOOK and not WEBHOOK_SECRET:
+        raise SystemExit("❌ WEBHOOK_SECRET est obligatoire en mode webhook")
+    if MODE_WEBHOOK and not WEBHOOK_URL:
+        # Sans URL publique, PTB annoncerait http://0.0.0.0:PORT/... à Telegram, qui la refuse
+        raise SystemExit("❌ WEBHOOK_URL (URL publique du bot) est obligatoire en mode webhook")
+
+    app = construire_application()
 
     print("✅ Bot démarré !")
-    print(f"📱 Allez sur Telegram et tapez /start")
-    app.run_polling()
+    print("📱 Allez sur Telegram et tapez /start")
+    if MODE_WEBHOOK:
+        # Telegram envoie le secret dans l'en-tête X-Telegram-Bot-Api-Secret-Token :
+        # toute requête sans le bon secret est refusée (403). Arrêt propre sur
+        # SIGINT/SIGTERM : les mises à jour en cours se terminent, puis
+        # persistance et base sont fermées.
+        print(f"🌐 Webhook sur le port {WEBHOOK_PORT}, chemin /{WEBHOOK_CHEMIN}")
+        app.run_webhook(
+            listen='0.0.0.0',
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_CHEMIN,
+            secret_token=WEBHOOK_SECRET,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_CHEMIN}",
+            allowed_updates=Update.ALL_TYPES,
+        )
+    else:
+        app.run_polling()
 
 if __name__ == '__main__':
     main()
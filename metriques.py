@@ -0,0 +1,222 @@
+import asyncio
+import functools
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Bornes des histogrammes, en secondes (la dernière classe est +Inf)
+BORNES = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+class Histogramme:
+    __slots__ = ('classes', 'nb', 'somme', 'max')
+
+    def __init__(self):
+        self.classes = [0] * (len(BORNES) + 1)
+        self.nb = 0
+        self.somme = 0.0
+        self.max = 0.0
+
+    def observer(self, duree):
+        i = 0
+        while i < len(BORNES) and duree > BORNES[i]:
+            i += 1
+        self.classes[i] += 1
+        self.nb += 1
+        self.somme += duree
+        if duree > self.max:
+            self.max = duree
+
+    def quantile(self, q):
+        """Borne supérieure de la classe qui contient le quantile `q` (au plus le max)"""
+        rang = q * self.nb
+        cumul = 0
+        for borne, nb in zip(BORNES, self.classes):
+            cumul += nb
+            if cumul >= rang:
+                return min(borne, self.max)
+        return self.max
+
+
+class Metriques:
+    """Histogrammes de latence et compteurs, par famille puis par clé :
+    ('db', nom de méthode), ('handler', motif du callback ou étape),
+    ('api', méthode de l'API Bot)...
+
+    Désactivées (METRIQUES=0, par défaut), rien n'est mesuré : les points
+    d'instrumentation testent `metriques.actif` et passent leur chemin, et
+    ni les curseurs ni les handlers ne sont enveloppés.
+    """
+
+    def __init__(self, actif=False, seuil_lent=0.1):
+        self.actif = actif
+        self.seuil_lent = seuil_lent
+        self._histogrammes = {}
+        self._compteurs = {}
+        self._verrou = threading.Lock()
+
+    def observer(self, famille, cle, duree):
+        with self._verrou:
+            histo = self._histogrammes.get((famille, cle))
+            if histo is None:
+                histo = self._histogrammes[(famille, cle)] = Histogramme()
+            histo.observer(duree)
+
+    def chronometrer(self, famille, cle, fonction, *args, **kwargs):
+        debut = time.perf_counter()
+        try:
+            return fonction(*args, **kwargs)
+        finally:
+            self.observer(famille, cle, time.perf_counter() - debut)
+
+    def incrementer(self, famille, cle, nb=1):
+        with self._verrou:
+            self._compteurs[(famille, cle)] = self._compteurs.get((famille, cle), 0) + nb
+
+    def histogrammes(self, famille):
+        """{cle: Histogramme} d'une famille (copie), du plus coûteux au moins coûteux"""
+        with self._verrou:
+            lignes = [(cle, h) for (f, cle), h in self._histogrammes.items() if f == famille]
+        return dict(sorted(lignes, key=lambda ligne: -ligne[1].somme))
+
+    def compteurs(self, famille):
+        with self._verrou:
+            return {cle: nb for (f, cle), nb in self._compteurs.items() if f == famille}
+
+    def texte_prometheus(self, jauges=None):
+        """Format texte d'exposition Prometheus ; `jauges` : {nom: valeur} en plus"""
+        with self._verrou:
+            histogrammes = sorted(self._histogrammes.items())
+            compteurs = sorted(self._compteurs.items())
+        lignes = []
+        familles_vues = set()
+        for (famille, cle), histo in histogrammes:
+            nom = f'relances_{famille}_secondes'
+            if famille not in familles_vues:
+                familles_vues.add(famille)
+                lignes.append(f'# TYPE {nom} histogram')
+            etiquette = f'cle="{_echapper(cle)}"'
+            cumul = 0
+            for borne, nb in zip(BORNES + ('+Inf',), histo.classes):
+                cumul += nb
+                lignes.append(f'{nom}_bucket{{{etiquette},le="{borne}"}} {cumul}')
+            lignes.append(f'{nom}_sum{{{etiquette}}} {histo.somme:.6f}')
+            lignes.append(f'{nom}_count{{{etiquette}}} {histo.nb}')
+        for (famille, cle), nb in compteurs:
+            nom = f'relances_{famille}_total'
+            if famille not in familles_vues:
+                familles_vues.add(famille)
+                lignes.append(f'# TYPE {nom} counter')
+            lignes.append(f'{nom}{{cle="{_echapper(cle)}"}} {nb}')
+        for nom, valeur in (jauges or {}).items():
+            lignes.append(f'# TYPE relances_{nom} gauge')
+            lignes.append(f'relances_{nom} {valeur}')
+        return '\n'.join(lignes) + '\n'
+
+
+def _echapper(valeur):
+    return str(valeur).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metriques = Metriques(actif=os.environ.get('METRIQUES', '0') == '1',
+                      seuil_lent=float(os.environ.get('METRIQUES_LENT_MS', '100')) / 1000)
+
+
+# ----- Requêtes SQL lentes -----
+class CurseurInstrumente(sqlite3.Cursor):
+    """Curseur qui chronomètre chaque execute() (jusqu'à la première ligne) et
+    journalise, au-delà du seuil, la requête et son EXPLAIN QUERY PLAN.
+    Utilisé par Database seulement quand les métriques sont actives."""
+
+    def execute(self, sql, parametres=()):
+        debut = time.perf_counter()
+        resultat = super().execute(sql, parametres)
+        duree = time.perf_counter() - debut
+        if duree >= metriques.seuil_lent:
+            metriques.incrementer('requetes_lentes', sql.split(None, 1)[0].upper())
+            logger.warning("Requête lente (%.0f ms) : %s\n%s", duree * 1000, ' '.join(sql.split()),
+                           self._plan(sql, parametres))
+        return resultat
+
+    def _plan(self, sql, parametres):
+        if sql.split(None, 1)[0].upper() not in ('SELECT', 'WITH', 'UPDATE', 'INSERT', 'DELETE'):
+            return ''
+        try:
+            plan = self.connection.execute('EXPLAIN QUERY PLAN ' + sql, parametres).fetchall()
+        except sqlite3.Error as e:
+            return f'(plan indisponible : {e})'
+        return '\n'.join(f'  {detail}' for _, _, _, detail in plan)
+
+
+# ----- Handlers -----
+def cle_handler(handler):
+    """Clé de mesure d'un handler : motif du callback, commande, ou nom de la fonction"""
+    motif = getattr(handler, 'pattern', None)
+    if motif is not None:
+        return getattr(motif, 'pattern', str(motif))
+    commandes = getattr(handler, 'commands', None)
+    if commandes:
+        return '/' + min(commandes)
+    return handler.callback.__name__
+
+
+def mesurer_handler(callback, cle, par_etape=False):
+    """Enveloppe un callback de handler ; avec `par_etape` (messages texte), la
+    clé est complétée par l'étape en cours de l'agent (user_data['etape'])"""
+
+    @functools.wraps(callback)
+    async def mesure(update, context):
+        nom = cle
+        if par_etape and context.user_data and context.user_data.get('etape'):
+            nom = f"{cle}:{context.user_data['etape']}"
+        debut = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            metriques.incrementer('handler_erreurs', nom)
+            raise
+        finally:
+            metriques.observer('handler', nom, time.perf_counter() - debut)
+
+    return mesure
+
+
+def instrumenter_application(application):
+    """Enveloppe tous les handlers enregistrés (à appeler après les add_handler)"""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            par_etape = getattr(handler, 'pattern', None) is None and not getattr(handler, 'commands', None)
+            handler.callback = mesurer_handler(handler.callback, cle_handler(handler), par_etape)
+
+
+# ----- Exposition HTTP -----
+async def servir_prometheus(hote, port, jauges=None):
+    """Serveur HTTP minimal : GET /metrics renvoie texte_prometheus().
+    `jauges` est appelée à chaque requête. Renvoie l'asyncio.Server."""
+
+    async def repondre(lecteur, ecrivain):
+        try:
+            ligne = await lecteur.readline()
+            while (await lecteur.readline()).strip():
+                pass
+            chemin = ligne.split()[1] if len(ligne.split()) > 1 else b''
+            if chemin == b'/metrics':
+                corps = metriques.texte_prometheus(jauges() if jauges else None).encode()
+                entete = b'HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+            else:
+                corps = b'not found\n'
+                entete = b'HTTP/1.1 404 Not Found\r\nContent-Type: text/plain\r\n'
+            ecrivain.write(entete + f'Content-Length: {len(corps)}\r\nConnection: close\r\n\r\n'.encode() + corps)
+            await ecrivain.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            ecrivain.close()
+
+    serveur = await asyncio.start_server(repondre, hote, port)
+    logger.info("Métriques Prometheus sur http://%s:%d/metrics", hote, port)
+    return serveur
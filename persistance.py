@@ -0,0 +1,133 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+
+class SQLitePersistence(BasePersistence):
+    """Persistance PTB (user_data, chat_data, bot_data) dans la base SQLite du bot.
+
+    - Écritures regroupées : PTB signale les données modifiées à chaque
+      intervalle ; les états réellement changés sont écrits ensemble, en une
+      seule transaction, par l'écrivain de la base.
+    - Chargement paresseux : rien n'est lu au démarrage pour les utilisateurs
+      et les chats ; l'état d'un utilisateur est lu juste avant de traiter
+      sa mise à jour (refresh_user_data), et relu seulement si une autre
+      instance l'a modifié depuis (numéro de version).
+    """
+
+    def __init__(self, db, update_interval=None):
+        if update_interval is None:
+            update_interval = float(os.environ.get('PERSISTANCE_INTERVALLE', '10'))
+        super().__init__(store_data=PersistenceInput(callback_data=False), update_interval=update_interval)
+        self.db = db
+        self._versions = {}
+        self._derniers = {}
+        self._en_attente = {}
+        self._vidage = None
+
+    # ----- Lecture -----
+    async def get_user_data(self):
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        etat = await self._lire('bot', 0)
+        return etat if etat is not None else {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def _lire(self, type_etat, cle):
+        ligne = await self.db.charger_etat(type_etat, cle, self._versions.get((type_etat, cle), 0))
+        if ligne is None:
+            return None
+        version, donnees = ligne
+        self._versions[(type_etat, cle)] = version
+        self._derniers[(type_etat, cle)] = donnees
+        return json.loads(donnees)
+
+    async def _rafraichir(self, type_etat, cle, donnees):
+        etat = await self._lire(type_etat, cle)
+        if etat is not None:
+            donnees.clear()
+            donnees.update(etat)
+
+    async def refresh_user_data(self, user_id, user_data):
+        await self._rafraichir('user', user_id, user_data)
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        await self._rafraichir('chat', chat_id, chat_data)
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    # ----- Écriture -----
+    def _marquer(self, type_etat, cle, donnees):
+        texte = json.dumps(donnees, ensure_ascii=False, sort_keys=True)
+        precedent = self._derniers.get((type_etat, cle))
+        if precedent == texte or (precedent is None and not donnees):
+            return
+        # Version = horodatage : la plus récente des instances l'emporte
+        version = time.time_ns()
+        self._versions[(type_etat, cle)] = version
+        self._derniers[(type_etat, cle)] = texte
+        self._en_attente[(type_etat, cle)] = (type_etat, cle, texte, version)
+        if self._vidage is None:
+            # Tous les états marqués pendant ce tour de boucle partent ensemble
+            self._vidage = asyncio.get_running_loop().create_task(self._vider())
+
+    async def _vider(self):
+        await asyncio.sleep(0)
+        lignes = list(self._en_attente.values())
+        self._en_attente.clear()
+        self._vidage = None
+        if lignes:
+            try:
+                await self.db.enregistrer_etats(lignes)
+            except Exception:
+                logger.exception("Échec de l'enregistrement de %d états", len(lignes))
+                for type_etat, cle, _, _ in lignes:
+                    self._derniers.pop((type_etat, cle), None)
+
+    async def update_user_data(self, user_id, data):
+        self._marquer('user', user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._marquer('chat', chat_id, data)
+
+    async def update_bot_data(self, data):
+        self._marquer('bot', 0, data)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    async def drop_user_data(self, user_id):
+        await self._supprimer('user', user_id)
+
+    async def drop_chat_data(self, chat_id):
+        await self._supprimer('chat', chat_id)
+
+    async def _supprimer(self, type_etat, cle):
+        self._en_attente.pop((type_etat, cle), None)
+        self._versions.pop((type_etat, cle), None)
+        self._derniers.pop((type_etat, cle), None)
+        await self.db.supprimer_etat(type_etat, cle)
+
+    async def flush(self):
+        if self._vidage is not None:
+            await self._vidage
+        await self._vider()
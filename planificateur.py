@@ -0,0 +1,103 @@
+import logging
+import os
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.helpers import escape_markdown
+
+logger = logging.getLogger(__name__)
+
+# Les heures de relance sont saisies en heure locale de l'agence
+FUSEAU = ZoneInfo(os.environ.get('FUSEAU_HORAIRE', 'Europe/Paris'))
+
+
+class PlanificateurRelances:
+    """Programme un job `run_once` par relance à heure fixe.
+
+    Seule une fenêtre glissante (par défaut les 6 prochaines heures) est
+    chargée, par une requête sur l'index des relances horaires ; un job de
+    rechargement charge la fenêtre suivante juste avant la fin de la
+    précédente. Création, clôture et report d'une relance mettent à jour son
+    job individuellement : la table relances n'est jamais parcourue en entier.
+    """
+
+    def __init__(self, db, destinataires_par_defaut=(), fenetre=timedelta(hours=6)):
+        self.db = db
+        self.destinataires_par_defaut = destinataires_par_defaut
+        self.fenetre = fenetre
+        self.job_queue = None
+        self.fin_fenetre = None
+        self._jobs = {}
+
+    async def demarrer(self, job_queue):
+        if job_queue is None:
+            logger.warning("JobQueue indisponible : rappels à heure fixe désactivés")
+            return
+        self.job_queue = job_queue
+        maintenant = datetime.now(FUSEAU).replace(second=0, microsecond=0, tzinfo=None)
+        # On reprend à la minute en cours : une relance de cette minute, déjà
+        # passée de quelques secondes, part tout de suite (voir _programmer)
+        await self._charger(maintenant - timedelta(minutes=1), maintenant + self.fenetre)
+
+    async def _charger(self, debut, fin):
+        relances = await self.db.get_relances_horaires(debut, fin)
+        for relance in relances:
+            self._programmer(relance)
+        self.fin_fenetre = fin
+        self.job_queue.run_once(self._recharger, self._heure_locale(fin) - timedelta(minutes=1),
+                                name='recharger_relances')
+        logger.info("Planificateur : %d relances programmées jusqu'à %s", len(relances), fin)
+
+    async def _recharger(self, context):
+        await self._charger(self.fin_fenetre, self.fin_fenetre + self.fenetre)
+
+    def _heure_locale(self, moment):
+        return moment.replace(tzinfo=FUSEAU)
+
+    def _programmer(self, relance):
+        rid, cid, date_r, heure, nom, telegram_id = relance
+        self.annuler(rid)
+        echeance = datetime.fromisoformat(f'{date_r}T{heure}')
+        # Tolérance de retard d'APScheduler (1 s par défaut) portée à une minute :
+        # au démarrage, une échéance de la minute en cours est déjà passée et
+        # serait sinon abandonnée comme « manquée »
+        self._jobs[rid] = self.job_queue.run_once(
+            self._notifier, self._heure_locale(echeance), data=relance, name=f'relance_{rid}',
+            job_kwargs={'misfire_grace_time': 60})
+
+    def annuler(self, relance_id):
+        job = self._jobs.pop(relance_id, None)
+        if job is not None:
+            job.schedule_removal()
+
+    async def relance_modifiee(self, relance_id):
+        """À appeler après création, report ou clôture d'une relance"""
+        if self.job_queue is None:
+            return
+        relance = await self.db.get_relance_horaire(relance_id)
+        if relance is None:
+            self.annuler(relance_id)
+            return
+        echeance = datetime.fromisoformat(f'{relance[2]}T{relance[3]}')
+        maintenant = datetime.now(FUSEAU).replace(tzinfo=None)
+        if maintenant < echeance <= self.fin_fenetre:
+            self._programmer(relance)
+        else:
+            # Déjà passée, ou au-delà de la fenêtre (le prochain rechargement la prendra)
+            self.annuler(relance_id)
+
+    async def _notifier(self, context):
+        rid, cid, date_r, heure, nom, telegram_id = context.job.data
+        self._jobs.pop(rid, None)
+        destinataires = [telegram_id] if telegram_id else list(self.destinataires_par_defaut)
+        keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton("✅ MARQUER EFFECTUÉE", callback_data=f'marquer_relance_{rid}_{cid}')],
+            [InlineKeyboardButton("📋 VOIR FICHE", callback_data=f'voir_client_{cid}')],
+        ])
+        for chat_id in destinataires:
+            try:
+                await context.bot.send_message(chat_id=chat_id, text=f"⏰ *Relance à {heure}* : {escape_markdown(nom)}",
+                                               reply_markup=keyboard, parse_mode='Markdown')
+            except Exception as e:
+                logger.warning("Rappel de la relance %s à %s impossible : %s", rid, chat_id, e)